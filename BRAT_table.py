@@ -15,9 +15,16 @@ import os
 import sys
 import datetime
 import time
+import numpy as np
 import FindBraidedNetwork
 import BRAT_Braid_Handler
-from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path
+import Raster_Sampler
+import Zonal_Statistics
+import DEM_Processing
+import Flow_Routing
+import Feature_Distance
+from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path, \
+    write_fields_by_reach_id
 import XMLBuilder
 import SupportingFunctions
 
@@ -26,6 +33,11 @@ XMLBuilder = XMLBuilder.XMLBuilder
 
 reload(FindBraidedNetwork)
 reload(BRAT_Braid_Handler)
+reload(Raster_Sampler)
+reload(Zonal_Statistics)
+reload(DEM_Processing)
+reload(Flow_Routing)
+reload(Feature_Distance)
 
 
 def main(
@@ -47,7 +59,8 @@ def main(
     find_clusters,
     should_segment_network,
     segment_by_ownership,
-    is_verbose):
+    is_verbose,
+    check_distances=None):
 
     """
     Calculates, for each stream network segment, the attributes needed to trun the BRAT tools.
@@ -70,6 +83,8 @@ def main(
     :param should_segment_network: If true, this option divides reaches based on the roads input.
     :param segment_by_ownership: If true, this option divides reaches based on the land ownership input.
     :param is_verbose:  If true, this option enables ArcMap to provide messages for each step conducted by the tool.
+    :param check_distances: If true, the iPC distances are also calculated from distance rasters, and reaches where
+        the two methods differ are reported
     :return:
     """
 
@@ -82,6 +97,7 @@ def main(
     should_segment_network = parse_input_bool(should_segment_network)
     segment_by_ownership = parse_input_bool(segment_by_ownership)
     is_verbose = parse_input_bool(is_verbose)
+    check_distances = parse_input_bool(check_distances)
 
     scratch = 'in_memory'
     #arcpy.env.workspace = scratch
@@ -144,7 +160,8 @@ def main(
 
     # run vegetation attributes function
     arcpy.AddMessage('Adding "iVeg" attributes to network...')
-    iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, seg_network_copy, scratch, is_verbose)
+    landuse_histogram = iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, seg_network_copy, scratch, is_verbose,
+                                        landuse)
 
     # find points of diversion if canals are defined
     if canal is not None:
@@ -155,7 +172,11 @@ def main(
     # run ipc attributes function if conflict layers are defined by user
     if road is not None and valley_bottom is not None:
         arcpy.AddMessage('Adding "iPC" attributes to network...')
-        ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, ownership, diversion_pts, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose)
+        ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, ownership, diversion_pts, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose,
+                       check_distances, landuse_histogram)
+
+    # the buffers' cells were reused by every zonal statistic, and aren't needed any more
+    Zonal_Statistics.clear_zone_cells()
 
     if perennial_network is not None:
         find_is_perennial(seg_network_copy, perennial_network)
@@ -385,7 +406,7 @@ def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_fi
     Calculate zonal statistics within buffer function
     :param buffer: The buffer around the stream
     :param ras: The DEM raster
-    :param stat_type: The type of statistic to be calculated (MAXIMUM, MINIMUM, etc.)
+    :param stat_type: The type of statistic to be calculated (MAXIMUM, MINIMUM, or MEAN)
     :param stat_field: The name of the field containing statistics to be calculated
     :param out_fc: The feature class to output to.
     :param out_FC_field: The field within the output feature class to output to.
@@ -393,87 +414,19 @@ def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_fi
     :return:
     """
     # get input raster stat value within each buffer
-    # note: zonal stats as table does not support overlapping polygons so we will check which
-    #       reach buffers output was produced for and which we need to run tool on again
-    stat_tbl = arcpy.sa.ZonalStatisticsAsTable(buffer, 'ReachID', ras, os.path.join(scratch, 'statTbl'), 'DATA', stat_type)
-
-    # get list of segment buffers where zonal stats tool produced output
-    have_stat_list = [row[0] for row in arcpy.da.SearchCursor(stat_tbl, 'ReachID')]
-    # create dictionary to hold all reach buffer min dem z values
-    stat_dict = {}
-    # add buffer raster stat values to dictionary
-    with arcpy.da.SearchCursor(stat_tbl, ['ReachID', stat_field]) as cursor:
-        for row in cursor:
-            stat_dict[row[0]] = row[1]
-    # create list of overlapping buffer reaches (i.e., where zonal stats tool did not produce output)
-    need_stat_list = []
-    with arcpy.da.SearchCursor(buffer, ['ReachID']) as cursor:
-        for row in cursor:
-            if row[0] not in have_stat_list:
-                need_stat_list.append(row[0])
-    # run zonal stats until we have output for each overlapping buffer segment
-    stat = None
-    tmp_buff_lyr = None
-    num_broken_repetitions = 0
-    BROKEN_REPS_ALLOWED = 5
-    while len(need_stat_list) > 0:
-        # create tuple of segment ids where still need raster values
-        need_stat = ()
-        for reach in need_stat_list:
-            if reach not in need_stat:
-                need_stat += (reach,)
-        # use the segment id tuple to create selection query and run zonal stats tool
-        if len(need_stat) == 1:
-            quer = '"ReachID" = ' + str(need_stat[0])
-        else:
-            quer = '"ReachID" IN ' + str(need_stat)
-        tmp_buff_lyr = arcpy.MakeFeatureLayer_management(buffer, 'tmp_buff_lyr')
-        arcpy.SelectLayerByAttribute_management(tmp_buff_lyr, 'NEW_SELECTION', quer)
-        stat = arcpy.sa.ZonalStatisticsAsTable(tmp_buff_lyr, 'ReachID', ras, os.path.join(scratch, 'stat'), 'DATA', stat_type)
-        # add segment stat values from zonal stats table to main dictionary
-        with arcpy.da.SearchCursor(stat, ['ReachID', stat_field]) as cursor:
-            for row in cursor:
-                stat_dict[row[0]] = row[1]
-        # create list of reaches that were run and remove from 'need to run' list
-        have_stat_list2 = [row[0] for row in arcpy.da.SearchCursor(stat, 'ReachID')]
-
-        if len(have_stat_list2) == 0:
-            num_broken_repetitions += 1
-            if num_broken_repetitions >= BROKEN_REPS_ALLOWED:
-                warning_message = "While calculating " + out_FC_field + ", the tool ran into an error. The following "
-                warning_message += "ReachIDs did not recieve correct values:\n"
-                for reach_id in need_stat_list:
-                    if reach_id == need_stat_list[-1]:
-                        warning_message += "and "
-                    warning_message += str(reach_id)
-                    if reach_id != need_stat_list[-1]:
-                        warning_message += ", "
-                warning_message += "\n"
-                arcpy.AddWarning(warning_message)
-                for reach_id in need_stat_list:
-                    stat_dict[reach_id] = 0
-                need_stat_list = []
-        for reach in have_stat_list2:
-            need_stat_list.remove(reach)
-
-    # populate dictionary value to output field by ReachID
-    with arcpy.da.UpdateCursor(out_fc, ['ReachID', out_FC_field]) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = stat_dict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    stat_dict.clear()
-
-    # delete temp fcs, tbls, etc.
-    #items = [statTbl, haveStatList, haveStatList2, needStatList, stat, tmp_buff_lyr, needStat]
-    items = [stat_tbl, stat, tmp_buff_lyr]
-    for item in items:
-        if item is not None:
-            arcpy.Delete_management(item)
+    # note: each buffer is rasterized on its own, so overlapping buffers all get values in one pass
+    reach_ids, stats = Zonal_Statistics.zonal_statistics(buffer, ras, [stat_type], 'ReachID')
+    values = stats[stat_type]
 
+    # populate stat values to output field by ReachID. Buffers with no data get 0, as they did when the zonal
+    # statistics table was joined to the network, so the stages after this never see a null
+    no_data = np.isnan(values)
+    if no_data.any():
+        no_data_ids = reach_ids[no_data].tolist()
+        arcpy.AddWarning(str(len(no_data_ids)) + " reaches have no data in their buffer, so their " + out_FC_field +
+                         " was set to 0: " + ", ".join(str(reach_id) for reach_id in no_data_ids[:10]) +
+                         (", ..." if len(no_data_ids) > 10 else ""))
+    write_fields_by_reach_id(out_fc, reach_ids, [(out_FC_field, np.where(no_data, 0.0, values))])
 
 
 def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose):
@@ -509,52 +462,29 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     arcpy.env.extent = desc.Extent
     arcpy.env.outputCoordinateSystem = desc.SpatialReference
     arcpy.env.cellSize = desc.meanCellWidth
-    # calculate mean z over 3x3 cell window
-    neighborhood = NbrRectangle(3, 3, "CELL")
-    tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
-    # clip smoothed dem to input dem
-    DEM = ExtractByMask(tmp_dem, in_DEM)
-
-    # function to attribute start/end elevation (dem z) to each flowline segment
-    def zSeg(vertex_type, out_field):
-        if is_verbose:
-            arcpy.AddMessage("Calculating values for " + out_field + "...")
-        # create start/end points for each flowline reach segment
-        tmp_pts = os.path.join(scratch, 'tmp_pts')
-        arcpy.FeatureVerticesToPoints_management(out_network, tmp_pts, vertex_type)
-        # create 30 meter buffer around each start/end point
-        tmp_buff = os.path.join(scratch, 'tmp_buff')
-        arcpy.Buffer_analysis(tmp_pts, tmp_buff, '30 Meters')
-        # get min dem z value within each buffer
-        arcpy.AddField_management(out_network, out_field, "DOUBLE")
-        zonalStatsWithinBuffer(tmp_buff, DEM, 'MINIMUM', 'MIN', out_network, out_field, scratch)
-
-        # delete temp fcs, tbls, etc.
-        items = [tmp_pts, tmp_buff]
-        for item in items:
-            arcpy.Delete_management(item)
-
-    # run zSeg function for start/end of each network segment
-    zSeg('START', 'iGeo_ElMax')
-    zSeg('END', 'iGeo_ElMin')
+    # calculate mean z over 3x3 cell window, one block at a time as the dem is read
+    smoothed_dem = DEM_Processing.SmoothedRasterSampler(in_DEM)
 
-    # calculate network reach slope
+    # calculate network reach length
     arcpy.AddField_management(out_network, "iGeo_Len", "DOUBLE")
     arcpy.CalculateField_management(out_network, "iGeo_Len", '!shape.length@meters!', "PYTHON_9.3")
-    arcpy.AddField_management(out_network, "iGeo_Slope", "DOUBLE")
-    with arcpy.da.UpdateCursor(out_network, ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope"]) as cursor:
-        if is_verbose:
-            arcpy.AddMessage("Calculating iGeo_Slope...")
-        for row in cursor:
-            row[3] = (abs(row[0] - row[1]))/row[2]
-            if row[3] == 0.0:
-                row[3] = 0.0001
-            cursor.updateRow(row)
+
+    # attribute start/end elevation (min dem z within 30 m) and slope to each flowline segment
+    if is_verbose:
+        arcpy.AddMessage("Calculating values for iGeo_ElMax, iGeo_ElMin and iGeo_Slope...")
+    add_end_elevations(out_network, smoothed_dem, 30)
 
     # get DA values
     if flow_acc is None:
         arcpy.AddMessage("Calculating drainage area...")
-        calc_drain_area(DEM, in_DEM)
+        if smoothed_dem.num_rows * smoothed_dem.num_cols <= Flow_Routing.MAX_ROUTED_CELLS:
+            # fill the smoothed dem's sinks, then route flow over it
+            filled_dem = DEM_Processing.FilledDEM(smoothed_dem)
+            calc_drain_area(filled_dem, in_DEM)
+        else:
+            arcpy.AddWarning("The DEM has more than " + str(Flow_Routing.MAX_ROUTED_CELLS) + " cells, so its " +
+                             "drainage area is calculated with Spatial Analyst instead")
+            calc_drain_area_spatial_analyst(in_DEM)
     elif not os.path.exists(os.path.dirname(in_DEM) + "/Flow"): # if there's no folder for the flow accumulation, make one
         os.mkdir(os.path.dirname(in_DEM) + "/Flow")
         if is_verbose:
@@ -581,9 +511,56 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     return DrArea
 
 
-def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scratch, is_verbose):
+def add_end_elevations(out_network, dem, radius):
+    """
+    Adds the lowest elevation within a distance of the start and end of each reach, as iGeo_ElMax and iGeo_ElMin, and
+    the slope between them over the reach's iGeo_Len as iGeo_Slope. The DEM is sampled straight from the reach end
+    points, reading only the parts of it the reaches are in
+    :param out_network: The output network to add fields to, which must already have iGeo_Len
+    :param dem: The DEM raster, or a RasterSampler of it
+    :param radius: The distance around each end point to search, in meters
+    :return:
     """
-    Calculates both existing and potential mean vegetation value within 30 m and 100 m buffer of each stream segment
+    if isinstance(dem, Raster_Sampler.RasterSampler):
+        sampler = dem
+    else:
+        sampler = Raster_Sampler.RasterSampler(dem)
+    reach_ids, reach_points = Raster_Sampler.find_reach_points(out_network, sampler.spatial_reference)
+    start, end = reach_points[0], reach_points[2]
+    map_radius = radius / sampler.spatial_reference.metersPerUnit
+
+    el_max = sampler.sample(start[0], start[1], map_radius, 'MINIMUM')
+    el_min = sampler.sample(end[0], end[1], map_radius, 'MINIMUM')
+
+    lengths = {}
+    with arcpy.da.SearchCursor(out_network, ["ReachID", "iGeo_Len"]) as cursor:
+        for row in cursor:
+            lengths[row[0]] = row[1]
+    reach_lengths = np.array([lengths[reach_id] for reach_id in reach_ids.tolist()], np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.abs(el_max - el_min) / reach_lengths
+
+    # reaches with no DEM data around an end have no elevation there, so they get the lowest slope, as do flat reaches
+    no_elevation = np.isnan(el_max) | np.isnan(el_min)
+    slope[no_elevation | (slope == 0.0)] = 0.0001
+    if np.any(no_elevation):
+        no_elevation_ids = reach_ids[no_elevation].tolist()
+        arcpy.AddWarning(str(len(no_elevation_ids)) + " reaches have no DEM data within " + str(radius) + " m of " +
+                         "an end, so their iGeo_ElMax or iGeo_ElMin is null and their iGeo_Slope was set to 0.0001: " +
+                         ", ".join(str(reach_id) for reach_id in no_elevation_ids[:10]) +
+                         (", ..." if len(no_elevation_ids) > 10 else ""))
+
+    write_fields_by_reach_id(out_network, reach_ids,
+                             [("iGeo_ElMax", np.where(np.isnan(el_max), None, el_max)),
+                              ("iGeo_ElMin", np.where(np.isnan(el_min), None, el_min)),
+                              ("iGeo_Slope", slope)])
+
+
+def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scratch, is_verbose, landuse=None):
+    """
+    Calculates both existing and potential mean vegetation value within 30 m and 100 m buffer of each stream segment,
+    and the mean landuse value within the 100 m buffer if there is a landuse raster. Every raster is read once, for
+    both buffers, and the landuse raster's values are counted in the same pass
     :param coded_veg: The coded existing vegetation raster
     :param coded_hist: The coded historic vegetation raster
     :param buf_100m: The 100m stream buffer
@@ -591,61 +568,88 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
     :param out_network: The output network that data will be added to.
     :param scratch: The current workspace
     :param is_verbose: If true, this option enables ArcMap to provide messages for each step conducted by the tool.
-    :return:
+    :param landuse: The landuse raster, or None
+    :return: The landuse histogram of the 100 m buffers (see Zonal_Statistics.zonal_histogram), for the landuse class
+        percentages, or None if there is no landuse raster
     """
     # if fields already exist, delete them
     fields = [f.name for f in arcpy.ListFields(out_network)]
-    drop = ["iVeg_100EX", "iVeg_30EX", "iVeg100Hpe", "iVeg_30Hpe"]
+    drop = ["iVeg100EX", "iVeg_30EX", "iVeg100Hpe", "iVeg_30Hpe", "iPC_LU"]
     for field in fields:
         if field in drop:
             arcpy.DeleteField_management(out_network, field)
 
-    # --existing vegetation values--
+    # --existing and historic (i.e., potential) vegetation values--
     if is_verbose:
-        arcpy.AddMessage("Creating current veg lookup raster...")
+        arcpy.AddMessage("Creating veg lookup rasters...")
     veg_lookup = Lookup(coded_veg, "VEG_CODE")
-    # add mean veg value 'iVeg100EX' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg100EX", "DOUBLE")
-    # get mean existing veg value within 100 m buffer
-    if is_verbose:
-        arcpy.AddMessage("Calculating iVeg100EX...")
-    zonalStatsWithinBuffer(buf_100m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg100EX", scratch)
+    hist_veg_lookup = Lookup(coded_hist, "VEG_CODE")
+    requests = [("iVeg100EX", buf_100m, veg_lookup, 'MEAN'),
+                ("iVeg_30EX", buf_30m, veg_lookup, 'MEAN'),
+                ("iVeg100Hpe", buf_100m, hist_veg_lookup, 'MEAN'),
+                ("iVeg_30Hpe", buf_30m, hist_veg_lookup, 'MEAN')]
+    lookups = [veg_lookup, hist_veg_lookup]
+    fields = [request[0] for request in requests]
+
+    # --mean landuse value ('iPC_LU')--
+    # the cells of each landuse value are counted in each buffer, weighting the cells on its edge by how much of them
+    # it covers, and the mean is found from the counts. The class percentages use the same counts, so the landuse
+    # raster is only read once, and the buffers only rasterized once on its grid
+    if landuse is not None:
+        requests.append(("landuse", buf_100m, landuse, 'HISTOGRAM', True))
+        fields.append("iPC_LU")
 
-    # add mean veg value 'iVeg_VT30EX' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg_30EX", "DOUBLE")
-    # get mean existing veg value within 30 m buffer
+    # get mean values within each buffer
     if is_verbose:
-        arcpy.AddMessage("Calculating iVeg_30EX...")
-    zonalStatsWithinBuffer(buf_30m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30EX", scratch)
+        arcpy.AddMessage("Calculating " + ", ".join(fields) + "...")
+    results = Zonal_Statistics.multi_zonal_statistics(requests)
+    landuse_histogram = None
+    if landuse is not None:
+        landuse_histogram = results.pop("landuse")
+        zone_ids, (lu_values, lu_counts, lu_totals) = landuse_histogram
+        results["iPC_LU"] = (zone_ids, landuse_mean(landuse, lu_values, lu_counts))
+
+    # populate all of the values to the output fields by ReachID, leaving buffers with no data null
+    reach_ids = np.unique(np.concatenate([results[field][0] for field in fields]))
+    field_arrays = []
+    for field in fields:
+        zone_ids, values = results[field]
+        field_values = np.full(len(reach_ids), np.nan)
+        field_values[np.searchsorted(reach_ids, zone_ids)] = values
+        field_arrays.append((field, np.where(np.isnan(field_values), None, field_values)))
+    write_fields_by_reach_id(out_network, reach_ids, field_arrays)
 
     # delete temp fcs, tbls, etc.
-    items = [veg_lookup]
-    for item in items:
+    for item in lookups:
         arcpy.Delete_management(item)
 
-    # --historic (i.e., potential) vegetation values--
-    if is_verbose:
-        arcpy.AddMessage("Creating historic veg lookup raster...")
-    hist_veg_lookup = Lookup(coded_hist, "VEG_CODE")
+    return landuse_histogram
 
-    # add mean veg value 'iVeg100Hpe' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg100Hpe", "DOUBLE")
-    # get mean potential veg value within 100 m buffer
-    if is_verbose:
-        arcpy.AddMessage("Calculating iVeg100Hpe...")
-    zonalStatsWithinBuffer(buf_100m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg100Hpe", scratch)
 
-    # add mean veg value 'iVeg_30Hpe' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg_30Hpe", "DOUBLE")
-    # get mean potential veg value within 30 m buffer
-    if is_verbose:
-        arcpy.AddMessage("Calculating iVeg_30Hpe...")
-    zonalStatsWithinBuffer(buf_30m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30Hpe", scratch)
+def landuse_mean(landuse, values, counts):
+    """
+    Finds the mean landuse code of each buffer from how many cells of each landuse raster value it has
+    :param landuse: The landuse raster, with a LU_CODE field
+    :param values: Array of the raster values counted
+    :param counts: 2D array of the (weighted) count of each value's cells in each buffer, with a row for each buffer
+        and a column for each value
+    :return: Array of the mean LU_CODE of each buffer, NaN for buffers with no cells with a code
+    """
+    fields = [f.name for f in arcpy.ListFields(landuse)]
+    if "LU_CODE" not in [field.upper() for field in fields]:
+        raise Exception("No field named \"LU_CODE\" in the land use raster")
+    lu_code_field = fields[[field.upper() for field in fields].index("LU_CODE")]
+    value_codes = {}
+    with arcpy.da.SearchCursor(landuse, ['Value', lu_code_field]) as cursor:
+        for row in cursor:
+            value_codes[row[0]] = row[1]
 
-    # delete temp fcs, tbls, etc.
-    items = [hist_veg_lookup]
-    for item in items:
-        arcpy.Delete_management(item)
+    # values without a code are left out, like the NoData cells of a lookup raster
+    codes = np.array([value_codes.get(int(value)) for value in values.tolist()], dtype=np.float64)
+    has_code = ~np.isnan(codes)
+    total_counts = counts[:, has_code].sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_counts > 0, counts[:, has_code].dot(codes[has_code]) / total_counts, np.nan)
 
 
 def find_points_of_diversion(canal, network, perennial_network, proj_path, is_verbose):
@@ -696,7 +700,7 @@ def find_points_of_diversion(canal, network, perennial_network, proj_path, is_ve
 
         
 
-def ipc_attributes(out_network, road, railroad, canal, valley_bottom, ownership, diversion_points, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose):
+def ipc_attributes(out_network, road, railroad, canal, valley_bottom, ownership, diversion_points, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose, check_distances=False, landuse_histogram=None):
     """
     Calculates distances from road intersections, adjacent roads, railroads and canals for each flowline segment
     :param out_network: The output network where fields will be added
@@ -712,6 +716,10 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, ownership,
     :param projPath: The file path to the project folder
     :param is_verbose: If true, this option enables ArcMap to provide messages for each step conducted by the tool.
     :param perennial_network: The perennial network shapefile
+    :param check_distances: If true, the distances are also calculated from distance rasters, and how much they differ
+        is reported
+    :param landuse_histogram: The landuse histogram of the 100m stream buffers returned by iveg_attributes. If None,
+        it is found from the landuse raster
     :return:
     """
     # find temp directory, or make if not present
@@ -721,32 +729,33 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, ownership,
         
     # if fields already exist, delete them
     fields = [f.name for f in arcpy.ListFields(out_network)]
-    drop = ["iPC_RoadX", "iPC_Road", "iPC_RoadVB", "iPC_Rail", "iPC_RailVB", "iPC_Canal", "iPC_DivPts", "iPC_LU", "iPC_Privat", "ADMIN_AGEN"]
+    drop = ["iPC_RoadX", "iPC_Road", "iPC_RoadVB", "iPC_Rail", "iPC_RailVB", "iPC_Canal", "iPC_DivPts", "iPC_Privat", "ADMIN_AGEN"]
     for field in fields:
         if field in drop:
             arcpy.DeleteField_management(out_network, field)
 
-    # calculate mean distance from road-stream crossings ('iPC_RoadX'), roads ('iPC_Road') and roads clipped to the valley bottom ('iPC_RoadVB')
+    # (field, features, statistic) for each distance field, which are all calculated together at the end
+    distance_layers = []
+
+    # calculate min distance from road-stream crossings ('iPC_RoadX'), and mean distance from roads ('iPC_Road') and roads clipped to the valley bottom ('iPC_RoadVB')
     if road is not None:
         road_crossings = temp_dir + "\\roadx.shp"
         # create points at road-stream intersections
         arcpy.Intersect_analysis([out_network, road], road_crossings, "", "", "POINT")
-        find_distance_from_feature(out_network, road_crossings, valley_bottom, temp_dir, buf_30m, "roadx", "iPC_RoadX", scratch, is_verbose, clip_feature = False)
-
-    if road is not None:
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "roadvb", "iPC_RoadVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "road", "iPC_Road", scratch, is_verbose, clip_feature = False)
+        distance_layers.append(("iPC_RoadX", road_crossings, 'MINIMUM'))
+        distance_layers.append(("iPC_RoadVB", clip_to_valley_bottom(road, valley_bottom, temp_dir, "roadvb"), 'MEAN'))
+        distance_layers.append(("iPC_Road", road, 'MEAN'))
 
     if railroad is not None:
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroadvb", "iPC_RailVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroad", "iPC_Rail", scratch, is_verbose, clip_feature = False)
+        distance_layers.append(("iPC_RailVB", clip_to_valley_bottom(railroad, valley_bottom, temp_dir, "railroadvb"), 'MEAN'))
+        distance_layers.append(("iPC_Rail", railroad, 'MEAN'))
 
     if canal is not None:
         # find distance from canal
-        find_distance_from_feature(out_network, canal, valley_bottom, temp_dir, buf_30m, "canal", "iPC_Canal", scratch, is_verbose, clip_feature=False)
+        distance_layers.append(("iPC_Canal", canal, 'MEAN'))
     if diversion_points is not None:
         # calculate distance from points of diversion
-        find_distance_from_feature(out_network, diversion_points, valley_bottom, temp_dir, buf_30m, "diversion", "iPC_DivPts", scratch, is_verbose, clip_feature = False)
+        distance_layers.append(("iPC_DivPts", diversion_points, 'MEAN'))
 
     # assign land ownership agency to each reach
     if ownership is not None:
@@ -777,11 +786,16 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, ownership,
         private_lyr = arcpy.MakeFeatureLayer_management(ownership, "private_lyr")
         arcpy.SelectLayerByAttribute_management(private_lyr, 'NEW_SELECTION', """ "ADMIN_AGEN" = 'PVT' OR "ADMIN_AGEN" = 'UND' """)
         arcpy.CopyFeatures_management(private_lyr, private)
-        find_distance_from_feature(out_network, private, valley_bottom, temp_dir, buf_30m, "private_land", "iPC_Privat", scratch, is_verbose, clip_feature=False)
+        distance_layers.append(("iPC_Privat", private, 'MEAN'))
+
+    add_distances_from_features(out_network, distance_layers, buf_30m, temp_dir, scratch, is_verbose, check_distances)
     
-    # calculate mean landuse value ('iPC_LU')
+    # calculate landuse class proportions (the mean landuse value 'iPC_LU' is added with the iVeg attributes)
     if landuse is not None:
-        add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose)
+        if landuse_histogram is None:
+            landuse_histogram = Zonal_Statistics.multi_zonal_statistics([("landuse", buf_100m, landuse, 'HISTOGRAM',
+                                                                          True)])["landuse"]
+        add_landuse_to_table(out_network, landuse, landuse_histogram, is_verbose)
 
     add_min_distance(out_network)
 
@@ -824,107 +838,115 @@ def add_min_distance(out_network):
             cursor.updateRow(row)
 
 
-def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
+def add_landuse_to_table(out_network, landuse, landuse_histogram, is_verbose):
     """
-    Adds landuse fields to the output network[iPC_LU, "iPC_VLowLU", "iPC_LowLU", "iPC_ModLU", "iPC_HighLU"]
+    Adds landuse class fields to the output network["iPC_VLowLU", "iPC_LowLU", "iPC_ModLU", "iPC_HighLU"]. The mean
+    landuse value, iPC_LU, is added by iveg_attributes
     :param out_network: Output network to add fields to.
     :param landuse: The landuse raster.
-    :param buf_100m: The 100m stream buffer
-    :param scratch: Th current workspace
+    :param landuse_histogram: The landuse histogram of the 100m stream buffers, from iveg_attributes
     :param is_verbose: If true, this option enables ArcMap to provide messages for each step conducted by the tool.
     :return:
     """
     if is_verbose:
-        arcpy.AddMessage("Calculating iPC_LU values...")
-    arcpy.AddField_management(out_network, "iPC_LU", "DOUBLE")
-    # create raster with just landuse code values
-    lu_ras = Lookup(landuse, "LU_CODE")
-    # calculate mean landuse value within 100 m buffer of each network segment
-    zonalStatsWithinBuffer(buf_100m, lu_ras, 'MEAN', 'MEAN', out_network, "iPC_LU", scratch)
+        arcpy.AddMessage("Calculating landuse class percentages...")
     # get percentage of each land use class in 100 m buffer of stream segment
-    fields = [f.name.upper() for f in arcpy.ListFields(landuse)]
+    fields = [f.name for f in arcpy.ListFields(landuse)]
 
-    if "LUI_CLASS" not in fields:
+    if "LUI_CLASS" not in [field.upper() for field in fields]:
         arcpy.AddWarning("No field named \"LU_CLASS\" in the land use raster. Make sure that this field exists" +
                          " with no typos if you wish to use the data from the land use raster")
         return
+    lui_class_field = fields[[field.upper() for field in fields].index("LUI_CLASS")]
 
-    buf_fields = [f.name for f in arcpy.ListFields(buf_100m)]
-    if 'oArea' not in buf_fields:
-        arcpy.AddField_management(buf_100m, 'oArea', 'DOUBLE')
-        with arcpy.da.UpdateCursor(buf_100m, ['SHAPE@AREA', 'oArea']) as cursor:
-            for row in cursor:
-                row[1] = row[0]
-                cursor.updateRow(row)
-    landuse_poly = arcpy.RasterToPolygon_conversion(landuse, os.path.join(scratch, 'landuse_poly'), 'NO_SIMPLIFY', "LUI_Class")
-    landuse_int = arcpy.Intersect_analysis([landuse_poly, buf_100m], os.path.join(scratch, 'landuse_int'))
-    arcpy.AddField_management(landuse_int, 'propArea', 'DOUBLE')
-    with arcpy.da.UpdateCursor(landuse_int, ['SHAPE@AREA', 'oArea', 'propArea']) as cursor:
-        for row in cursor:
-            row[2] = row[0]/row[1]
-            cursor.updateRow(row)
-    area_tbl = arcpy.Statistics_analysis(landuse_int, os.path.join(scratch, 'areaTbl'), [['propArea', 'SUM']], ['ReachID', 'LUI_CLASS'])
-    area_piv_tbl = arcpy.PivotTable_management(area_tbl, ['ReachID'], 'LUI_CLASS', 'SUM_propArea', os.path.join(scratch, 'areaPivTbl'))
-
-    sanitize_area_piv_tbl(area_piv_tbl)
-    # create empty dictionary to hold input table field values
-    tbl_dict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(area_piv_tbl, ['ReachID', 'VeryLow', 'Low', 'Moderate', 'High']) as cursor:
+    # the land use class of each raster value
+    lu_classes = ['VeryLow', 'Low', 'Moderate', 'High']
+    value_classes = {}
+    with arcpy.da.SearchCursor(landuse, ['Value', lui_class_field]) as cursor:
         for row in cursor:
-            tbl_dict[row[0]] = [row[1], row[2], row[3], row[4]]
-
-    # populate flowline network out fields
-    arcpy.AddField_management(out_network, "iPC_VLowLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_LowLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_ModLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_HighLU", 'DOUBLE')
-
-    with arcpy.da.UpdateCursor(out_network, ['ReachID', 'iPC_VLowLU', 'iPC_LowLU', 'iPC_ModLU', 'iPC_HighLU']) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = round(100*tbl_dict[aKey][0], 2)
-                row[2] = round(100*tbl_dict[aKey][1], 2)
-                row[3] = round(100*tbl_dict[aKey][2], 2)
-                row[4] = round(100*tbl_dict[aKey][3], 2)
-                cursor.updateRow(row)
-            except:
-                pass
-    tbl_dict.clear()
-
-    arcpy.Delete_management(lu_ras)
-
-
-def sanitize_area_piv_tbl(area_piv_tbl):
-    """
-    Makes sure that the areaPivTbl has all the fields we need. If it doesn't, we'll add it.
-    :param area_piv_tbl:
-    :return:
+            value_classes[row[0]] = row[1]
+
+    # the area of each raster value in each buffer, weighting the cells on its edge by how much of them it covers, is
+    # added up by land use class. Like the area proportions these replace, the totals include NoData cells, so each
+    # percentage is of the whole buffer
+    reach_ids, (values, counts, totals) = landuse_histogram
+    class_counts = np.zeros((len(reach_ids), len(lu_classes)))
+    for i, value in enumerate(values.tolist()):
+        lu_class = value_classes.get(int(value))
+        if lu_class in lu_classes:
+            class_counts[:, lu_classes.index(lu_class)] += counts[:, i]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = np.round(100 * class_counts / totals[:, np.newaxis], 2)
+
+    # populate flowline network out fields, leaving buffers with no cells null
+    field_arrays = []
+    for i, field in enumerate(["iPC_VLowLU", "iPC_LowLU", "iPC_ModLU", "iPC_HighLU"]):
+        field_arrays.append((field, np.where(totals > 0, percentages[:, i], None)))
+    write_fields_by_reach_id(out_network, reach_ids, field_arrays)
+
+
+def clip_to_valley_bottom(feature, valley_bottom, temp_dir, temp_name):
+    """
+    Clips a feature to the valley bottom
+    :param feature: The feature to clip
+    :param valley_bottom: The valley bottom shapefile
+    :param temp_dir: The temporary folder directory
+    :param temp_name: The name given to the clipped shapefile
+    :return: The path of the clipped shapefile
     """
-    fields = [f.name for f in arcpy.ListFields(area_piv_tbl)]
-    check_and_add_zero_fields(area_piv_tbl, fields, 'VeryLow')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'Low')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'Moderate')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'High')
+    feature_subset = os.path.join(temp_dir, temp_name + '_subset.shp')
+    arcpy.Clip_analysis(feature, valley_bottom, feature_subset)
+    return feature_subset
 
 
-def check_and_add_zero_fields(table, fields, field_name):
+def add_distances_from_features(out_network, distance_layers, buf, temp_dir, scratch, is_verbose, check_distances=False):
     """
-    Checks that a field is in the table. If it isn't, we add it and populate it with zeros
-    :param table: The table that we want to check
-    :param fields: All the fields in the table (more efficient if doing multiple checks)
-    :param field_name: The name of the field we want to check for
+    Finds the distance from each stream segment's 30 m buffer to each of a set of features, sampling the network once
+    for all of them, and populates a field for each
+    :param out_network: The output network where new fields will be added
+    :param distance_layers: A list of (field name, feature, 'MINIMUM' or 'MEAN') for each field
+    :param buf: The 30m stream buffer shapefile, which is only used if check_distances is true
+    :param temp_dir: The temporary folder directory
+    :param scratch: The current workspace
+    :param is_verbose: If true, this option enables ArcMap to provide messages for each step conducted by the tool.
+    :param check_distances: If true, the distances are also calculated from distance rasters, and how much they differ
+        is reported
     :return:
     """
-    if field_name not in fields:
-        arcpy.AddField_management(table, field_name, "DOUBLE")
-        arcpy.CalculateField_management(table, field_name, 0, "PYTHON")
-
-
-def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False):
-    """
-    Finds the distance from a given feature to each stream segment and populates a new field
+    if len(distance_layers) == 0:
+        return
+    if is_verbose:
+        arcpy.AddMessage("Calculating " + ", ".join(layer[0] for layer in distance_layers) + " values...")
+    reach_ids, distances = Feature_Distance.distances_from_features(out_network, [(layer[0], layer[1]) for layer in distance_layers],
+                                                                    buffer_distance=30)
+
+    field_arrays = []
+    for field, feature, stat_type in distance_layers:
+        if distances[field] is None:
+            # if there are no features, then set the distance from to high value (10000 m)
+            field_arrays.append((field, np.full(len(reach_ids), 10000.0)))
+        else:
+            minimums, means = distances[field]
+            values = minimums if stat_type == 'MINIMUM' else means
+            field_arrays.append((field, np.where(np.isnan(values), None, values)))
+    write_fields_by_reach_id(out_network, reach_ids, field_arrays)
+
+    if check_distances:
+        for field, feature, stat_type in distance_layers:
+            check_field = "chk_" + field[4:]
+            find_distance_from_feature(out_network, feature, None, temp_dir, buf, "chk_" + field[4:].lower(), check_field, scratch, is_verbose, stat_type=stat_type)
+            table = arcpy.da.TableToNumPyArray(out_network, ['ReachID', field, check_field], null_value=-1)
+            differences = np.abs(table[field] - table[check_field])[(table[field] >= 0) & (table[check_field] >= 0)]
+            if len(differences) > 0:
+                arcpy.AddMessage(field + " differs from its distance raster value by " + str(round(np.mean(differences), 2)) +
+                                 " on average and by at most " + str(round(np.max(differences), 2)))
+            arcpy.DeleteField_management(out_network, check_field)
+
+
+def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False, stat_type = 'MEAN'):
+    """
+    Finds the distance from a given feature to each stream segment from a distance raster and populates a new field.
+    The iPC distance fields are found with add_distances_from_features instead, which only uses this to check them
     :param out_network: The output network where new fields will be added
     :param feature: The feature that you want to calculate the distance from
     :param valley_bottom: The valley bottom shapefile
@@ -935,6 +957,7 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
     :param scratch: The current workspace
     :param is_verbose: If true, this option enables ArcMap to provide messages for each step conducted by the tool.
     :param clip_feature: If true, the feature will be clipped to the valley bottom
+    :param stat_type: 'MINIMUM' or 'MEAN', how the distances within each segment's buffer are combined
     :return:
     """
     if is_verbose:
@@ -965,7 +988,7 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
         # calculate euclidean distance from input features
         ed_feature = EucDistance(feature_subset, cell_size = 5) # cell size of 5 m
         # get min distance from feature in the within 30 m buffer of each network segment
-        if new_field_name == 'iPC_RoadX':
+        if stat_type == 'MINIMUM':
             zonalStatsWithinBuffer(buf, ed_feature, 'MINIMUM', 'MIN', out_network, new_field_name, scratch)
         else:
             zonalStatsWithinBuffer(buf, ed_feature, 'MEAN', 'MEAN', out_network, new_field_name, scratch)
@@ -978,36 +1001,51 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
 # calculate drainage area function
 def calc_drain_area(DEM, input_DEM):
     """
-    Calculate drainage area function
-    :param DEM: Smoothed DEM
+    Calculate drainage area function. Also writes the flow directions, coded for ArcGIS and for TauDEM, to the same
+    folder for bdws
+    :param DEM: Smoothed DEM with its sinks filled, as a DEM_Processing.FilledDEM
     :param input_DEM: The original input DEM
     :return:
     """
-    #  define raster environment settings
-    desc = arcpy.Describe(DEM)
-    arcpy.env.extent = desc.Extent
-    arcpy.env.outputCoordinateSystem = desc.SpatialReference
-    arcpy.env.cellSize = desc.meanCellWidth
-
     #  calculate cell area for use in drainage area calcultion
-    height = desc.meanCellHeight
-    width = desc.meanCellWidth
-    cell_area = height * width
+    cell_area = DEM.cell_height * DEM.cell_width
 
-    # derive drainage area raster (in square km) from input DEM
+    # derive drainage area raster (in square km) from input DEM, routing flow a band of rows at a time
     # note: draiange area calculation assumes input dem is in meters
-    filled_DEM = Fill(DEM) # fill sinks in dem
-    flow_direction = FlowDirection(filled_DEM) # calculate flow direction
-    flow_accumulation = FlowAccumulation(flow_direction) # calculate flow accumulation
-    drain_area = flow_accumulation * cell_area / 1000000 # calculate drainage area in square kilometers
-
-    # save drainage area raster
-    if os.path.exists(os.path.dirname(input_DEM) + "/Flow/DrainArea_sqkm.tif"):
-        arcpy.Delete_management(os.path.dirname(input_DEM) + "/Flow/DrainArea_sqkm.tif")
-        arcpy.CopyRaster_management(drain_area, os.path.dirname(input_DEM) + "/Flow/DrainArea_sqkm.tif")
-    else:
-        os.mkdir(os.path.dirname(input_DEM) + "/Flow")
-        arcpy.CopyRaster_management(drain_area, os.path.dirname(input_DEM) + "/Flow/DrainArea_sqkm.tif")
+    flow_direction = Flow_Routing.flow_directions_in_bands(DEM, DEM.cell_width, DEM.cell_height, DEM.block_rows)
+    drain_area = Flow_Routing.accumulate_flow(flow_direction, block_rows=DEM.block_rows)
+    drain_area *= cell_area / 1000000 # calculate drainage area in square kilometers
+
+    # save drainage area raster, and the flow directions in both codings bdws accepts
+    flow_folder = os.path.dirname(input_DEM) + "/Flow"
+    if not os.path.exists(flow_folder):
+        os.mkdir(flow_folder)
+    DEM_Processing.write_blocks(DEM_Processing.ArraySampler(drain_area, DEM), flow_folder + "/DrainArea_sqkm.tif")
+    del drain_area
+    DEM_Processing.write_flow_directions(flow_direction, DEM, flow_folder + "/FlowDir_ESRI.tif", 'ESRI')
+    DEM_Processing.write_flow_directions(flow_direction, DEM, flow_folder + "/FlowDir_TauDEM.tif", 'TAUDEM')
+
+
+def calc_drain_area_spatial_analyst(input_DEM):
+    """
+    Calculates drainage area with Spatial Analyst, for DEMs too large to route flow over in memory
+    :param input_DEM: The original input DEM
+    :return:
+    """
+    desc = arcpy.Describe(input_DEM)
+    cell_area = desc.meanCellHeight * desc.meanCellWidth
+
+    # smooth the dem with a 3x3 mean, like DEM_Processing.SmoothedRasterSampler, then fill and route it
+    smoothed = ExtractByMask(FocalStatistics(input_DEM, NbrRectangle(3, 3, "CELL"), 'MEAN'), input_DEM)
+    flow_direction = FlowDirection(Fill(smoothed))
+    drain_area = FlowAccumulation(flow_direction) * cell_area / 1000000
+
+    # save drainage area raster, and the ESRI-coded flow directions
+    flow_folder = os.path.dirname(input_DEM) + "/Flow"
+    if not os.path.exists(flow_folder):
+        os.mkdir(flow_folder)
+    arcpy.CopyRaster_management(drain_area, flow_folder + "/DrainArea_sqkm.tif")
+    arcpy.CopyRaster_management(flow_direction, flow_folder + "/FlowDir_ESRI.tif")
 
 
 def write_xml(output_folder, coded_veg, coded_hist, seg_network, inDEM, valley_bottom, landuse,
@@ -0,0 +1,305 @@
+# -------------------------------------------------------------------------------
+# Name:        Benchmark
+# Purpose:     Times the numerical cores of the BRAT capacity model stages on synthetic networks
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import time
+import sys
+import numpy as np
+import FIS_Engine
+import Regional_Curves
+import Conflict_Curves
+
+try:
+    import tracemalloc
+except ImportError:
+    # tracemalloc is only in Python 3, so ArcMap's Python 2 falls back to the process's peak memory (see
+    # process_peak_memory)
+    tracemalloc = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # resource is only on Unix
+    resource = None
+
+
+# The number of reaches in each synthetic network
+DEFAULT_TIERS = [1000, 10000, 100000, 1000000]
+
+# Where reaches per second from a previous run are stored, to compare against
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Benchmark_Baseline.json")
+
+# A stage is flagged as a regression if it processes fewer than this fraction of its baseline reaches per second
+REGRESSION_THRESHOLD = 0.75
+
+# The number of reaches compared against the skfuzzy reference
+ACCURACY_SAMPLE_SIZE = 200
+
+
+def make_network(num_reaches, seed=0):
+    """
+    Makes a synthetic reach attribute table with every field the benchmarked stages read. The values are random
+    but follow the shape of real BRAT networks, including the repeated and clamped values that show up in them
+    :param num_reaches: The number of reaches
+    :param seed: Seed for the random number generator, so every run gets the same network
+    :return: A dictionary of field name to array
+    """
+    random_state = np.random.RandomState(seed)
+    network = {'ReachID': np.arange(1, num_reaches + 1, dtype=np.int64)}
+
+    # vegetation suitability averages of 0 to 4 codes, with a share of reaches entirely in one class
+    for field in ['iVeg100EX', 'iVeg_30EX']:
+        veg = np.round(random_state.uniform(0, 4, num_reaches), 2)
+        whole_class = random_state.rand(num_reaches) < 0.2
+        veg[whole_class] = random_state.randint(0, 5, whole_class.sum())
+        network[field] = veg
+
+    network['iGeo_DA'] = np.exp(random_state.normal(3, 1.5, num_reaches))
+    network['iGeo_Slope'] = np.clip(np.exp(random_state.normal(np.log(0.02), 1.0, num_reaches)), 0, 1)
+    network['iHyd_SPLow'] = np.clip(np.exp(random_state.normal(np.log(30), 1.5, num_reaches)), 0, 10000)
+    network['iHyd_SP2'] = np.clip(np.exp(random_state.normal(np.log(500), 1.5, num_reaches)), 0, 10000)
+
+    ovc = random_state.uniform(0, 45, num_reaches)
+    ovc[random_state.rand(num_reaches) < 0.25] = 0
+    network['oVC_EX'] = ovc
+
+    for field in ['iPC_RoadX', 'iPC_RoadAd', 'iPC_Canal', 'iPC_RR']:
+        network[field] = random_state.exponential(500, num_reaches)
+    network['iPC_LU'] = random_state.uniform(0, 2, num_reaches)
+
+    return network
+
+
+def run_veg_fis(network):
+    """
+    The numerical core of Veg_FIS
+    :param network: The synthetic network (see make_network)
+    :return: Array of vegetation capacity
+    """
+    return FIS_Engine.evaluate_unique(FIS_Engine.VEG_FIS, [network['iVeg100EX'], network['iVeg_30EX']])[0]
+
+
+def run_comb_fis(network):
+    """
+    The numerical core of Comb_FIS
+    :param network: The synthetic network (see make_network)
+    :return: Array of combined capacity
+    """
+    return FIS_Engine.evaluate_unique(FIS_Engine.COMB_FIS, [network['oVC_EX'], network['iHyd_SP2'],
+                                                            network['iHyd_SPLow'], network['iGeo_Slope']])[0]
+
+
+def run_ihyd(network):
+    """
+    The numerical core of iHyd, with the default regional curves
+    :param network: The synthetic network (see make_network)
+    :return: Array of Q2 stream power
+    """
+    q_low, q2 = Regional_Curves.calc_discharge(network['iGeo_DA'] * 0.3861021585424458, 0, None, None)
+    Regional_Curves.calc_stream_power(network['iGeo_Slope'], q_low)
+    return Regional_Curves.calc_stream_power(network['iGeo_Slope'], q2)
+
+
+def run_conflict_potential(network):
+    """
+    The numerical core of Conflict_Potential, with its default distance thresholds
+    :param network: The synthetic network (see make_network)
+    :return: Array of conflict potential
+    """
+    return Conflict_Curves.score_conflict(network, Conflict_Curves.default_curves())
+
+
+STAGES = [('Veg_FIS', run_veg_fis),
+          ('Comb_FIS', run_comb_fis),
+          ('iHyd', run_ihyd),
+          ('Conflict_Potential', run_conflict_potential)]
+
+
+def time_stage(stage, network, repeats):
+    """
+    Times a stage on a network, and measures its peak memory in a separate run
+    :param stage: The stage function
+    :param network: The synthetic network (see make_network)
+    :param repeats: The number of timed runs. The fastest is kept
+    :return: The fastest time in seconds, and the peak memory in bytes
+    """
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        stage(network)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+        stage(network)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return best, peak
+
+    # without tracemalloc, use how much the stage raised the process's peak memory. The process's peak only goes up,
+    # so an earlier run that went higher hides this one, and the size of the stage's output is the lower bound
+    before = process_peak_memory()
+    output = stage(network)
+    after = process_peak_memory()
+    peak = np.asarray(output).nbytes
+    if before is not None and after is not None:
+        peak = max(peak, after - before)
+    return best, peak
+
+
+def process_peak_memory():
+    """
+    Finds the most memory this process has used so far, for Pythons without tracemalloc
+    :return: The peak memory in bytes, or None if it can't be found
+    """
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        # the peak working set is only reported on Windows
+        if hasattr(memory, 'peak_wset'):
+            return memory.peak_wset
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return None
+
+
+def check_accuracy(network):
+    """
+    Compares the FIS stages against the skfuzzy ControlSystemSimulation they replaced, on the first reaches of a
+    network
+    :param network: The synthetic network (see make_network)
+    :return: A dictionary of stage name to the largest difference, in dams/km
+    """
+    sample = dict((field, values[:ACCURACY_SAMPLE_SIZE]) for field, values in network.items())
+    differences = {}
+    for name, fis, fields in [('Veg_FIS', FIS_Engine.VEG_FIS, ['iVeg100EX', 'iVeg_30EX']),
+                              ('Comb_FIS', FIS_Engine.COMB_FIS, ['oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope'])]:
+        inputs = [sample[field] for field in fields]
+        reference = FIS_Engine.evaluate_skfuzzy(fis, inputs)
+        differences[name] = float(np.abs(FIS_Engine.evaluate(fis, inputs) - reference).max())
+    return differences
+
+
+def load_baseline(baseline_file):
+    """
+    Loads the reaches per second of a previous run
+    :param baseline_file: The JSON file saved by save_baseline
+    :return: A dictionary of stage name to a dictionary of tier to reaches per second
+    """
+    if not os.path.exists(baseline_file):
+        return {}
+    with open(baseline_file) as f:
+        return json.load(f)
+
+
+def save_baseline(baseline_file, results):
+    """
+    Saves the reaches per second of this run as the baseline for future runs
+    :param baseline_file: The JSON file to save to
+    :param results: The list of result dictionaries from main
+    :return:
+    """
+    baseline = {}
+    for result in results:
+        baseline.setdefault(result['stage'], {})[str(result['reaches'])] = result['reaches_per_second']
+    with open(baseline_file, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def main(tiers=None, repeats=3, baseline_file=DEFAULT_BASELINE, update_baseline=False, seed=0):
+    """
+    Runs every stage on every tier and prints reaches per second, peak memory, and regressions against the baseline.
+    Results are flagged as failed if a stage regressed or a FIS stage's difference from skfuzzy exceeds its tolerance
+    :param tiers: The network sizes to run. Defaults to DEFAULT_TIERS
+    :param repeats: The number of timed runs of each stage on each tier
+    :param baseline_file: The JSON file holding the baseline reaches per second
+    :param update_baseline: If true, this run is saved as the new baseline
+    :param seed: Seed for the synthetic networks
+    :return: The list of result dictionaries, and True if there were any regressions or tolerance failures
+    """
+    if tiers is None:
+        tiers = DEFAULT_TIERS
+    baseline = load_baseline(baseline_file)
+    results = []
+    regressions = []
+    failed = False
+
+    print("{:<20}{:>10}{:>14}{:>16}{:>14}{:>12}".format("Stage", "Reaches", "Seconds", "Reaches/s", "Peak MB",
+                                                        "vs base"))
+    for num_reaches in tiers:
+        network = make_network(num_reaches, seed)
+        for name, stage in STAGES:
+            try:
+                seconds, peak = time_stage(stage, network, repeats)
+            except (ImportError, NameError) as e:
+                # a missing module, or a module calling reload, which isn't a builtin in Python 3
+                print("{:<20}{:>10}  skipped: {}".format(name, num_reaches, e))
+                continue
+
+            reaches_per_second = num_reaches / max(seconds, 1e-9)
+            result = {'stage': name, 'reaches': num_reaches, 'seconds': seconds,
+                      'reaches_per_second': reaches_per_second, 'peak_bytes': peak}
+            results.append(result)
+
+            base = baseline.get(name, {}).get(str(num_reaches))
+            ratio = ""
+            if base:
+                ratio = "{:.2f}x".format(reaches_per_second / base)
+                if reaches_per_second < REGRESSION_THRESHOLD * base:
+                    ratio += " !"
+                    regressions.append(result)
+            peak_text = "n/a" if peak is None else "{:.1f}".format(peak / 1e6)
+            print("{:<20}{:>10}{:>14.4f}{:>16.0f}{:>14}{:>12}".format(name, num_reaches, seconds, reaches_per_second,
+                                                                      peak_text, ratio))
+
+    try:
+        differences = check_accuracy(make_network(ACCURACY_SAMPLE_SIZE, seed))
+        for name in sorted(differences):
+            status = "ok"
+            if differences[name] > FIS_Engine.SKFUZZY_TOLERANCE:
+                status = "EXCEEDS TOLERANCE"
+                failed = True
+            print("Largest difference from skfuzzy for {}: {:.6f} dams/km ({})".format(name, differences[name],
+                                                                                        status))
+    except (ImportError, NameError) as e:
+        print("Skipped accuracy check against skfuzzy: {}".format(e))
+
+    for result in regressions:
+        failed = True
+        print("Regression: {} on {} reaches is slower than {:.0%} of its baseline".format(
+            result['stage'], result['reaches'], REGRESSION_THRESHOLD))
+
+    if update_baseline:
+        save_baseline(baseline_file, results)
+        print("Saved baseline to " + baseline_file)
+
+    return results, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times the BRAT capacity model stages on synthetic networks")
+    parser.add_argument('--tiers', type=int, nargs='+', default=DEFAULT_TIERS,
+                        help="The number of reaches in each synthetic network")
+    parser.add_argument('--repeats', type=int, default=3, help="The number of timed runs of each stage")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="The JSON file of baseline reaches per second")
+    parser.add_argument('--update-baseline', action='store_true', help="Save this run as the new baseline")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic networks")
+    args = parser.parse_args()
+    results, failed = main(args.tiers, args.repeats, args.baseline, args.update_baseline, args.seed)
+    sys.exit(1 if failed else 0)
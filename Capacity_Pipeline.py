@@ -0,0 +1,167 @@
+# -------------------------------------------------------------------------------
+# Name:        Capacity Pipeline
+# Purpose:     Runs iHyd, the vegetation and combined FIS, conflict potential and conservation and restoration on a
+#              BRAT table in one go, reading the network once and writing the output once
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import os
+import sys
+from SupportingFunctions import make_folder
+import ReachTable
+import FIS_Engine
+import iHyd
+import Veg_FIS
+import Comb_FIS
+import Conflict_Potential
+import Constraints_Opportunities
+reload(ReachTable)
+reload(FIS_Engine)
+reload(iHyd)
+reload(Veg_FIS)
+reload(Comb_FIS)
+reload(Conflict_Potential)
+reload(Constraints_Opportunities)
+ReachTable = ReachTable.ReachTable
+
+
+def main(in_network, out_name, region, q_low_eqtn, q2_eqtn, max_da_thresh, crossing_low=10, crossing_high=100,
+         adj_low=10, adj_high=100, canal_low=50, canal_high=200, rr_low=30, rr_high=100, input_rounding=None,
+         chunk_size=None, processes=None, curve_file=None, run_conservation=False, surveyed_dams=None,
+         conservation_areas=None, conservation_easements=None, rule_file=None):
+    """
+    Runs the capacity model stages on one in-memory copy of the BRAT table. The network is copied to the output once,
+    every field the stages read is loaded once, the stages hand the reach table from one to the next, and every
+    field they add is written to the output in one pass. The input network is left as it is
+    :param in_network: The BRAT table network (the output of BRAT_table), with the iGeo, iVeg and iPC fields
+    :param out_name: The output name for the Combined Capacity Network
+    :param region: The optional region code to identify an already existing equation (see iHyd)
+    :param q_low_eqtn: The Qlow equation to be calculated
+    :param q2_eqtn: The Q2 equation to be calculated
+    :param max_da_thresh: The drainage area value above which the stream is assumed to not support dam building
+    :param crossing_low: The road crossing distance at and below which conflict potential is highest
+    :param crossing_high: The road crossing distance above which conflict potential is lowest
+    :param adj_low: The adjacent road distance at and below which conflict potential is highest
+    :param adj_high: The adjacent road distance above which conflict potential is lowest
+    :param canal_low: The canal distance at and below which conflict potential is highest
+    :param canal_high: The canal distance above which conflict potential is lowest
+    :param rr_low: The railroad distance at and below which conflict potential is highest
+    :param rr_high: The railroad distance above which conflict potential is lowest
+    :param input_rounding: The number of FIS universe steps inputs are rounded to before reaches with the same
+        inputs are evaluated together. If None, only reaches with exactly the same inputs are evaluated together
+    :param chunk_size: The number of reaches the FIS evaluates at once, which bounds its memory use
+    :param processes: The number of processes the FIS blocks are spread across
+    :param curve_file: An optional JSON file of conflict potential scoring curves, which are used for the region
+        (see Conflict_Potential.load_curves)
+    :param run_conservation: If true, the conservation and restoration classes are added too
+    :param surveyed_dams: The dams shapefile, for the conservation and restoration strategies map
+    :param conservation_areas: The conservation areas shapefile, for the strategies map
+    :param conservation_easements: The conservation easements shapefile, for the strategies map
+    :param rule_file: An optional JSON file of conservation and restoration rule tables, which are used for the
+        region (see Constraints_Opportunities.load_rule_tables)
+    :return: The path to the output network
+    """
+    if region is None or region == "None" or region == '' or region == '#':
+        region = 0
+    else:
+        region = int(float(region))
+    if q_low_eqtn == "None" or q_low_eqtn == '' or q_low_eqtn == '#':
+        q_low_eqtn = None
+    if q2_eqtn == "None" or q2_eqtn == '' or q2_eqtn == '#':
+        q2_eqtn = None
+
+    if chunk_size is None or chunk_size == '' or chunk_size == '#':
+        chunk_size = FIS_Engine.DEFAULT_CHUNK_SIZE
+    else:
+        chunk_size = int(chunk_size)
+
+    if processes is None or processes == '' or processes == '#':
+        processes = 1
+    else:
+        processes = int(processes)
+
+    run_conservation = run_conservation is True or str(run_conservation).lower() == 'true'
+    if surveyed_dams == '' or surveyed_dams == '#':
+        surveyed_dams = None
+    if conservation_areas == '' or conservation_areas == '#':
+        conservation_areas = None
+    if conservation_easements == '' or conservation_easements == '#':
+        conservation_easements = None
+
+    if input_rounding is None or input_rounding == '' or input_rounding == '#':
+        veg_resolution = None
+        comb_resolution = None
+    else:
+        veg_resolution = FIS_Engine.input_steps(FIS_Engine.VEG_FIS, float(input_rounding))
+        comb_resolution = FIS_Engine.input_steps(FIS_Engine.COMB_FIS, float(input_rounding))
+
+    arcpy.env.overwriteOutput = True
+
+    output_folder = os.path.dirname(os.path.dirname(in_network))
+    analyses_folder = make_folder(output_folder, "02_Analyses")
+
+    if out_name.endswith('.shp'):
+        out_network = os.path.join(analyses_folder, out_name)
+    else:
+        out_network = os.path.join(analyses_folder, out_name + ".shp")
+
+    if os.path.exists(out_network):
+        arcpy.Delete_management(out_network)
+    arcpy.CopyFeatures_management(in_network, out_network)
+
+    # read every input field the stages need, in one pass
+    network_fields = [f.name for f in arcpy.ListFields(out_network)]
+    conflict_fields = [field for field in Conflict_Potential.CONFLICT_FIELDS if field in network_fields]
+    conservation_fields = []
+    if run_conservation:
+        conservation_fields = [field for field in Constraints_Opportunities.BRAT_TABLE_FIELDS
+                               if field in network_fields]
+    table = ReachTable.load(out_network, iHyd.IHYD_FIELDS + Veg_FIS.VEG_FIS_FIELDS + ['iGeo_Len'] + conflict_fields +
+                            conservation_fields)
+
+    sidecar_folder = os.path.dirname(out_network)
+
+    iHyd.calc_hydrology(table, region, q_low_eqtn, q2_eqtn)
+
+    arcpy.AddMessage("Running vegetation FIS...")
+    Veg_FIS.veg_cap_fis(table, 'Hpe', sidecar_folder, False, veg_resolution, chunk_size, processes)
+    Veg_FIS.veg_cap_fis(table, 'ex', sidecar_folder, False, veg_resolution, chunk_size, processes)
+
+    arcpy.AddMessage("Running combined FIS...")
+    Comb_FIS.comb_cap_fis(table, 'hpe', max_da_thresh, sidecar_folder, comb_resolution, chunk_size, processes)
+    Comb_FIS.comb_cap_fis(table, 'ex', max_da_thresh, sidecar_folder, comb_resolution, chunk_size, processes)
+
+    # region 0 is the generic iHyd region, which only has the default conflict potential curves
+    arcpy.AddMessage("Adding conflict potential...")
+    Conflict_Potential.calc_conflict(table, crossing_low, crossing_high, adj_low, adj_high, canal_low, canal_high,
+                                     rr_low, rr_high, curve_file, region if region != 0 else None)
+
+    if run_conservation:
+        arcpy.AddMessage("Adding conservation and restoration classes...")
+        rule_tables = dict(Constraints_Opportunities.RULE_TABLES)
+        if rule_file is not None and rule_file != '' and rule_file != '#':
+            rule_tables.update(Constraints_Opportunities.load_rule_tables(rule_file, region if region != 0 else None))
+        run_strategies = conservation_areas is not None and surveyed_dams is not None
+        Constraints_Opportunities.add_output_fields(out_network, run_strategies)
+        Constraints_Opportunities.calc_conservation(table, out_network, surveyed_dams, conservation_areas,
+                                                    conservation_easements, rule_tables)
+
+    # write every output field, in one pass
+    arcpy.AddMessage("Writing " + str(len(table.changed_fields)) + " fields to " + out_network + "...")
+    table.flush(out_network)
+
+    Comb_FIS.make_layers(out_network)
+    if run_conservation:
+        Constraints_Opportunities.make_layers(out_network)
+
+    Comb_FIS.add_xml_output(in_network, out_network)
+
+    return out_network
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -10,29 +10,66 @@
 # -------------------------------------------------------------------------------
 
 import arcpy
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
 import numpy as np
 import os
 import sys
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, \
                                 find_relative_path, write_xml_element_with_path
+import FIS_Engine
+import ReachTable
 import XMLBuilder
+reload(FIS_Engine)
+reload(ReachTable)
 reload(XMLBuilder)
+ReachTable = ReachTable.ReachTable
 XMLBuilder = XMLBuilder.XMLBuilder
 
+# The fields comb_cap_fis and comb_cap_sensitivity read
+COMB_FIS_FIELDS = ['oVC_HPE', 'oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope', 'iGeo_DA', 'iGeo_Len']
 
-def main(proj_path, in_network, max_da_thresh, out_name):
+
+def main(proj_path, in_network, max_da_thresh, out_name, input_rounding=None, chunk_size=None, processes=None,
+         sensitivity_sets=None, sensitivity_spread=None):
     """
     The main function, runs the combined FIS for the BRAT input table
     :param proj_path: The path to the project folder for this BRAT run
     :param in_network: The input BRAT network
     :param max_da_thresh: The drainage area value above which the stream is assumed to not support dam building
     :param out_name: The output name for the Combined Capacity Network
+    :param input_rounding: The number of FIS universe steps inputs are rounded to before reaches with the same
+        inputs are evaluated together. If None, only reaches with exactly the same inputs are evaluated together
+    :param chunk_size: The number of reaches the FIS evaluates at once, which bounds its memory use
+    :param processes: The number of processes the FIS blocks are spread across
+    :param sensitivity_sets: The number of randomly perturbed sets of membership functions to run the existing
+        capacity FIS with. If None, no sensitivity analysis is run
+    :param sensitivity_spread: The largest relative change to any membership function breakpoint in the
+        sensitivity analysis. Defaults to 0.1
     :return:
     """
+    if input_rounding is None or input_rounding == '' or input_rounding == '#':
+        input_resolution = None
+    else:
+        input_resolution = FIS_Engine.input_steps(FIS_Engine.COMB_FIS, float(input_rounding))
+
+    if chunk_size is None or chunk_size == '' or chunk_size == '#':
+        chunk_size = FIS_Engine.DEFAULT_CHUNK_SIZE
+    else:
+        chunk_size = int(chunk_size)
+
+    if processes is None or processes == '' or processes == '#':
+        processes = 1
+    else:
+        processes = int(processes)
+
+    if sensitivity_sets is None or sensitivity_sets == '' or sensitivity_sets == '#':
+        sensitivity_sets = 0
+    else:
+        sensitivity_sets = int(sensitivity_sets)
 
-    scratch = 'in_memory'
+    if sensitivity_spread is None or sensitivity_spread == '' or sensitivity_spread == '#':
+        sensitivity_spread = 0.1
+    else:
+        sensitivity_spread = float(sensitivity_spread)
 
     output_folder = os.path.dirname(os.path.dirname(in_network))
     analyses_folder = make_folder(output_folder, "02_Analyses")
@@ -46,29 +83,83 @@ def main(proj_path, in_network, max_da_thresh, out_name):
         arcpy.Delete_management(out_network)
     arcpy.CopyFeatures_management(in_network, out_network)
 
+    table = ReachTable.load(out_network, COMB_FIS_FIELDS)
+
     # run the combined fis function for both potential and existing
-    comb_cap_fis(out_network, 'hpe', scratch, max_da_thresh)
-    comb_cap_fis(out_network, 'ex', scratch, max_da_thresh)
+    sidecar_folder = os.path.dirname(out_network)
+    comb_cap_fis(table, 'hpe', max_da_thresh, sidecar_folder, input_resolution, chunk_size, processes)
+    comb_cap_fis(table, 'ex', max_da_thresh, sidecar_folder, input_resolution, chunk_size, processes)
+
+    if sensitivity_sets > 0:
+        comb_cap_sensitivity(table, max_da_thresh, sensitivity_sets, sensitivity_spread, chunk_size)
+
+    table.flush(out_network)
 
     make_layers(out_network)
 
     add_xml_output(in_network, out_network)
 
 
-def comb_cap_fis(in_network, model_run, scratch, max_da_thresh):
+def comb_fis_inputs(table, veg_field):
+    """
+    Gets the combined FIS inputs from a reach table, re-assigned to within the range of the fis
+    :param table: The ReachTable of the BRAT network
+    :param veg_field: The vegetation capacity field to use, either 'oVC_HPE' or 'oVC_EX'
+    :return: A list of arrays of vegetation capacity, Q2 stream power, baseflow stream power and slope
+    """
+    ovc_array = np.array(table[veg_field], np.float64)
+    ihydsp2_array = np.array(table['iHyd_SP2'], np.float64)
+    ihydsplow_array = np.array(table['iHyd_SPLow'], np.float64)
+    igeoslope_array = np.array(table['iGeo_Slope'], np.float64)
+
+    # check that inputs are within range of fis
+    # if not, re-assign the value to just within range
+    ovc_array[ovc_array < 0] = 0
+    ovc_array[ovc_array > 45] = 45
+    ihydsp2_array[ihydsp2_array < 0] = 0.0001
+    ihydsp2_array[ihydsp2_array > 10000] = 10000
+    ihydsplow_array[ihydsplow_array < 0] = 0.0001
+    ihydsplow_array[ihydsplow_array > 10000] = 10000
+    igeoslope_array[igeoslope_array > 1] = 1
+
+    return [ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array]
+
+
+def correct_capacity(out, ovc, drainage_area, max_da_thresh):
+    """
+    Applies the corrections to combined capacity FIS output described in comb_cap_fis
+    :param out: Array of FIS output. The last axis is the reaches
+    :param ovc: Array of the vegetation capacity of each reach
+    :param drainage_area: Array of the drainage area of each reach
+    :param max_da_thresh: The drainage area value above which the stream is assumed to not support dam building
+    :return: The corrected array
+    """
+    # the centroids come from the same output terms and defuzzification as the FIS output itself
+    defuzz_none = round(FIS_Engine.term_centroid(FIS_Engine.COMB_FIS, 'none'), 6)
+    defuzz_pervasive = round(FIS_Engine.term_centroid(FIS_Engine.COMB_FIS, 'pervasive'))
+
+    # (np.floor(x + 0.5) rounds halves up, like round())
+    out[np.round(out, 6) == defuzz_none] = 0.0
+    out[np.floor(out + 0.5) >= defuzz_pervasive] = 40.0
+    out = np.where(out > ovc, ovc, out)
+    out[..., drainage_area >= float(max_da_thresh)] = 0.0
+    return out
+
+
+def comb_cap_fis(table, model_run, max_da_thresh, sidecar_folder, input_resolution=None,
+                 chunk_size=FIS_Engine.DEFAULT_CHUNK_SIZE, processes=1):
     """
     The combined capacity FIS function
-    :param in_network: The input BRAT network
+    :param table: The ReachTable of the BRAT network, which the output fields are added to
     :param model_run: The model being run, either 'Hpe' or 'ex" (Potential or Existing)
-    :param scratch: The current workspace
     :param max_da_thresh: The drainage area value above which the stream is assumed to not support dam building
+    :param sidecar_folder: The folder the FIS inputs and outputs of each reach are saved in for the next run
+    :param input_resolution: The resolution each FIS input is rounded to before reaches with the same inputs are
+        evaluated together (see FIS_Engine.unique_inputs)
+    :param chunk_size: The number of reaches the FIS evaluates at once, which bounds its memory use
+    :param processes: The number of processes the FIS blocks are spread across
     :return:
     """
-    arcpy.env.overwriteOutput = True
-
-    # get list of all fields in the flowline network
-    fields = [f.name for f in arcpy.ListFields(in_network)]
-
     # set the carrying capacity and vegetation field depending on whether potential or existing run
     if model_run == 'hpe':
         out_field = "oCC_HPE"
@@ -79,247 +170,70 @@ def comb_cap_fis(in_network, model_run, scratch, max_da_thresh):
         veg_field = "oVC_EX"
         mcc_field = "mCC_EX_CT"
 
-    # check for oCC_* field in the network attribute table and delete if exists
-    if out_field in fields:
-        arcpy.DeleteField_management(in_network, out_field)
-
-    # get arrays for fields of interest
-    segid_np = arcpy.da.FeatureClassToNumPyArray(in_network, "ReachID")
-    ovc_np = arcpy.da.FeatureClassToNumPyArray(in_network, veg_field)
-    ihydsp2_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iHyd_SP2")
-    ihydsplow_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iHyd_SPLow")
-    igeoslope_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iGeo_Slope")
-
-    segid_array = np.asarray(segid_np, np.int64)
-    ovc_array = np.asarray(ovc_np, np.float64)
-    ihydsp2_array = np.asarray(ihydsp2_np, np.float64)
-    ihydsplow_array = np.asarray(ihydsplow_np, np.float64)
-    igeoslope_array = np.asarray(igeoslope_np, np.float64)
-
-    # check that inputs are within range of fis
-    # if not, re-assign the value to just within range
-    ovc_array[ovc_array < 0] = 0
-    ovc_array[ovc_array > 45] = 45
-    ihydsp2_array[ihydsp2_array < 0] = 0.0001
-    ihydsp2_array[ihydsp2_array > 10000] = 10000
-    ihydsplow_array[ihydsplow_array < 0] = 0.0001
-    ihydsplow_array[ihydsplow_array > 10000] = 10000
-    igeoslope_array[igeoslope_array > 1] = 1
-
-    # delete temp arrays
-    items = [segid_np, ovc_np, ihydsp2_np, ihydsplow_np, igeoslope_np]
-    for item in items:
-        del item
-
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
-    sp2 = ctrl.Antecedent(np.arange(0, 10000, 1), 'input2')
-    splow = ctrl.Antecedent(np.arange(0, 10000, 1), 'input3')
-    slope = ctrl.Antecedent(np.arange(0, 1, 0.0001), 'input4')
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-    # build membership functions for each antecedent and consequent object
-    ovc['none'] = fuzz.trimf(ovc.universe, [0, 0, 0.1])
-    ovc['rare'] = fuzz.trapmf(ovc.universe, [0, 0.1, 0.5, 1.5])
-    ovc['occasional'] = fuzz.trapmf(ovc.universe, [0.5, 1.5, 4, 8])
-    ovc['frequent'] = fuzz.trapmf(ovc.universe, [4, 8, 12, 25])
-    ovc['pervasive'] = fuzz.trapmf(ovc.universe, [12, 25, 45, 45])
-
-    sp2['persists'] = fuzz.trapmf(sp2.universe, [0, 0, 1000, 1200])
-    sp2['breach'] = fuzz.trimf(sp2.universe, [1000, 1200, 1600])
-    sp2['oblowout'] = fuzz.trimf(sp2.universe, [1200, 1600, 2400])
-    sp2['blowout'] = fuzz.trapmf(sp2.universe, [1600, 2400, 10000, 10000])
-
-    splow['can'] = fuzz.trapmf(splow.universe, [0, 0, 150, 175])
-    splow['probably'] = fuzz.trapmf(splow.universe, [150, 175, 180, 190])
-    splow['cannot'] = fuzz.trapmf(splow.universe, [180, 190, 10000, 10000])
-
-    slope['flat'] = fuzz.trapmf(slope.universe, [0, 0, 0.0002, 0.005])
-    slope['can'] = fuzz.trapmf(slope.universe, [0.0002, 0.005, 0.12, 0.15])
-    slope['probably'] = fuzz.trapmf(slope.universe, [0.12, 0.15, 0.17, 0.23])
-    slope['cannot'] = fuzz.trapmf(slope.universe, [0.17, 0.23, 1, 1])
-
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-    # build fis rule table
-    rule1 = ctrl.Rule(ovc['none'], density['none'])
-    rule2 = ctrl.Rule(splow['cannot'], density['none'])
-    rule3 = ctrl.Rule(slope['cannot'], density['none'])
-    rule4 = ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule5 = ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule6 = ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule7 = ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule8 = ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule9 = ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule10 = ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['none'])
-    rule11 = ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['none'])
-    rule12 = ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule13 = \
-        ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule14 = ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule15 = ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule16 = ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule17 = \
-        ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule18 = ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule19 = ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule20 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['flat'], density['occasional'])
-    rule21 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['can'], density['frequent'])
-    rule22 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional'])
-    rule23 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule24 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['can'], density['frequent'])
-    rule25 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule26 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional'])
-    rule27 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent'])
-    rule28 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional'])
-    rule29 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule30 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent'])
-    rule31 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule32 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional'])
-    rule33 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent'])
-    rule34 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional'])
-    rule35 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['rare'])
-    rule36 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional'])
-    rule37 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare'])
-    rule38 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare'])
-    rule39 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['can'], density['rare'])
-    rule40 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare'])
-    rule41 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare'])
-    rule42 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare'])
-    rule43 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-    rule44 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['flat'], density['frequent'])
-    rule45 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['can'], density['pervasive'])
-    rule46 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['probably'], density['frequent'])
-    rule47 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['flat'], density['frequent'])
-    rule48 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['can'], density['pervasive'])
-    rule49 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['probably'], density['frequent'])
-    rule50 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['flat'], density['frequent'])
-    rule51 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['can'], density['pervasive'])
-    rule52 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['probably'], density['frequent'])
-    rule53 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['flat'], density['frequent'])
-    rule54 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['can'], density['pervasive'])
-    rule55 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['probably'], density['frequent'])
-    rule56 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['frequent'])
-    rule57 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['can'], density['pervasive'])
-    rule58 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['frequent'])
-    rule59 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule60 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['frequent'])
-    rule61 = \
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule62 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['flat'], density['occasional'])
-    rule63 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['can'], density['occasional'])
-    rule64 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare'])
-    rule65 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule66 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['can'], density['occasional'])
-    rule67 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-
-    comb_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10,
-                                    rule11, rule12, rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20,
-                                    rule21, rule22, rule23, rule24, rule25, rule26, rule27, rule28, rule29, rule30,
-                                    rule31, rule32, rule33, rule34, rule35, rule36, rule37, rule38, rule39, rule40,
-                                    rule41, rule42, rule43, rule44, rule45, rule46, rule47, rule48, rule49, rule50,
-                                    rule51, rule52, rule53, rule54, rule55, rule56, rule57, rule58, rule59, rule60,
-                                    rule61, rule62, rule63, rule64, rule65, rule66, rule67])
-    comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
+    segid_array = np.asarray(table.reach_ids(), np.int64)
 
     # run fuzzy inference system on inputs and defuzzify output
+    # the rules and membership functions are defined in FIS_Engine.COMB_FIS, and every reach is evaluated at once
+    # only reaches whose inputs changed since the last run are evaluated, and reaches with the same (rounded)
+    # inputs, such as clamped slopes and stream powers, share a single evaluation
     # TODO Test this using nas instead of zeros
-    out = np.zeros(len(ovc_array))
-    for i in range(len(out)):
-        comb_fis.input['input1'] = ovc_array[i]
-        comb_fis.input['input2'] = ihydsp2_array[i]
-        comb_fis.input['input3'] = ihydsplow_array[i]
-        comb_fis.input['input4'] = igeoslope_array[i]
-        comb_fis.compute()
-        out[i] = comb_fis.output['result']
-
-    # save fuzzy inference system output as table
-    columns = np.column_stack((segid_array, out))
-    out_table = os.path.dirname(in_network) + "/" + out_field + "_Table.txt"
-    # TODO See if possible to skip this step
-    np.savetxt(out_table, columns, delimiter=",", header="ReachID, " + out_field, comments="")
-    occ_table = scratch + "/" + out_field + "Tbl"
-    arcpy.CopyRows_management(out_table, occ_table)
-
-    # join the fuzzy inference system output to the flowline network
-    # create empty dictionary to hold input table field values
-    tbl_dict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(occ_table, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            tbl_dict[row[0]] = row[1]
-    # populate flowline network out field
-    arcpy.AddField_management(in_network, out_field, 'DOUBLE')
-    with arcpy.da.UpdateCursor(in_network, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            try:
-                a_key = row[0]
-                row[1] = tbl_dict[a_key]
-                cursor.updateRow(row)
-            # TODO There should be no bare excepts. What kind of error is this trying to catch?
-            except:
-                pass
-    tbl_dict.clear()
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    #            density 'none' values are changed in the model
-    x = np.arange(0, 45, 0.01)
-    mfx_none = fuzz.trimf(x, [0, 0, 0.1])
-    defuzz_none = round(fuzz.defuzz(x, mfx_none, 'centroid'), 6)
-    mfx_pervasive = fuzz.trapmf(x, [12, 25, 45, 45])
-    defuzz_pervasive = round(fuzz.defuzz(x, mfx_pervasive, 'centroid'))
+    sidecar_file = os.path.join(sidecar_folder, out_field + "_FIS.npz")
+    out, num_evaluated, hit_rate = FIS_Engine.evaluate_incremental(FIS_Engine.COMB_FIS, segid_array,
+                                                                   comb_fis_inputs(table, veg_field),
+                                                                   sidecar_file, input_resolution, chunk_size,
+                                                                   processes)
+    arcpy.AddMessage("Reaches with new or changed inputs for " + out_field + ": " + str(num_evaluated) + " of " +
+                     str(len(segid_array)))
+    arcpy.AddMessage("Reaches that reused another reach's FIS result for " + out_field + ": " +
+                     str(round(hit_rate * 100, 1)) + "%")
 
     # update combined capacity (occ_*) values in stream network
+    # set occ_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
     # correct for occ_* greater than ovc_* as vegetation is most limiting factor in model
     # (i.e., combined fis value should not be greater than the vegetation capacity)
     # set occ_* to 0 if the drainage area is greater than the user defined threshold
     # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
-    # set occ_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
-
-    with arcpy.da.UpdateCursor(in_network, [out_field, veg_field, 'iGeo_DA', 'iGeo_Slope']) as cursor:
-        for row in cursor:
-            if round(row[0], 6) == defuzz_none:
-                row[0] = 0.0
-            if round(row[0]) >= defuzz_pervasive:
-                row[0] = 40.0
-            if row[0] > row[1]:
-                row[0] = row[1]
-            if row[2] >= float(max_da_thresh):
-                row[0] = 0.0
-            cursor.updateRow(row)
-
-    # delete temporary tables and arrays
-    arcpy.Delete_management(out_table)
-    arcpy.Delete_management(occ_table)
-    items = [columns, out, x, mfx_none, defuzz_none]
-    for item in items:
-        del item
+    out = correct_capacity(out, np.asarray(table[veg_field], np.float64), table['iGeo_DA'], max_da_thresh)
+    table.set_field(out_field, out)
 
     # calculate dam count (mCC_**_CT) for each reach as number of dams * reach length (in km)
-    arcpy.AddField_management(in_network, mcc_field, 'SHORT')
-    with arcpy.da.UpdateCursor(in_network, [mcc_field, out_field, 'iGeo_Len']) as cursor:
-        for row in cursor:
-            len_km = row[2] / 1000
-            raw_ct = row[1] * len_km
-            if 1 > raw_ct > 0:
-                row[0] = 1
-            else:
-                row[0] = round(raw_ct)
-            cursor.updateRow(row)
+    # reaches with less than one dam are rounded up to one
+    raw_ct = out * (np.asarray(table['iGeo_Len'], np.float64) / 1000)
+    count = np.where((raw_ct > 0) & (raw_ct < 1), 1, np.floor(raw_ct + 0.5)).astype(np.int32)
+    table.set_field(mcc_field, count, 'SHORT')
 
     # calculate dam count historic departure as difference between potential count and existing count
     if model_run == 'ex':
-        arcpy.AddField_management(in_network, 'mCC_HisDep', 'SHORT')
-        with arcpy.da.UpdateCursor(in_network, ['mCC_HisDep', 'mCC_EX_CT', 'mCC_HPE_CT']) as cursor:
-            for row in cursor:
-                row[0] = row[2] - row[1]
-                cursor.updateRow(row)
+        table.set_field('mCC_HisDep', table['mCC_HPE_CT'] - table['mCC_EX_CT'], 'SHORT')
+
+
+def comb_cap_sensitivity(table, max_da_thresh, num_sets, spread, chunk_size=FIS_Engine.DEFAULT_CHUNK_SIZE,
+                         seed=None):
+    """
+    Runs the existing capacity FIS with randomly perturbed membership function breakpoints, and adds the 5th,
+    50th and 95th percentile of oCC_EX for each reach to oCC_EX_P05, oCC_EX_P50 and oCC_EX_P95
+    :param table: The ReachTable of the BRAT network
+    :param max_da_thresh: The drainage area value above which the stream is assumed to not support dam building
+    :param num_sets: The number of perturbed sets of membership functions
+    :param spread: The largest relative change to any breakpoint (see FIS_Engine.perturbed_term_params)
+    :param chunk_size: The number of (set, reach) pairs to evaluate at once
+    :param seed: Seed for the random number generator
+    :return:
+    """
+    arcpy.AddMessage("Running capacity sensitivity analysis with " + str(num_sets) + " parameter sets...")
+    percentiles = [5, 50, 95]
+
+    # evaluate every parameter set on every reach as one batch
+    term_params = FIS_Engine.perturbed_term_params(FIS_Engine.COMB_FIS, num_sets, spread, seed)
+    out = FIS_Engine.evaluate_perturbed(FIS_Engine.COMB_FIS, comb_fis_inputs(table, 'oVC_EX'), term_params,
+                                        chunk_size)
+
+    # apply the same corrections comb_cap_fis applies to oCC_EX
+    out = correct_capacity(out, np.asarray(table['oVC_EX'], np.float64), table['iGeo_DA'], max_da_thresh)
+
+    out_percentiles = np.percentile(out, percentiles, axis=0)
+    for i, percentile in enumerate(percentiles):
+        table.set_field("oCC_EX_P" + str(percentile).zfill(2), out_percentiles[i])
 
 
 def add_xml_output(in_network, out_network):
@@ -0,0 +1,101 @@
+# -------------------------------------------------------------------------------
+# Name:        Conflict Curves
+# Purpose:     Scores conflict potential from its inputs with piecewise linear and step curves, over NumPy arrays.
+#              Doesn't use arcpy, so it can run outside ArcGIS
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# The conflict potential inputs, in the order they are scored
+CONFLICT_FIELDS = ["iPC_RoadX", "iPC_RoadAd", "iPC_Canal", "iPC_RR", "iPC_LU"]
+
+
+def default_curves(CrossingLow=10, CrossingHigh=100, AdjLow=10, AdjHigh=100, CanalLow=50, CanalHigh=200, RRLow=30,
+                   RRHigh=100):
+    """
+    Makes the standard conflict potential scoring curves: a distance decay curve for each distance input, and the
+    land use intensity steps
+    :return: A dictionary of input field to scoring curve
+    """
+    return {"iPC_RoadX": distance_curve(CrossingLow, CrossingHigh),
+            "iPC_RoadAd": distance_curve(AdjLow, AdjHigh),
+            "iPC_Canal": distance_curve(CanalLow, CanalHigh),
+            "iPC_RR": distance_curve(RRLow, RRHigh),
+            "iPC_LU": {"type": "step",
+                       "steps": [[1.0, 0.99], [0.66, 0.75], [0.33, 0.5], [0, 0.25, ">"]],
+                       "default": 0.01}}
+
+
+def distance_curve(low, high):
+    """
+    Makes a distance decay curve: distances up to low score 0.99, distances over high score 0.01, and distances in
+    between are scored along the line between the two
+    :param low: The distance at and below which conflict potential is highest
+    :param high: The distance above which conflict potential is lowest
+    :return: The scoring curve
+    """
+    return {"type": "linear",
+            "points": [[float(low), 0.99], [float(high), 0.01]],
+            "default": 0.01}
+
+
+def score_curve(values, curve):
+    """
+    Scores an array of values with a piecewise linear or step curve (see Conflict_Potential.load_curves)
+    :param values: Array of input values
+    :param curve: The scoring curve
+    :return: Array of scores
+    """
+    values = np.asarray(values, np.float64)
+    default = curve.get("default", 0.01)
+    if curve["type"] == "linear":
+        points = np.array(sorted(curve["points"]), np.float64)
+        score = np.interp(values, points[:, 0], points[:, 1])
+    elif curve["type"] == "step":
+        conditions = [values > step[0] if len(step) > 2 and step[2] == ">" else values >= step[0]
+                      for step in curve["steps"]]
+        score = np.select(conditions, [step[1] for step in curve["steps"]], default)
+    else:
+        raise Exception("Unknown conflict potential curve type: " + str(curve["type"]))
+
+    # negative distances and missing values are given the default score
+    return np.where(values >= 0, score, default)
+
+
+def score_conflict(table, curves):
+    """
+    Scores every conflict potential input the table has, and takes the highest score of each reach
+    :param table: A ReachTable, or a dictionary of field name to array
+    :param curves: A dictionary of input field to scoring curve
+    :return: Array of conflict potential scores. Reaches with no inputs score 0
+    """
+    scores = [score_curve(table[field], curves[field]) for field in CONFLICT_FIELDS
+              if field in table and field in curves]
+    if len(scores) == 0:
+        return np.zeros(len(table["ReachID"]))
+    return np.fmax.reduce(np.vstack(scores), axis=0)
+
+
+def find_distance_score(distance, low, high):
+    """
+    Scores conflict potential from the distance to a human feature, with a distance decay curve (see distance_curve)
+    :param distance: Array of distances to the feature
+    :param low: The distance at and below which conflict potential is highest
+    :param high: The distance above which conflict potential is lowest
+    :return: Array of conflict potential scores
+    """
+    return score_curve(distance, distance_curve(low, high))
+
+
+def find_landuse_score(lu):
+    """
+    Scores conflict potential from the land use intensity of the area around a reach
+    :param lu: Array of land use intensities
+    :return: Array of conflict potential scores
+    """
+    return score_curve(lu, default_curves()["iPC_LU"])
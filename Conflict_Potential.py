@@ -10,11 +10,27 @@
 # -------------------------------------------------------------------------------
 
 import arcpy
-import numpy as np
+import json
 import os
 import sys
 import projectxml
 from SupportingFunctions import getUUID
+import ReachTable
+import Conflict_Curves
+reload(ReachTable)
+reload(Conflict_Curves)
+ReachTable = ReachTable.ReachTable
+
+# The conflict potential inputs calc_conflict reads, if the network has them
+CONFLICT_FIELDS = Conflict_Curves.CONFLICT_FIELDS
+
+# The scoring curves are in Conflict_Curves
+default_curves = Conflict_Curves.default_curves
+distance_curve = Conflict_Curves.distance_curve
+score_curve = Conflict_Curves.score_curve
+score_conflict = Conflict_Curves.score_conflict
+find_distance_score = Conflict_Curves.find_distance_score
+find_landuse_score = Conflict_Curves.find_landuse_score
 
 
 def main(
@@ -27,7 +43,9 @@ def main(
     CanalLow,
     CanalHigh,
     RRLow,
-    RRHigh):
+    RRHigh,
+    curve_file=None,
+    region=None):
 
     scratch = 'in_memory'
 
@@ -41,14 +59,16 @@ def main(
     # CanalHigh = 200
     # RRLow = 30
     # RRHigh = 100
-    out_network = find_oPC_Score(in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch)
+    out_network = find_oPC_Score(in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch,
+                                 curve_file, region)
 
     add_xml_output(projPath, in_network, out_network)
 
     makeLayers(out_network)
 
 
-def find_oPC_Score(in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch):
+def find_oPC_Score(in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch,
+                   curve_file=None, region=None):
     # if out_name.endswith('.shp'):
     #     out_network = os.path.join(os.path.dirname(in_network), out_name)
     # else:
@@ -62,173 +82,67 @@ def find_oPC_Score(in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, Canal
     if "oPC_Score" in fields:
         arcpy.DeleteField_management(out_network, "oPC_Score")
 
-    # create segid array for joining output
-    segid_np = arcpy.da.FeatureClassToNumPyArray(out_network, "ReachID")
-    segid_array = np.asarray(segid_np, np.int64)
-
-    # road crossing conflict
-    if "iPC_RoadX" in fields:
-        roadx_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RoadX")
-        roadx = np.asarray(roadx_array, np.float64)
-        roadx_pc = np.empty_like(roadx)
-        m = slopeInt(CrossingLow, CrossingHigh)[0]
-        b = slopeInt(CrossingLow, CrossingHigh)[1]
-        for i in range(len(roadx)):
-            if roadx[i] >= 0 and roadx[i] <= CrossingLow:
-                roadx_pc[i] = 0.99
-            elif roadx[i] > CrossingLow and roadx[i] <= CrossingHigh:
-                roadx_pc[i] = m * roadx[i] + b
-            elif roadx[i] > CrossingHigh:
-                roadx_pc[i] = 0.01
-            else:
-                roadx_pc[i] = 0.01
-
-        del roadx_array, roadx, m, b
-    else:
-        roadx_pc = np.zeros_like(segid_array)
-
-    # road adjacent conflict
-    if "iPC_RoadAd" in fields:
-        roadad_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RoadAd")
-        roadad = np.asarray(roadad_array, np.float64)
-        #roadad_pc = np.zeros_like(roadad)
-        roadad_pc = np.empty_like(roadad)
-        m = slopeInt(AdjLow, AdjHigh)[0]
-        b = slopeInt(AdjLow, AdjHigh)[1]
-        for i in range(len(roadad)):
-            if roadad[i] >= 0 and roadad[i] <= AdjLow:
-                roadad_pc[i] = 0.99
-            elif roadad[i] > AdjLow and roadad[i] <= AdjHigh:
-                roadad_pc[i] = m * roadad[i] + b
-            elif roadad[i] > AdjHigh:
-                roadad_pc[i] = 0.01
-            else:
-                roadad_pc[i] = 0.01
-
-        del roadad_array, roadad, m, b
-    else:
-        roadad_pc = np.zeros_like(segid_array)
-
-    # canal conflict
-    if "iPC_Canal" in fields:
-        canal_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_Canal")
-        canal = np.asarray(canal_array, np.float64)
-        #canal_pc = np.zeros_like(canal)
-        canal_pc = np.empty_like(canal)
-        m = slopeInt(CanalLow, CanalHigh)[0]
-        b = slopeInt(CanalLow, CanalHigh)[1]
-        for i in range(len(canal)):
-            if canal[i] >= 0 and canal[i] <= CanalLow:
-                canal_pc[i] = 0.99
-            elif canal[i] > CanalLow and canal[i] <= CanalHigh:
-                canal_pc[i] = m * canal[i] + b
-            elif canal[i] > CanalHigh:
-                canal_pc[i] = 0.01
-            else:
-                canal_pc[i] = 0.01
-
-        del canal_array, canal, m, b
-    else:
-        canal_pc = np.zeros_like(segid_array)
-
-    # railroad conflict
-    if "iPC_RR" in fields:
-        rr_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RR")
-        rr = np.asarray(rr_array, np.float64)
-        #rr_pc = np.zeros_like(rr)
-        rr_pc = np.empty_like(rr)
-        m = slopeInt(RRLow, RRHigh)[0]
-        b = slopeInt(RRLow, RRHigh)[1]
-        for i in range(len(rr)):
-            if rr[i] >= 0 and rr[i] <= RRLow:
-                rr_pc[i] = 0.99
-            elif rr[i] > RRLow and rr[i] <= RRHigh:
-                rr_pc[i] = m * rr[i] + b
-            elif rr[i] > RRHigh:
-                rr_pc[i] = 0.01
-            else:
-                rr_pc[i] = 0.01
+    # read whichever conflict inputs the network has
+    table = ReachTable.load(out_network, [field for field in CONFLICT_FIELDS if field in fields])
 
-        del rr_array, rr, m, b
-    else:
-        rr_pc = np.zeros_like(segid_array)
-
-    # landuse conflict
-    if "iPC_LU" in fields:
-        lu_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_LU")
-        lu = np.asarray(lu_array, np.float64)
-        lu_pc = np.empty_like(lu)
-
-        # for i in range(len(lu)):
-        #     if lu[i] >= 2:
-        #         lu_pc[i] = 0.75
-        #     elif lu[i] >= 1.25 and lu[i] < 2:
-        #         lu_pc[i] = 0.5
-        #     elif lu[i] < 1.25:
-        #         lu_pc[i] = 0.01
-        #     else:
-        #         lu_pc[i] = 0.01
-
-        for i in range(len(lu)):
-            if lu[i] >= 1.0:
-                lu_pc[i] = 0.99
-            elif lu[i] >= 0.66 and lu[i] < 1.0:
-                lu_pc[i] = 0.75
-            elif lu[i] >= 0.33 and lu[i] < 0.66:
-                lu_pc[i] = 0.5
-            elif lu[i] > 0 and lu[i] < 0.33:
-                lu_pc[i] = 0.25
-            else:
-                lu_pc[i] = 0.01
-    else:
-        lu_pc = np.zeros_like(segid_array)
+    calc_conflict(table, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, curve_file,
+                  region)
 
-    # get max of all individual conflict potential scores
-    # this is our conflict potential output
-    oPC_Score = np.fmax(roadx_pc, np.fmax(roadad_pc, np.fmax(canal_pc, np.fmax(rr_pc, lu_pc))))
+    # join the output to the flowline network
+    table.flush(out_network)
 
-    # save the output text file
-    columns = np.column_stack((segid_array, oPC_Score))
-    out_table = os.path.dirname(out_network) + "/oPC_Score_Table.txt"
-    np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, oPC_Score", comments = "")
+    return out_network
 
-    opc_score_table = scratch + "/opc_score_table"
-    arcpy.CopyRows_management(out_table, opc_score_table)
 
-    # join the output to the flowline network
-    # create empty dictionary to hold input table field values
-    tblDict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(opc_score_table, ['ReachID', 'oPC_Score']) as cursor:
-        for row in cursor:
-            tblDict[row[0]] = row[1]
-    # populate flowline network out field
-    arcpy.AddField_management(out_network, 'oPC_Score', 'DOUBLE')
-    with arcpy.da.UpdateCursor(out_network, ['ReachID', 'oPC_Score']) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = tblDict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    tblDict.clear()
-
-    arcpy.Delete_management(out_table)
-    arcpy.Delete_management(opc_score_table)
+def calc_conflict(table, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh,
+                  curve_file=None, region=None):
+    """
+    Adds conflict potential (oPC_Score) to a reach table, as the highest of the conflict potential scores of the
+    inputs the table has. Missing inputs score 0
+    :param table: The ReachTable of the BRAT network
+    :param CrossingLow: The road crossing distance at and below which conflict potential is highest
+    :param CrossingHigh: The road crossing distance above which conflict potential is lowest
+    :param AdjLow: The adjacent road distance at and below which conflict potential is highest
+    :param AdjHigh: The adjacent road distance above which conflict potential is lowest
+    :param CanalLow: The canal distance at and below which conflict potential is highest
+    :param CanalHigh: The canal distance above which conflict potential is lowest
+    :param RRLow: The railroad distance at and below which conflict potential is highest
+    :param RRHigh: The railroad distance above which conflict potential is lowest
+    :param curve_file: An optional JSON file of scoring curves that replace the ones above (see load_curves)
+    :param region: The region whose curves are used from the curve file
+    :return:
+    """
+    curves = default_curves(CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh)
+    if curve_file is not None and curve_file != '' and curve_file != '#':
+        curves.update(load_curves(curve_file, region))
 
-    return out_network
+    table.set_field("oPC_Score", score_conflict(table, curves))
 
 
-# function to calculate slope-intercept equation based on user inputs
-def slopeInt(lowValue, highValue):
-    x1 = lowValue
-    y1 = 0.99
-    x2 = highValue
-    y2 = 0.01
-    m = (y2 - y1)/(x2 - x1) # calculate slope
-    b = y1 - (m * x1) # calculate y-intercept
-    return [m, b]
+def load_curves(curve_file, region=None):
+    """
+    Reads conflict potential scoring curves from a JSON file, so curves can be set for each region without editing
+    code. The file holds a "default" entry and an entry for any region, each a dictionary of input field to curve.
+    A region's curves replace the default curves for the fields it lists. A curve is either
+        {"type": "linear", "points": [[x, score], ...], "default": score}
+    which interpolates between points (sorted by x) and holds the end scores past either end, or
+        {"type": "step", "steps": [[threshold, score], ...], "default": score}
+    which gives the score of the first step whose threshold the value is greater than or equal to. A step can have a
+    third item, ">", to require the value to be strictly greater. Negative or missing values get the default score
+    in either type
+    :param curve_file: The JSON file
+    :param region: The region to use curves for. If None, only the default curves are used
+    :return: A dictionary of input field to scoring curve
+    """
+    with open(curve_file) as f:
+        all_curves = json.load(f)
+    curves = dict(all_curves.get("default", {}))
+    if region is not None and region != '' and region != '#':
+        if str(region) not in all_curves:
+            arcpy.AddWarning("No conflict potential curves for region " + str(region) + " in " + curve_file +
+                             ", so the default curves were used")
+        curves.update(all_curves.get(str(region), {}))
+    return curves
 
 
 def add_xml_output(projPath, in_network, out_network):
@@ -0,0 +1,155 @@
+# -------------------------------------------------------------------------------
+# Name:        Conservation Rules
+# Purpose:     Holds the ordered rule tables of the constraints and opportunities model, and classifies reaches by
+#              them over whole columns
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# The ordered rule tables that assign each category. Each rule is a category and a list of conditions that must all
+# be true; the first rule a reach meets gives its category, and reaches that meet no rule get the default. A
+# condition is [field, operator, value], or {"any": [conditions]} when any one of several conditions is enough.
+# Operators are <, <=, >, >=, ==, != and "in" (value is a list). VegDep is oVC_HPE - oVC_EX. Any of these tables can
+# be replaced by a rule file (see Constraints_Opportunities.load_rule_tables)
+RULE_TABLES = {
+    # Areas beavers can build dams, but could be undesirable impacts
+    "oPBRC_UI": {
+        "default": "Negligible Risk",
+        "rules": [
+            # if capacity is none risk is negligible
+            ["Negligible Risk", [["oCC_EX", "<=", 0]]],
+            # if canals are within 20 meters (usually means canal is on the reach)
+            ["Major Risk", [["iPC_Canal", "<=", 20]]],
+            # if infrastructure within 30 m or land use is high
+            # if capacity is frequent or pervasive risk is considerable
+            # if capaicty is rare or ocassional risk is some
+            ["Major Risk", [{"any": [["oPC_Dist", "<=", 30], ["iPC_LU", ">=", 0.66]]}, ["oCC_EX", ">=", 5.0]]],
+            ["Considerable Risk", [{"any": [["oPC_Dist", "<=", 30], ["iPC_LU", ">=", 0.66]]}]],
+            # if infrastructure within 30 to 100 m
+            # if capacity is frequent or pervasive risk is some
+            # if capacity is rare or ocassional risk is minor
+            ["Considerable Risk", [["oPC_Dist", "<=", 100], ["oCC_EX", ">=", 5.0]]],
+            ["Minor Risk", [["oPC_Dist", "<=", 100]]],
+            # if infrastructure within 100 to 300 m or land use is 0.33 to 0.66 risk is minor
+            ["Minor Risk", [{"any": [["oPC_Dist", "<=", 300], ["iPC_LU", ">=", 0.33]]}]]]},
+
+    # Areas beavers can't build dams and why
+    "oPBRC_UD": {
+        "default": "Dam Building Possible",
+        "rules": [
+            # First deal with vegetation limitations
+            # Find places historically veg limited first ('oVC_HPE' None)
+            # 'oVC_EX' Occasional, Frequent, or Pervasive (some areas have oVC_EX > oVC_HPE)
+            ["Potential Reservoir or Landuse Conversion", [["oVC_HPE", "<=", 0], ["oVC_EX", ">", 0]]],
+            ["Naturally Vegetation Limited", [["oVC_HPE", "<=", 0]]],
+            # 'iGeo_Slope' > 23%
+            ["Slope Limited", [["iGeo_Slope", ">", 0.23]]],
+            # 'oCC_EX' None (Primary focus of this layer is the places that can't support dams now... so why?)
+            ["Anthropogenically Limited", [["oCC_EX", "<=", 0], ["iPC_LU", ">", 0.3]]],
+            ["Stream Power Limited", [["oCC_EX", "<=", 0],
+                                      {"any": [["iHyd_SPLow", ">=", 190], ["iHyd_SP2", ">=", 2400]]}]],
+            ["Stream Size Limited", [["oCC_EX", "<=", 0]]]]},
+
+    # Conservation & Restoration Opportunties, for reaches where 'oPBRC_UI' is Negligible Risk or Minor Risk
+    # 'iPC_VLowLU' is natural land use and 'iPC_HighLU' is developed land use
+    "oPBRC_CR": {
+        "default": "NA",
+        "rules": [
+            # 'oCC_EX' Frequent or Pervasive
+            # 'mCC_HisDep' <= 3
+            ["Easiest - Low-Hanging Fruit", [["oPBRC_UI", "in", ["Negligible Risk", "Minor Risk"]],
+                                             ["oCC_EX", ">=", 5], ["mCC_HisDep", "<=", 3]]],
+            # 'oCC_EX' Occasional, Frequent, or Pervasive
+            # 'oCC_HPE' Frequent or Pervasive
+            # 'mCC_HisDep' <= 3
+            # 'iPC_VLowLU' > 75 and 'iPC_HighLU' < 10
+            ["Straight Forward - Quick Return", [["oPBRC_UI", "in", ["Negligible Risk", "Minor Risk"]],
+                                                 ["oCC_EX", ">", 1], ["mCC_HisDep", "<=", 3],
+                                                 ["oCC_HPE", ">=", 5], ["iPC_VLowLU", ">", 75],
+                                                 ["iPC_HighLU", "<", 10]]],
+            # 'oCC_EX' Rare or Occasional
+            # 'oCC_HPE' Frequent or Pervasive
+            # 'iPC_VLowLU' > 75 and 'iPC_HighLU' < 10
+            ["Strategic - Long-Term Investment", [["oPBRC_UI", "in", ["Negligible Risk", "Minor Risk"]],
+                                                  ["oCC_HPE", ">=", 5], ["oCC_EX", "<", 5], ["oCC_EX", ">", 0],
+                                                  ["iPC_VLowLU", ">", 75], ["iPC_HighLU", "<", 10]]]]},
+
+    # beaver dam management strategies (derived from TNC project)
+    # urban land use is over 0.66, and agricultural land use is over 0.33 up to 0.66
+    "DamStrat": {
+        "default": "Other",
+        "rules": [
+            ["1. Beaver conservation", [["ObsDam", "==", "Yes"], ["iPC_LU", "<=", 0.33]]],
+            ["6. Restoration with urban or agricultural modification", [["oCC_EX", ">=", 1], ["iPC_LU", ">", 0.33]]],
+            ["5. Restoration with infrastructure modification", [["oCC_EX", ">=", 1], ["oPC_Dist", "<=", 30]]],
+            ["4a. Vegetation restoration first-priority", [["oCC_EX", ">=", 1], ["oCC_EX", "<", 5],
+                                                           ["iPC_LU", "<=", 0.66], ["VegDep", ">=", 4]]],
+            ["4. Medium-low restoration potential", [["oCC_EX", ">=", 1], ["oCC_EX", "<", 5],
+                                                     ["iPC_LU", "<=", 0.66]]],
+            ["2. Highest restoration potential - translocation", [["oCC_EX", ">=", 20],
+                                                                  {"any": [["ConsArea", "==", "Yes"],
+                                                                           ["ConsEase", "==", "Yes"]]}]],
+            ["3a. Vegetation restoration first-priority", [["oCC_EX", ">=", 5], ["iPC_LU", "<=", 0.66],
+                                                           ["VegDep", ">=", 4]]],
+            ["3. High restoration potential", [["oCC_EX", ">=", 5], ["iPC_LU", "<=", 0.66]]]]}}
+
+
+def classify(columns, rule_table):
+    """
+    Assigns each reach the category of the first rule it meets in an ordered rule table (see RULE_TABLES)
+    :param columns: A dictionary of field name to array, with every field the rule table uses
+    :param rule_table: The rule table
+    :return: Array of categories
+    """
+    num_reaches = len(next(iter(columns.values())))
+    conditions = []
+    for category, rule in rule_table["rules"]:
+        met = np.ones(num_reaches, dtype=bool)
+        for condition in rule:
+            met &= evaluate_condition(columns, condition)
+        conditions.append(met)
+    categories = [str(category) for category, rule in rule_table["rules"]]
+    return np.select(conditions, categories, str(rule_table["default"]))
+
+
+def evaluate_condition(columns, condition):
+    """
+    Evaluates one condition of a rule for every reach
+    :param columns: A dictionary of field name to array
+    :param condition: [field, operator, value], or {"any": [conditions]}
+    :return: Array of whether each reach meets the condition
+    """
+    if isinstance(condition, dict):
+        met = None
+        for any_condition in condition["any"]:
+            any_met = evaluate_condition(columns, any_condition)
+            met = any_met if met is None else met | any_met
+        return met
+
+    field, operator, value = condition
+    if field not in columns:
+        raise Exception("The rule tables use " + field + ", which is not in the network")
+    column = columns[field]
+    if operator == "in":
+        met = np.zeros(len(column), dtype=bool)
+        for item in value:
+            met |= column == item
+        return met
+    elif operator == "==":
+        return column == value
+    elif operator == "!=":
+        return column != value
+    elif operator == "<":
+        return column < value
+    elif operator == "<=":
+        return column <= value
+    elif operator == ">":
+        return column > value
+    elif operator == ">=":
+        return column >= value
+    raise Exception("Unknown rule operator: " + str(operator))
@@ -10,16 +10,42 @@
 # -------------------------------------------------------------------------------
 
 import arcpy
+import json
+import numpy as np
 import sys
 import os
 import projectxml
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path, write_xml_element_with_path
+import Conservation_Rules
+import ReachTable
+import SpatialIndex
 import XMLBuilder
+reload(Conservation_Rules)
+reload(ReachTable)
+reload(SpatialIndex)
 reload(XMLBuilder)
+ReachTable = ReachTable.ReachTable
 XMLBuilder = XMLBuilder.XMLBuilder
 
 
-def main(proj_path, in_network, out_name, surveyed_dams=None, conservation_areas=None, conservation_easements=None):
+# The rule tables, and classifying reaches by them, are in Conservation_Rules
+RULE_TABLES = Conservation_Rules.RULE_TABLES
+classify = Conservation_Rules.classify
+evaluate_condition = Conservation_Rules.evaluate_condition
+
+# The fields calc_conservation reads that come from the BRAT table, rather than from the capacity model stages
+BRAT_TABLE_FIELDS = ['iPC_VLowLU', 'iPC_HighLU', 'oPC_Dist', 'iPC_LU', 'iPC_Canal']
+
+# The largest distance in meters from a surveyed dam to the reach it is on
+DAM_SNAP_DISTANCE = 60
+
+# The length of each text field the model adds
+TEXT_FIELD_LENGTHS = [("oPBRC_UI", 30), ("oPBRC_UD", 30), ("oPBRC_CR", 40), ("DamStrat", 60), ("ObsDam", 10),
+                      ("ConsArea", 10), ("ConsEase", 10)]
+
+
+def main(proj_path, in_network, out_name, surveyed_dams=None, conservation_areas=None, conservation_easements=None,
+         rule_file=None, region=None):
     """
     For each stream segment, assigns a conservation and restoration class
     :param proj_path: The file path to the BRAT project folder
@@ -28,263 +54,217 @@ def main(proj_path, in_network, out_name, surveyed_dams=None, conservation_areas
     :param surveyed_dams: The dams shapefile
     :param conservation_areas: The conservation areas shapefile
     :param conservation_easements: The conservation easements shapefile
+    :param rule_file: An optional JSON file of rule tables that replace the ones in RULE_TABLES
+    :param region: The region whose rule tables are used from the rule file
     :return:
     """
     arcpy.env.overwriteOutput = True
 
+    if surveyed_dams == '' or surveyed_dams == '#':
+        surveyed_dams = None
+    if conservation_areas == '' or conservation_areas == '#':
+        conservation_areas = None
+    if conservation_easements == '' or conservation_easements == '#':
+        conservation_easements = None
+
+    rule_tables = dict(RULE_TABLES)
+    if rule_file is not None and rule_file != '' and rule_file != '#':
+        rule_tables.update(load_rule_tables(rule_file, region))
+
     out_network = os.path.dirname(in_network) + "/" + out_name + ".shp"
     arcpy.CopyFeatures_management(in_network, out_network)
 
+    # only add the strategies map fields if running this part of the model
+    run_strategies = conservation_areas is not None and surveyed_dams is not None
+    add_output_fields(out_network, run_strategies)
+
+    table = ReachTable.load(out_network, [])
+    calc_conservation(table, out_network, surveyed_dams, conservation_areas, conservation_easements, rule_tables)
+    table.flush(out_network)
+
+    make_layers(out_network)
+
+    write_xml(in_network, out_network)
+
+    return out_network
+
+
+def add_output_fields(out_network, run_strategies):
+    """
+    Replaces the text fields the model writes, so they have the right lengths
+    :param out_network: The network the model writes to
+    :param run_strategies: If true, the strategies map fields are added too
+    :return:
+    """
     # check for oPBRC fields and delete if exists
     old_fields = [f.name for f in arcpy.ListFields(out_network)]
-    cons_rest_fields = ["oPBRC_UI", "oPBRC_UD", "oPBRC_CR", "DamStrat", "ObsDam", "ConsRest", "ConsEase"]
-    for f in cons_rest_fields:
+    for f, length in TEXT_FIELD_LENGTHS:
         if f in old_fields:
             arcpy.DeleteField_management(out_network, f)
 
-    # add all new fields
-    arcpy.AddField_management(out_network, "oPBRC_UI", "TEXT", "", "", 30)
-    arcpy.AddField_management(out_network, "oPBRC_UD", "TEXT", "", "", 30)
-    arcpy.AddField_management(out_network, "oPBRC_CR", "TEXT", "", "", 40)
-    arcpy.AddField_management(out_network, "DamStrat", "TEXT", "", "", 60)
-    arcpy.AddField_management(out_network, "ObsDam", "TEXT", "", "", 10)
-    arcpy.AddField_management(out_network, "ConsArea", "TEXT", "", "", 10)
-    arcpy.AddField_management(out_network, "ConsEase", "TEXT", "", "", 10)
+    for f, length in TEXT_FIELD_LENGTHS:
+        if run_strategies or f not in ["DamStrat", "ObsDam", "ConsArea", "ConsEase"]:
+            arcpy.AddField_management(out_network, f, "TEXT", "", "", length)
+
+
+def calc_conservation(table, network, surveyed_dams=None, conservation_areas=None, conservation_easements=None,
+                      rule_tables=None):
+    """
+    Adds the conservation and restoration classes (oPBRC_UI, oPBRC_UD, oPBRC_CR and, with surveyed dams and
+    conservation areas, the strategies map fields) to a reach table. Inputs the table doesn't have yet are read
+    from the network
+    :param table: The ReachTable of the BRAT network
+    :param network: The network the table belongs to, with the combined capacity and iPC fields
+    :param surveyed_dams: The dams shapefile, or None
+    :param conservation_areas: The conservation areas shapefile, or None
+    :param conservation_easements: The conservation easements shapefile, or None
+    :param rule_tables: A dictionary of output field to rule table. Defaults to RULE_TABLES
+    :return:
+    """
+    if rule_tables is None:
+        rule_tables = RULE_TABLES
+    network_fields = [f.name.lower() for f in arcpy.ListFields(network)]
+
+    def has_field(field):
+        return field in table or field.lower() in network_fields
 
     # use old historic capacity field names if new ones not in combined capacity output
-    if 'oVC_PT' in old_fields:
+    if has_field('oVC_PT'):
         ovc_hpe = 'oVC_PT'
     else:
         ovc_hpe = 'oVC_Hpe'
 
-    if 'oCC_PT' in old_fields:
+    if has_field('oCC_PT'):
         occ_hpe = 'oCC_PT'
     else:
         occ_hpe = 'oCC_HPE'
 
-    fields = ['oPBRC_UI', 'oPBRC_UD', 'oPBRC_CR', ovc_hpe, 'oVC_EX', occ_hpe, 'oCC_EX', 'iGeo_Slope', 'mCC_HisDep',
-              'iPC_VLowLU', 'iPC_HighLU', 'oPC_Dist', 'iPC_LU', 'iHyd_SPLow', 'iHyd_SP2', 'DamStrat', 'iPC_RoadX',
-              'iPC_Canal', 'ObsDam', 'ConsArea', 'ConsEase']
-
-    # add arbitrarily large value to avoid error
-    if 'iPC_Canal' not in old_fields:
-        arcpy.AddField_management(out_network, "iPC_Canal", "DOUBLE")
-        arcpy.CalculateField_management(out_network, 'iPC_Canal', """500000""", "PYTHON")
-
-    # 'oPBRC_UI' (Areas beavers can build dams, but could be undesireable impacts)
-    # arcpy.AddMessage(fields)
-    # field_check = [f.name for f in arcpy.ListFields(out_network)]
-    # arcpy.AddMessage("--------------------")
-    # arcpy.AddMessage(field_check)
-    with arcpy.da.UpdateCursor(out_network, fields) as cursor:
-        for row in cursor:
-
-            occ_ex = row[6]
-            opc_dist = row[11]
-            ipc_lu = row[12]
-            ipc_canal = row[17]
-            
-            if occ_ex <= 0:
-                # if capacity is none risk is negligible
-                row[0] = "Negligible Risk"
-            elif ipc_canal <= 20:
-                # if canals are within 20 meters (usually means canal is on the reach)
-                row[0] = "Major Risk"
-            else:
-                # if infrastructure within 30 m or land use is high
-                # if capacity is frequent or pervasive risk is considerable
-                # if capaicty is rare or ocassional risk is some
-                if opc_dist <= 30 or ipc_lu >= 0.66:
-                    if occ_ex >= 5.0:
-                        row[0] = "Major Risk"
-                    else:
-                        row[0] = "Considerable Risk"
-                # if infrastructure within 30 to 100 m
-                # if capacity is frequent or pervasive risk is some
-                # if capacity is rare or ocassional risk is minor
-                elif opc_dist <= 100:
-                    if occ_ex >= 5.0:
-                        row[0] = "Considerable Risk"
-                    else:
-                        row[0] = "Minor Risk"
-                # if infrastructure within 100 to 300 m or land use is 0.33 to 0.66 risk is minor
-                elif opc_dist <= 300 or ipc_lu >= 0.33:
-                    row[0] = "Minor Risk"
-                else:
-                    row[0] = "Negligible Risk"
-
-            cursor.updateRow(row)
-
-    # 'oPBRC_UD' (Areas beavers can't build dams and why)
-    with arcpy.da.UpdateCursor(out_network, fields) as cursor:
-        for row in cursor:
-
-            ovc_hpe = row[3]
-            ovc_ex = row[4]
-            occ_ex = row[6]
-            slope = row[7]
-            landuse = row[12]
-            splow = row[13]
-            sp2 = row[14]
-
-            # First deal with vegetation limitations
-            # Find places historically veg limited first ('oVC_HPE' None)
-            if ovc_hpe <= 0:
-                # 'oVC_EX' Occasional, Frequent, or Pervasive (some areas have oVC_EX > oVC_HPE)
-                if ovc_ex > 0:
-                    row[1] = 'Potential Reservoir or Landuse Conversion'
-                else:    
-                    row[1] = 'Naturally Vegetation Limited'    
-            # 'iGeo_Slope' > 23%
-            elif slope > 0.23:
-                row[1] = 'Slope Limited'
-            # 'oCC_EX' None (Primary focus of this layer is the places that can't support dams now... so why?)
-            elif occ_ex <= 0:
-                if landuse > 0.3:
-                    row[1] = "Anthropogenically Limited"
-                elif splow >= 190 or sp2 >= 2400:
-                    row[1] = "Stream Power Limited"
-                else:
-                    row[1] = "Stream Size Limited"
-            else:
-                row[1] = 'Dam Building Possible'
-
-            cursor.updateRow(row)
-
-    # 'oPBRC_CR' (Conservation & Restoration Opportunties)
-    with arcpy.da.UpdateCursor(out_network, fields) as cursor:
-        for row in cursor:
-            # 'oPBRC_UI' Negligible Risk or Minor Risk
-            opbrc_ui = row[0]
-            occ_hpe = row[5]
-            occ_ex = row[6]
-            mcc_his_dep = row[8]
-            ipc_vlow_lu = row[9]
-            ipc_high_lu = row[10]
-            if opbrc_ui == 'Negligible Risk' or opbrc_ui == 'Minor Risk':
-                # 'oCC_EX' Frequent or Pervasive
-                # 'mcc_his_dep' <= 3
-                if occ_ex >= 5 and mcc_his_dep <= 3:
-                    row[2] = 'Easiest - Low-Hanging Fruit'
-                # 'oCC_EX' Occasional, Frequent, or Pervasive
-                # 'oCC_HPE' Frequent or Pervasive
-                # 'mcc_his_dep' <= 3
-                # 'ipc_vlow_lu'(i.e., Natural) > 75
-                # 'ipc_high_lu' (i.e., Developed) < 10
-                elif occ_ex > 1 and mcc_his_dep <= 3 and occ_hpe >= 5 and ipc_vlow_lu > 75 and ipc_high_lu < 10:
-                    row[2] = 'Straight Forward - Quick Return'
-                # 'oCC_EX' Rare or Occasional
-                # 'oCC_HPE' Frequent or Pervasive
-                # 'ipc_vlow_lu'(i.e., Natural) > 75
-                # 'ipc_high_lu' (i.e., Developed) < 10
-                elif occ_hpe >= 5 > occ_ex > 0 and ipc_vlow_lu > 75 and ipc_high_lu < 10:
-                    row[2] = 'Strategic - Long-Term Investment'
-                else:
-                    row[2] = 'NA'
-            else:
-                row[2] = 'NA'
-            cursor.updateRow(row)
+    fields = [ovc_hpe, 'oVC_EX', occ_hpe, 'oCC_EX', 'iGeo_Slope', 'mCC_HisDep', 'iPC_VLowLU', 'iPC_HighLU', 'oPC_Dist',
+              'iPC_LU', 'iHyd_SPLow', 'iHyd_SP2']
+    has_canals = has_field('iPC_Canal')
+    if has_canals:
+        fields.append('iPC_Canal')
+    table.load_fields(network, fields)
+
+    # the rule tables use the current field names
+    columns = dict((field, table[field]) for field in fields)
+    columns['oVC_HPE'] = table[ovc_hpe]
+    columns['oCC_HPE'] = table[occ_hpe]
+    columns['VegDep'] = np.asarray(table[ovc_hpe], np.float64) - np.asarray(table['oVC_EX'], np.float64)
+    if not has_canals:
+        # no canals, so use an arbitrarily large distance
+        columns['iPC_Canal'] = np.full(len(table.reach_ids()), 500000.0)
+
+    for out_field in ["oPBRC_UI", "oPBRC_UD", "oPBRC_CR"]:
+        columns[out_field] = classify(columns, rule_tables[out_field])
+        table.set_field(out_field, columns[out_field], 'TEXT')
 
     if conservation_areas is not None and surveyed_dams is not None:
-        # beaver dam management strategies (derived from TNC project)
-        with arcpy.da.UpdateCursor(out_network, ["ObsDam", "ConsArea", "ConsEase"]) as cursor:
-            for row in cursor:
-                row[0] = "No"
-                row[1] = "No"
-                row[2] = "No"
-                cursor.updateRow(row)
-
-        network_lyr = arcpy.MakeFeatureLayer_management(out_network, "network_lyr")
-
-        dams = os.path.join(proj_path, 'tmp_snapped_dams.shp')
-        arcpy.CopyFeatures_management(surveyed_dams, dams)
-        arcpy.Snap_edit(dams, [[out_network, 'EDGE', '60 Meters']])
-        arcpy.SelectLayerByLocation_management(network_lyr, "INTERSECT", dams, '', "NEW_SELECTION")
-        with arcpy.da.UpdateCursor(network_lyr, ["ObsDam"]) as cursor:
-            for row in cursor:
-                row[0] = "Yes"
-                cursor.updateRow(row)
+        obs_dam, cons_area, cons_ease = tag_reaches(network, table, surveyed_dams,
+                                                    [conservation_areas, conservation_easements])
+        for out_field, tags in [("ObsDam", obs_dam), ("ConsArea", cons_area), ("ConsEase", cons_ease)]:
+            columns[out_field] = np.where(tags, "Yes", "No")
+            table.set_field(out_field, columns[out_field], 'TEXT')
 
-        arcpy.SelectLayerByLocation_management(network_lyr, "INTERSECT", conservation_areas, '', "NEW_SELECTION")
-        with arcpy.da.UpdateCursor(network_lyr, ["ConsArea"]) as cursor:
-            for row in cursor:
-                row[0] = "Yes"
-                cursor.updateRow(row)
+        table.set_field("DamStrat", classify(columns, rule_tables["DamStrat"]), 'TEXT')
 
-        arcpy.SelectLayerByLocation_management(network_lyr, "INTERSECT", conservation_easements, '', "NEW_SELECTION")
-        with arcpy.da.UpdateCursor(network_lyr, ["ConsEase"]) as cursor:
-            for row in cursor:
-                row[0] = "Yes"
-                cursor.updateRow(row)
 
-        with arcpy.da.UpdateCursor(out_network, fields) as cursor:
+def load_rule_tables(rule_file, region=None):
+    """
+    Reads rule tables from a JSON file, so the categories can be changed for each region without editing code. The
+    file holds a "default" entry and an entry for any region, each a dictionary of output field to rule table, in
+    the same form as RULE_TABLES. A region's rule tables replace the default ones for the fields it lists
+    :param rule_file: The JSON file
+    :param region: The region to use rule tables for. If None, only the default rule tables are used
+    :return: A dictionary of output field to rule table
+    """
+    with open(rule_file) as f:
+        all_rule_tables = json.load(f)
+    rule_tables = dict(all_rule_tables.get("default", {}))
+    if region is not None and region != '' and region != '#':
+        if str(region) not in all_rule_tables:
+            arcpy.AddWarning("No rule tables for region " + str(region) + " in " + rule_file +
+                             ", so the default rule tables were used")
+        rule_tables.update(all_rule_tables.get(str(region), {}))
+    return rule_tables
+
+
+def tag_reaches(network, table, surveyed_dams, area_feature_classes, snap_distance=DAM_SNAP_DISTANCE):
+    """
+    Finds the reaches with a surveyed dam on them, and the reaches that intersect each of a set of polygon feature
+    classes, using a spatial index over the reach geometries. Each dam is on the nearest reach within snap_distance
+    :param network: The stream network
+    :param table: The ReachTable of the stream network
+    :param surveyed_dams: The dams shapefile, or None
+    :param area_feature_classes: A list of polygon feature classes (any can be None)
+    :param snap_distance: The largest distance in meters from a dam to the reach it is on
+    :return: An array for the dams, and then an array for each polygon feature class, of whether each reach is tagged
+    """
+    spatial_reference = arcpy.Describe(network).spatialReference
+    num_reaches = len(table.reach_ids())
+
+    # consecutive vertices of each part of a reach make its segments
+    vertex_ids = []
+    vertex_parts = []
+    vertex_x = []
+    vertex_y = []
+    num_parts = 0
+    with arcpy.da.SearchCursor(network, ['ReachID', 'SHAPE@']) as cursor:
+        for row in cursor:
+            if row[1] is None:
+                continue
+            for part in row[1]:
+                for point in part:
+                    if point is not None:
+                        vertex_ids.append(row[0])
+                        vertex_parts.append(num_parts)
+                        vertex_x.append(point.X)
+                        vertex_y.append(point.Y)
+                num_parts += 1
+    index = SpatialIndex.SegmentIndex.from_polylines(table.find_rows(np.array(vertex_ids, np.int64)), vertex_x,
+                                                     vertex_y, vertex_parts=vertex_parts)
+
+    obs_dam = np.zeros(num_reaches, dtype=bool)
+    if surveyed_dams is not None:
+        dams = arcpy.da.FeatureClassToNumPyArray(surveyed_dams, ['SHAPE@X', 'SHAPE@Y'],
+                                                 spatial_reference=spatial_reference, explode_to_points=True)
+        nearest = index.nearest(dams['SHAPE@X'], dams['SHAPE@Y'], snap_distance / spatial_reference.metersPerUnit)[0]
+        obs_dam[nearest[nearest >= 0]] = True
+
+    # find the reaches near each polygon from the index, then read only those reaches' geometries to test them
+    area_tags = [np.zeros(num_reaches, dtype=bool) for features in area_feature_classes]
+    polygon_candidates = []
+    for i, features in enumerate(area_feature_classes):
+        if features is None:
+            continue
+        with arcpy.da.SearchCursor(features, ['SHAPE@'], spatial_reference=spatial_reference) as cursor:
             for row in cursor:
-                # 'oPBRC_UI' Negligible Risk or Minor Risk
-                opbrc_ui = row[0]
-                hist_veg = row[3]
-                curr_veg = row[4]
-                curr_dams = row[6]
-                infrastructure_dist = row[11]
-                landuse = row[12]
-                obs_dams = row[18]
-                protected = row[19]
-                easement = row[20]
-
-                hist_veg_departure = hist_veg - curr_veg
-                urban = landuse > 0.66
-                ag = 0.33 < landuse <= 0.66
-                no_urban = not urban
-                no_ag = not ag
-
-                # default category is 'Other'
-                row[15] = 'Other'
-
-                if curr_dams >= 5:
-                    if no_urban:
-                        if hist_veg_departure >= 4:
-                            row[15] = "3a. Vegetation restoration first-priority"
-                        else:
-                            row[15] = "3. High restoration potential"
-
-                if curr_dams >= 20 and protected == 'Yes':
-                    row[15] = "2. Highest restoration potential - translocation"
-
-                if curr_dams >= 20 and easement == 'Yes':
-                    row[15] = "2. Highest restoration potential - translocation"
-
-                if 1 <= curr_dams < 5 and no_urban:
-                    if hist_veg_departure >= 4:
-                        row[15] = "4a. Vegetation restoration first-priority"
-                    else:
-                        row[15] = "4. Medium-low restoration potential"
-
-                if curr_dams >= 1 and infrastructure_dist <= 30:
-                    row[15] = "5. Restoration with infrastructure modification"
-
-                if curr_dams >= 1 and urban:
-                    row[15] = "6. Restoration with urban or agricultural modification"
-
-                if curr_dams >= 1 and ag:
-                    row[15] = "6. Restoration with urban or agricultural modification"
-
-                if obs_dams == 'Yes' and no_urban and no_ag:
-                    row[15] = "1. Beaver conservation"
-
-                cursor.updateRow(row)
-
-        arcpy.Delete_management(dams)
-
-    else:  # remove strategies map fields if not running this part of the model
-        arcpy.DeleteField_management(out_network, "DamStrat")
-        arcpy.DeleteField_management(out_network, "ObsDam")
-        arcpy.DeleteField_management(out_network, "ConsRest")
-        arcpy.DeleteField_management(out_network, "ConsEase")
-        
-    make_layers(out_network)
-
-    write_xml(in_network, out_network)
-
-    return out_network
+                if row[0] is None:
+                    continue
+                extent = row[0].extent
+                candidates = index.owners_in_box(extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+                if len(candidates) > 0:
+                    polygon_candidates.append((i, row[0], candidates))
+
+    if len(polygon_candidates) > 0:
+        candidate_rows = set(np.concatenate([candidates for i, polygon, candidates in polygon_candidates]).tolist())
+        reach_ids = table.reach_ids()
+        candidate_ids = set(reach_ids[list(candidate_rows)].tolist())
+        reach_shapes = {}
+        with arcpy.da.SearchCursor(network, ['ReachID', 'SHAPE@']) as cursor:
+            for row in cursor:
+                if row[0] in candidate_ids:
+                    reach_shapes[row[0]] = row[1]
+
+        for i, polygon, candidates in polygon_candidates:
+            for reach_row in candidates.tolist():
+                if area_tags[i][reach_row]:
+                    continue
+                reach_shape = reach_shapes.get(reach_ids[reach_row])
+                if reach_shape is not None and not polygon.disjoint(reach_shape):
+                    area_tags[i][reach_row] = True
+
+    return [obs_dam] + area_tags
 
 
 def make_layers(out_network):
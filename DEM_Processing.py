@@ -0,0 +1,223 @@
+# -------------------------------------------------------------------------------
+# Name:        DEM Processing
+# Purpose:     Smooths and fills DEMs block by block over NumPy arrays, without Spatial Analyst
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import os
+import numpy as np
+import Raster_Sampler
+import Depression_Filling
+import Flow_Routing
+reload(Raster_Sampler)
+reload(Depression_Filling)
+reload(Flow_Routing)
+
+
+# The number of rows processed at once when a whole raster is written
+DEFAULT_BLOCK_ROWS = Depression_Filling.DEFAULT_BLOCK_ROWS
+
+# The NoData value of rasters written here
+NO_DATA_VALUE = -9999.0
+
+
+class SmoothedRasterSampler(Raster_Sampler.RasterSampler):
+    """
+    A RasterSampler of the 3x3 cell mean of a raster, the same as FocalStatistics with a 3x3 rectangle and MEAN
+    followed by ExtractByMask to the raster. Each block is smoothed as it is read, from the block and a one-cell halo
+    around it, so the smoothed raster is never made whole
+    """
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        """
+        Reads a window of the smoothed raster
+        :param row_start: The first row of the window
+        :param col_start: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: Array of the window's smoothed values, with NoData and cells off the raster as NaN
+        """
+        values = Raster_Sampler.RasterSampler.read_window(self, row_start - 1, col_start - 1, num_rows + 2,
+                                                           num_cols + 2)
+        return focal_mean_3x3(values)
+
+
+class FilledDEM(Depression_Filling.BandedFill):
+    """
+    A DEM with its depressions filled by priority-flood (see Depression_Filling.BandedFill), on the same grid as the
+    DEM so it can be read like a RasterSampler
+    """
+
+    def __init__(self, dem, epsilon=0.0, block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        :param dem: The DEM, as a raster or a RasterSampler of one
+        :param epsilon: If greater than 0, each filled cell is raised this much above the cell it drains to, so flats
+            have a gradient to their outlet. Only used if the DEM fits in one band
+        :param block_rows: The number of rows filled at once, which bounds the memory used
+        """
+        dem = dem if isinstance(dem, Raster_Sampler.RasterSampler) else Raster_Sampler.RasterSampler(dem)
+        self.x_min = dem.x_min
+        self.y_max = dem.y_max
+        self.cell_width = dem.cell_width
+        self.cell_height = dem.cell_height
+        self.spatial_reference = dem.spatial_reference
+        if epsilon > 0 and not Depression_Filling.BandedFill.uses_epsilon(dem.num_rows, block_rows):
+            arcpy.AddWarning("The DEM is too large to fill in one piece, so its flats were filled without a gradient")
+        Depression_Filling.BandedFill.__init__(self, dem, epsilon, block_rows)
+
+
+class ArraySampler:
+    """
+    An array held in memory on the same grid as a raster, readable like a RasterSampler so it can be written with
+    write_blocks
+    """
+
+    def __init__(self, values, grid):
+        """
+        :param values: A 2D array of values, with NaN for NoData
+        :param grid: A RasterSampler (or FilledDEM) on the grid the values are on
+        """
+        self.values = values
+        self.x_min = grid.x_min
+        self.y_max = grid.y_max
+        self.cell_width = grid.cell_width
+        self.cell_height = grid.cell_height
+        self.num_rows, self.num_cols = values.shape
+        self.spatial_reference = grid.spatial_reference
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        """
+        Reads a window of the array
+        :param row_start: The first row of the window
+        :param col_start: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: Array of the window's values as doubles, with cells off the array as NaN
+        """
+        window = np.full((num_rows, num_cols), np.nan)
+        read_row_start = max(row_start, 0)
+        read_col_start = max(col_start, 0)
+        read_row_stop = min(row_start + num_rows, self.num_rows)
+        read_col_stop = min(col_start + num_cols, self.num_cols)
+        if read_row_stop > read_row_start and read_col_stop > read_col_start:
+            window[read_row_start - row_start:read_row_stop - row_start,
+                   read_col_start - col_start:read_col_stop - col_start] = \
+                self.values[read_row_start:read_row_stop, read_col_start:read_col_stop]
+        return window
+
+
+class FlowDirectionSampler(ArraySampler):
+    """
+    Flow directions held in memory, read as the codes of a flow direction raster a window at a time, so the codes are
+    never held for the whole DEM
+    """
+
+    def __init__(self, directions, grid, coding='ESRI'):
+        """
+        :param directions: A 2D array of flow directions from Flow_Routing.flow_directions
+        :param grid: A RasterSampler (or FilledDEM) on the grid the directions are on
+        :param coding: 'ESRI' or 'TAUDEM' (see Flow_Routing.direction_codes)
+        """
+        ArraySampler.__init__(self, directions, grid)
+        self.coding = coding
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        """
+        Reads the flow direction codes of a window
+        :return: Array of the window's codes as doubles, with NoData and cells off the array as NaN
+        """
+        directions = ArraySampler.read_window(self, row_start, col_start, num_rows, num_cols)
+        directions = np.where(np.isnan(directions), -1, directions).astype(np.int8)
+        return Flow_Routing.direction_codes(directions, self.coding)
+
+
+# The depression filling functions are in Depression_Filling
+fill_depressions = Depression_Filling.fill_depressions
+priority_flood = Depression_Filling.priority_flood
+
+
+def focal_mean_3x3(values):
+    """
+    Finds the mean of the cells with data in the 3x3 window around each cell. Cells without data stay without data
+    :param values: A 2D array, with NaN for NoData
+    :return: A 2D array of the means of the inner cells, with two fewer rows and columns than values
+    """
+    has_data = ~np.isnan(values)
+    filled = np.where(has_data, values, 0.0)
+    num_rows = values.shape[0] - 2
+    num_cols = values.shape[1] - 2
+
+    # add up the nine shifted views of the window
+    totals = np.zeros((num_rows, num_cols))
+    counts = np.zeros((num_rows, num_cols))
+    for row_offset in range(3):
+        for col_offset in range(3):
+            totals += filled[row_offset:row_offset + num_rows, col_offset:col_offset + num_cols]
+            counts += has_data[row_offset:row_offset + num_rows, col_offset:col_offset + num_cols]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = totals / counts
+    means[~has_data[1:-1, 1:-1]] = np.nan
+    return means
+
+
+def smooth_raster(in_raster, out_raster, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Writes the 3x3 cell mean of a raster (see SmoothedRasterSampler), a block of rows at a time
+    :param in_raster: The raster to smooth, such as a DEM
+    :param out_raster: The path of the smoothed raster to write
+    :param block_rows: The number of rows smoothed at once, which bounds the memory used
+    :return: The path of the smoothed raster
+    """
+    sampler = SmoothedRasterSampler(in_raster)
+    return write_blocks(sampler, out_raster, block_rows)
+
+
+def write_blocks(sampler, out_raster, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Writes the values a sampler reads to a raster on the same grid, a block of rows at a time. Each block is saved as
+    its own raster, and the blocks are then mosaicked together
+    :param sampler: The RasterSampler to read values from
+    :param out_raster: The path of the raster to write
+    :param block_rows: The number of rows read at once
+    :return: The path of the raster
+    """
+    out_folder = os.path.dirname(out_raster)
+    name = os.path.splitext(os.path.basename(out_raster))[0]
+    if arcpy.Exists(out_raster):
+        arcpy.Delete_management(out_raster)
+
+    block_paths = []
+    for row_start in range(0, sampler.num_rows, block_rows):
+        num_rows = min(block_rows, sampler.num_rows - row_start)
+        block = sampler.read_window(row_start, 0, num_rows, sampler.num_cols)
+        block = np.where(np.isnan(block), NO_DATA_VALUE, block).astype(np.float32)
+        lower_left = arcpy.Point(sampler.x_min, sampler.y_max - (row_start + num_rows) * sampler.cell_height)
+        block_raster = arcpy.NumPyArrayToRaster(block, lower_left, sampler.cell_width, sampler.cell_height,
+                                                NO_DATA_VALUE)
+        block_path = os.path.join(out_folder, name + "_block" + str(len(block_paths)) + ".tif")
+        block_raster.save(block_path)
+        block_paths.append(block_path)
+
+    arcpy.MosaicToNewRaster_management(block_paths, out_folder, os.path.basename(out_raster),
+                                       sampler.spatial_reference, "32_BIT_FLOAT", sampler.cell_width, 1)
+    for block_path in block_paths:
+        arcpy.Delete_management(block_path)
+    return out_raster
+
+
+def write_flow_directions(directions, grid, out_raster, coding='ESRI', block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Writes flow directions to a raster, coded the way ArcGIS or TauDEM code them, a block of rows at a time
+    :param directions: A 2D array of flow directions from Flow_Routing.flow_directions
+    :param grid: A RasterSampler on the grid the directions are on
+    :param out_raster: The path of the raster to write
+    :param coding: 'ESRI' or 'TAUDEM'
+    :param block_rows: The number of rows written at once
+    :return: The path of the raster
+    """
+    return write_blocks(FlowDirectionSampler(directions, grid, coding), out_raster, block_rows)
@@ -0,0 +1,289 @@
+# -------------------------------------------------------------------------------
+# Name:        Depression Filling
+# Purpose:     Fills the depressions of DEMs by priority-flood over NumPy arrays, a band of rows at a time for large
+#              DEMs. Doesn't use arcpy, so it can run and be tested outside ArcGIS
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import heapq
+import numpy as np
+from collections import deque
+
+
+# The number of rows filled at once
+DEFAULT_BLOCK_ROWS = 1024
+
+
+class BandedFill:
+    """
+    A DEM with its depressions filled by priority-flood, readable a window at a time like a RasterSampler. A DEM
+    with more rows than block_rows is filled a band of rows at a time: each band is flooded from its own edges, with
+    every cell labelled by the edge cell it was reached from, and the lowest spill elevation between each pair of
+    labels is kept. The labels are then flooded from the DEM's edges to find the level each one has to be filled to,
+    and a band's cells are its own filled elevations raised to their labels' levels. Only one band is held in memory
+    at a time
+    """
+
+    def __init__(self, dem, epsilon=0.0, block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        :param dem: The DEM, as anything with num_rows, num_cols and a read_window like RasterSampler's, which gives
+            NaN for NoData
+        :param epsilon: If greater than 0, each filled cell is raised this much above the cell it drains to, so flats
+            have a gradient to their outlet. Only used if the DEM fits in one band (see uses_epsilon)
+        :param block_rows: The number of rows filled at once, which bounds the memory used
+        """
+        self.dem = dem
+        self.num_rows = dem.num_rows
+        self.num_cols = dem.num_cols
+        self.block_rows = int(block_rows)
+        self.num_bands = (self.num_rows + self.block_rows - 1) // self.block_rows
+        self.epsilon = epsilon if self.num_bands <= 1 else 0.0
+        self.first_labels = None
+        self.levels = None
+        self.band = (None, None)
+        if self.num_bands > 1:
+            self.find_levels()
+
+    @staticmethod
+    def uses_epsilon(num_rows, block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        :return: Whether a DEM with this many rows fits in one band, so its flats can be given a gradient
+        """
+        return num_rows <= int(block_rows)
+
+    def flood_band(self, band):
+        """
+        Fills the depressions of one band of rows, flooding it from its own edges
+        :param band: The index of the band
+        :return: Arrays of the filled band and of the label of each cell, and a dictionary of each pair of labels to
+            the lowest elevation water spills between them at
+        """
+        row_start = band * self.block_rows
+        values = self.dem.read_window(row_start, 0, min(self.block_rows, self.num_rows - row_start), self.num_cols)
+        first_label = self.first_labels[band] if self.first_labels is not None else 1
+        return priority_flood(values, self.epsilon, band > 0, band < self.num_bands - 1, first_label)
+
+    def find_levels(self):
+        """
+        Floods every band to find the spill elevations between their labels, then floods the labels from the DEM's
+        edges to find the level each label has to be filled to
+        :return:
+        """
+        spills = {}
+        self.first_labels = [1]
+        previous_bottom = None
+        for band in range(self.num_bands):
+            filled, labels, band_spills = self.flood_band(band)
+            self.first_labels.append(max(self.first_labels[-1], int(labels.max()) + 1))
+            add_spills(spills, band_spills)
+
+            # cells of neighbouring bands that touch, including diagonally, can spill into each other, and cells
+            # next to NoData in the other band drain off the DEM
+            if previous_bottom is not None:
+                bottom_filled, bottom_labels = previous_bottom
+                for col_offset in [-1, 0, 1]:
+                    above = slice(max(0, -col_offset), self.num_cols - max(0, col_offset))
+                    below = slice(max(0, col_offset), self.num_cols - max(0, -col_offset))
+                    above_labels = bottom_labels[above]
+                    below_labels = labels[0, below]
+                    above_filled = bottom_filled[above]
+                    below_filled = filled[0, below]
+                    pairs = (above_labels >= 0) & (below_labels >= 0)
+                    add_spills(spills, zip(above_labels[pairs].tolist(), below_labels[pairs].tolist(),
+                                           np.fmax(above_filled[pairs], below_filled[pairs]).tolist()))
+                    drains = (above_labels >= 0) & (below_labels < 0)
+                    add_spills(spills, [(label, 0, elevation) for label, elevation in
+                                        zip(above_labels[drains].tolist(), above_filled[drains].tolist())])
+                    drains = (above_labels < 0) & (below_labels >= 0)
+                    add_spills(spills, [(label, 0, elevation) for label, elevation in
+                                        zip(below_labels[drains].tolist(), below_filled[drains].tolist())])
+            previous_bottom = (filled[-1].copy(), labels[-1].copy())
+        num_labels = self.first_labels.pop()
+
+        self.levels = flood_labels(spills, num_labels)
+        self.levels[self.levels == np.inf] = -np.inf
+        self.levels = np.append(self.levels, -np.inf)
+
+    def read_band(self, band):
+        """
+        :return: Array of the filled elevations of one band of rows, with NoData as NaN
+        """
+        if self.band[0] != band:
+            filled, labels, band_spills = self.flood_band(band)
+            if self.levels is not None:
+                # cells without data have label -1, which is the last level, -inf, so they stay NaN
+                filled = np.maximum(filled, self.levels[labels])
+            self.band = (band, filled)
+        return self.band[1]
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        """
+        Reads a window of the filled DEM
+        :param row_start: The first row of the window
+        :param col_start: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: Array of the window's filled elevations, with NoData and cells off the raster as NaN
+        """
+        window = np.full((num_rows, num_cols), np.nan)
+        read_col_start = max(col_start, 0)
+        read_col_stop = min(col_start + num_cols, self.num_cols)
+        for row in range(max(row_start, 0), min(row_start + num_rows, self.num_rows), self.block_rows):
+            band = row // self.block_rows
+            band_start = band * self.block_rows
+            band_stop = min(band_start + self.block_rows, self.num_rows, row_start + num_rows)
+            if read_col_stop > read_col_start:
+                window[band_start - row_start + max(row - band_start, 0):band_stop - row_start,
+                       read_col_start - col_start:read_col_stop - col_start] = \
+                    self.read_band(band)[max(row - band_start, 0):band_stop - band_start, read_col_start:read_col_stop]
+        return window
+
+
+def fill_depressions(values, epsilon=0.0):
+    """
+    Fills the depressions of a DEM held in memory, so every cell has a path to the DEM's edge or NoData that never
+    goes uphill
+    :param values: A 2D array of elevations, with NaN for NoData
+    :param epsilon: If greater than 0, each filled cell is raised this much above the cell it drains to, so flats have
+        a gradient to their outlet
+    :return: A 2D array of the filled elevations
+    """
+    return priority_flood(values, epsilon)[0]
+
+
+def priority_flood(values, epsilon=0.0, open_top=False, open_bottom=False, first_label=1):
+    """
+    Fills depressions by priority-flood (Barnes et al. 2014): cells are flooded inward from the edges, lowest first,
+    and any cell lower than the cell it was reached from is raised to it. Cells that were raised are flooded from a
+    plain queue instead of the heap, as they can't be lower than anything left in it
+    :param values: A 2D array of elevations, with NaN for NoData
+    :param epsilon: The amount a raised cell is raised above the cell it was reached from
+    :param open_top: True if the top row continues into rows not in values. Those cells are not on the DEM's edge, and
+        each one starts its own label
+    :param open_bottom: True if the bottom row continues into rows not in values, like open_top
+    :param first_label: The label of the first top or bottom row cell that starts its own label
+    :return: Arrays of the filled elevations and of the label of each cell (0 for cells reached from the DEM's edge,
+        -1 for NoData), and a dictionary of each pair of labels that touch to the lowest elevation water spills
+        between them at
+    """
+    num_rows, num_cols = values.shape
+    padded_cols = num_cols + 2
+    padded = np.full((num_rows + 2, padded_cols), np.nan)
+    padded[1:-1, 1:-1] = values
+    has_data = ~np.isnan(padded)
+
+    # cells next to the DEM's edge or NoData drain off it
+    outside = ~has_data
+    if open_top:
+        outside[0] = False
+    if open_bottom:
+        outside[-1] = False
+    next_to_outside = np.zeros(padded.shape, dtype=bool)
+    for row_offset in [-1, 0, 1]:
+        for col_offset in [-1, 0, 1]:
+            next_to_outside[1:-1, 1:-1] |= outside[1 + row_offset:num_rows + 1 + row_offset,
+                                                   1 + col_offset:num_cols + 1 + col_offset]
+    labels = np.full(padded.shape, -1, dtype=np.int64)
+    seeds = has_data & next_to_outside
+    labels[seeds] = 0
+
+    # the open rows' other cells each start a label
+    open_rows = []
+    if open_top:
+        open_rows.append(1)
+    if open_bottom and num_rows not in open_rows:
+        open_rows.append(num_rows)
+    next_label = first_label
+    for row in open_rows:
+        starts = has_data[row] & ~seeds[row]
+        labels[row, starts] = np.arange(next_label, next_label + np.count_nonzero(starts))
+        next_label += np.count_nonzero(starts)
+        seeds[row] |= starts
+
+    filled = padded.ravel().tolist()
+    label = labels.ravel().tolist()
+    closed = (~has_data | seeds).ravel().tolist()
+    seed_cells = np.nonzero(seeds.ravel())[0]
+    heap = list(zip(padded.ravel()[seed_cells].tolist(), seed_cells.tolist()))
+    heapq.heapify(heap)
+    pit = deque()
+    spills = {}
+    offsets = [-padded_cols - 1, -padded_cols, -padded_cols + 1, -1, 1, padded_cols - 1, padded_cols,
+               padded_cols + 1]
+    track_spills = len(open_rows) > 0
+
+    while len(heap) > 0 or len(pit) > 0:
+        if len(pit) > 0:
+            cell = pit.popleft()
+        else:
+            cell = heapq.heappop(heap)[1]
+        elevation = filled[cell]
+        cell_label = label[cell]
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                if track_spills and label[neighbour] >= 0 and label[neighbour] != cell_label:
+                    key = (min(cell_label, label[neighbour]), max(cell_label, label[neighbour]))
+                    spill = max(elevation, filled[neighbour])
+                    if spill < spills.get(key, np.inf):
+                        spills[key] = spill
+                continue
+            closed[neighbour] = True
+            label[neighbour] = cell_label
+            if filled[neighbour] <= elevation:
+                filled[neighbour] = elevation + epsilon
+                pit.append(neighbour)
+            else:
+                heapq.heappush(heap, (filled[neighbour], neighbour))
+
+    filled = np.array(filled).reshape(padded.shape)[1:-1, 1:-1]
+    labels = np.array(label, dtype=np.int64).reshape(padded.shape)[1:-1, 1:-1]
+    return filled, labels, spills
+
+
+def add_spills(spills, new_spills):
+    """
+    Adds spill elevations between labels, keeping the lowest for each pair
+    :param spills: The dictionary of each pair of labels to the lowest spill elevation between them
+    :param new_spills: A dictionary of label pairs to spill elevations, or a list of (label, label, elevation)
+    :return:
+    """
+    if isinstance(new_spills, dict):
+        new_spills = [(key[0], key[1], spill) for key, spill in new_spills.items()]
+    for first, second, spill in new_spills:
+        if first == second:
+            continue
+        key = (min(first, second), max(first, second))
+        if spill < spills.get(key, np.inf):
+            spills[key] = spill
+
+
+def flood_labels(spills, num_labels):
+    """
+    Finds the level each label has to be filled to, which is the lowest elevation its water can leave the DEM at,
+    by flooding the graph of labels from label 0, the DEM's edges
+    :param spills: A dictionary of each pair of labels to the lowest spill elevation between them
+    :param num_labels: The number of labels
+    :return: Array of the level of each label (inf for labels that can't reach the edge)
+    """
+    neighbours = [[] for label in range(num_labels)]
+    for (first, second), spill in spills.items():
+        neighbours[first].append((second, spill))
+        neighbours[second].append((first, spill))
+
+    levels = np.full(num_labels, np.inf)
+    levels[0] = -np.inf
+    heap = [(-np.inf, 0)]
+    while len(heap) > 0:
+        level, label = heapq.heappop(heap)
+        if level > levels[label]:
+            continue
+        for neighbour, spill in neighbours[label]:
+            neighbour_level = max(level, spill)
+            if neighbour_level < levels[neighbour]:
+                levels[neighbour] = neighbour_level
+                heapq.heappush(heap, (neighbour_level, neighbour))
+    return levels
@@ -0,0 +1,235 @@
+# -------------------------------------------------------------------------------
+# Name:        Equation Engine
+# Purpose:     Compiles regional curve equations once and evaluates them over whole networks, without eval()
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import ast
+import numbers
+import numpy as np
+
+
+# The variables an equation can use. DAsqm is the drainage area of each reach in square miles, and the others are
+# basin or reach characteristics used by the regional curves in iHyd and the batch iHyd scripts
+ALLOWED_VARIABLES = ['DAsqm', 'ELEV_FT', 'MIN_ELEV', 'RELIEF', 'PRECIP', 'PRECIP_IN', 'JAN_PRECIP', 'LATITUDE',
+                     'LONGITUDE', 'FOREST', 'FOREST_PLUS_ONE', 'BASIN_SLOPE', 'SLOPE_THIRTY', 'SLOPE_FIFTY']
+
+# The functions an equation can call, by themselves or as np.<function> / numpy.<function>
+ALLOWED_FUNCTIONS = {'log': np.log, 'log10': np.log10, 'exp': np.exp, 'sqrt': np.sqrt, 'abs': np.abs}
+
+# The number of reaches evaluated at once. Intermediate results are only this long, so they stay in cache
+DEFAULT_BLOCK_SIZE = 65536
+
+BINARY_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+                    ast.Pow: np.power}
+UNARY_OPERATORS = {ast.USub: np.negative}
+
+
+class EquationError(Exception):
+    """
+    Raised when an equation can't be parsed or uses something that isn't allowed
+    """
+    pass
+
+
+class CompiledEquation:
+    """
+    An equation parsed into a tree of NumPy operations. Parts of the equation that only use numbers and single-valued
+    variables are worked out once per evaluation, and the rest is evaluated in blocks of reaches, with each operation
+    writing in place into the output, so a long equation needs at most a few block-sized buffers
+    """
+
+    def __init__(self, text):
+        """
+        :param text: The equation, such as "14.7 * (DAsqm ** 0.815)". Division is always true division
+        """
+        self.text = text
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError as e:
+            raise EquationError("Could not parse the equation '" + text + "': " + str(e))
+        self.variables = set()
+        self.root = self.convert(tree.body)
+
+    def convert(self, node):
+        """
+        Converts a Python syntax tree node into the equation's own tree, checking that it is allowed. Nodes are
+        ('number', value), ('variable', name), ('unary', ufunc, child), ('binary', ufunc, left, right) and
+        ('call', ufunc, child)
+        :param node: The syntax tree node
+        :return: The equation tree node
+        """
+        if is_number(node):
+            return ('number', np.float64(number_value(node)))
+        elif isinstance(node, ast.Name):
+            if node.id not in ALLOWED_VARIABLES:
+                raise EquationError("The equation '" + self.text + "' uses " + node.id + ", which is not one of the " +
+                                    "allowed variables: " + ", ".join(ALLOWED_VARIABLES))
+            self.variables.add(node.id)
+            return ('variable', node.id)
+        elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            return ('binary', BINARY_OPERATORS[type(node.op)], self.convert(node.left), self.convert(node.right))
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            return self.convert(node.operand)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return ('unary', UNARY_OPERATORS[type(node.op)], self.convert(node.operand))
+        elif isinstance(node, ast.Call) and len(node.args) == 1 and len(node.keywords) == 0:
+            function_name = None
+            if isinstance(node.func, ast.Name):
+                function_name = node.func.id
+            elif isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name) and \
+                    node.func.value.id in ['np', 'numpy']:
+                function_name = node.func.attr
+            if function_name in ALLOWED_FUNCTIONS:
+                return ('call', ALLOWED_FUNCTIONS[function_name], self.convert(node.args[0]))
+        raise EquationError("The equation '" + self.text + "' uses something that is not allowed. Equations can " +
+                            "only use numbers, the variables " + ", ".join(ALLOWED_VARIABLES) + ", +, -, *, /, ** " +
+                            "and the functions " + ", ".join(sorted(ALLOWED_FUNCTIONS)))
+
+    def evaluate(self, variables, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Evaluates the equation
+        :param variables: A dictionary of variable name to a single value or an array with a value for each reach.
+            Every array must be the same length
+        :param block_size: The number of reaches evaluated at once
+        :return: Array of results at double precision, or a single value if every variable has a single value
+        """
+        missing = sorted(self.variables - set(variables))
+        if len(missing) > 0:
+            raise EquationError("The equation '" + self.text + "' needs values for " + ", ".join(missing))
+
+        arrays = {}
+        scalars = {}
+        for name in self.variables:
+            value = np.asarray(variables[name])
+            if value.ndim == 0:
+                scalars[name] = np.float64(value)
+            else:
+                arrays[name] = value
+        lengths = set(len(value) for value in arrays.values())
+        if len(lengths) > 1:
+            raise EquationError("The variables of the equation '" + self.text + "' have different lengths")
+
+        with np.errstate(all='ignore'):
+            root = fold(self.root, scalars)
+            if root[0] == 'number':
+                if len(lengths) == 0:
+                    return root[1]
+                return np.full(lengths.pop(), root[1])
+
+            num_values = lengths.pop()
+            out = np.empty(num_values, dtype=np.float64)
+            buffers = []
+            for start in range(0, num_values, block_size):
+                stop = min(start + block_size, num_values)
+                run(root, arrays, slice(start, stop), out[start:stop], buffers)
+        return out
+
+
+def is_number(node):
+    """
+    :return: True if a syntax tree node is a real number
+    """
+    constant = getattr(ast, 'Constant', None)
+    if constant is None:
+        if not isinstance(node, ast.Num):
+            return False
+    elif not isinstance(node, constant):
+        return False
+    value = number_value(node)
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def number_value(node):
+    """
+    :return: The value of a number syntax tree node
+    """
+    constant = getattr(ast, 'Constant', None)
+    if constant is not None and isinstance(node, constant):
+        return node.value
+    return node.n
+
+
+def fold(node, scalars):
+    """
+    Works out every part of an equation tree that doesn't use an array
+    :param node: The equation tree node
+    :param scalars: A dictionary of variable name to single value
+    :return: The equation tree node with those parts replaced by numbers
+    """
+    kind = node[0]
+    if kind == 'variable' and node[1] in scalars:
+        return ('number', scalars[node[1]])
+    elif kind == 'unary' or kind == 'call':
+        child = fold(node[2], scalars)
+        if child[0] == 'number':
+            return ('number', np.float64(node[1](child[1])))
+        return (kind, node[1], child)
+    elif kind == 'binary':
+        left = fold(node[2], scalars)
+        right = fold(node[3], scalars)
+        if left[0] == 'number' and right[0] == 'number':
+            return ('number', np.float64(node[1](left[1], right[1])))
+        return (kind, node[1], left, right)
+    return node
+
+
+def run(node, arrays, block, out, buffers):
+    """
+    Evaluates a folded equation tree for one block of reaches, writing the result into out
+    :param node: The equation tree node. It uses at least one array
+    :param arrays: A dictionary of variable name to array
+    :param block: The slice of reaches to evaluate
+    :param out: The array to write the result to
+    :param buffers: A list of spare arrays, reused between blocks and operations
+    :return:
+    """
+    kind = node[0]
+    if kind == 'variable':
+        out[...] = arrays[node[1]][block]
+    elif kind == 'unary' or kind == 'call':
+        run(node[2], arrays, block, out, buffers)
+        node[1](out, out=out)
+    else:
+        ufunc, left, right = node[1], node[2], node[3]
+        if right[0] == 'number':
+            run(left, arrays, block, out, buffers)
+            ufunc(out, right[1], out=out)
+        elif left[0] == 'number':
+            run(right, arrays, block, out, buffers)
+            ufunc(left[1], out, out=out)
+        else:
+            run(left, arrays, block, out, buffers)
+            buffer = buffers.pop() if len(buffers) > 0 else np.empty(len(out), dtype=np.float64)
+            run(right, arrays, block, buffer[:len(out)], buffers)
+            ufunc(out, buffer[:len(out)], out=out)
+            buffers.append(buffer)
+
+
+_compiled_equations = {}
+
+
+def compile_equation(text):
+    """
+    Compiles an equation, or gets it from the cache if the same text has already been compiled
+    :param text: The equation
+    :return: The CompiledEquation
+    """
+    key = text.strip()
+    if key not in _compiled_equations:
+        _compiled_equations[key] = CompiledEquation(key)
+    return _compiled_equations[key]
+
+
+def evaluate_equation(text, variables, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Compiles (or gets from the cache) and evaluates an equation
+    :param text: The equation
+    :param variables: A dictionary of variable name to a single value or an array with a value for each reach
+    :param block_size: The number of reaches evaluated at once
+    :return: Array of results, or a single value if every variable has a single value
+    """
+    return compile_equation(text).evaluate(variables, block_size)
@@ -0,0 +1,875 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Engine
+# Purpose:     Evaluates the BRAT fuzzy inference systems over whole arrays of reaches at once
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import multiprocessing
+
+
+# The number of reaches evaluated at once. Each block holds a (block size x rules x inputs) array of rule
+# memberships and a (block size x output breakpoints x output terms) array of clipped output terms.
+DEFAULT_CHUNK_SIZE = 3000
+
+# Largest difference between this engine and the skfuzzy ControlSystemSimulation that it replaces, in dams/km.
+# skfuzzy aggregates the clipped consequents on the sampled output universe, so where two sloped edges cross
+# between samples it cuts the corner, while this engine finds the crossing and integrates it exactly.
+SKFUZZY_TOLERANCE = 0.01
+
+# Spacing of the grid that lookup surfaces are evaluated on. This matches the 0.01 step of the vegetation FIS
+# input universes, so every sample skfuzzy would use is a grid node.
+DEFAULT_SURFACE_RESOLUTION = 0.01
+
+# Changing this invalidates every cached compiled FIS and lookup surface. Bump it whenever the engine's results
+# or the layout of the compiled arrays change.
+ENGINE_VERSION = 2
+
+# Where compiled FIS definitions and lookup surfaces are cached between runs
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), "BRAT_FIS_Cache")
+
+
+# Vegetation capacity FIS definition (see Veg_FIS.main)
+# Each input is (name, (universe start, stop, step), [(term, membership function, parameters), ...]).
+# Each rule is (one term per input, output term). A term of None means the input is not part of the rule, and
+# a term starting with '~' means the rule uses the complement of that term.
+VEG_FIS = {
+    'inputs': [
+        ('riparian', (0, 4, 0.01), [('unsuitable', 'trapmf', [0, 0, 0.1, 1]),
+                                    ('barely', 'trimf', [0.1, 1, 2]),
+                                    ('moderately', 'trimf', [1, 2, 3]),
+                                    ('suitable', 'trimf', [2, 3, 4]),
+                                    ('preferred', 'trimf', [3, 4, 4])]),
+        ('streamside', (0, 4, 0.01), [('unsuitable', 'trapmf', [0, 0, 0.1, 1]),
+                                      ('barely', 'trimf', [0.1, 1, 2]),
+                                      ('moderately', 'trimf', [1, 2, 3]),
+                                      ('suitable', 'trimf', [2, 3, 4]),
+                                      ('preferred', 'trimf', [3, 4, 4])])
+    ],
+    'output': ('density', (0, 45, 0.01), [('none', 'trimf', [0, 0, 0.1]),
+                                          ('rare', 'trapmf', [0, 0.1, 0.5, 1.5]),
+                                          ('occasional', 'trapmf', [0.5, 1.5, 4, 8]),
+                                          ('frequent', 'trapmf', [4, 8, 12, 25]),
+                                          ('pervasive', 'trapmf', [12, 25, 45, 45])]),
+    'rules': [
+        (('unsuitable', 'unsuitable'), 'none'),
+        (('barely', 'unsuitable'), 'rare'),
+        (('moderately', 'unsuitable'), 'rare'),
+        (('suitable', 'unsuitable'), 'occasional'),
+        (('preferred', 'unsuitable'), 'occasional'),
+        (('unsuitable', 'barely'), 'rare'),
+        # matBRAT has consequent as 'occasional'
+        (('barely', 'barely'), 'rare'),
+        (('moderately', 'barely'), 'occasional'),
+        (('suitable', 'barely'), 'occasional'),
+        (('preferred', 'barely'), 'occasional'),
+        (('unsuitable', 'moderately'), 'rare'),
+        (('barely', 'moderately'), 'occasional'),
+        (('moderately', 'moderately'), 'occasional'),
+        (('suitable', 'moderately'), 'frequent'),
+        (('preferred', 'moderately'), 'frequent'),
+        (('unsuitable', 'suitable'), 'occasional'),
+        (('barely', 'suitable'), 'occasional'),
+        (('moderately', 'suitable'), 'frequent'),
+        (('suitable', 'suitable'), 'frequent'),
+        (('preferred', 'suitable'), 'pervasive'),
+        (('unsuitable', 'preferred'), 'occasional'),
+        (('barely', 'preferred'), 'frequent'),
+        (('moderately', 'preferred'), 'pervasive'),
+        (('suitable', 'preferred'), 'pervasive'),
+        (('preferred', 'preferred'), 'pervasive')
+    ]
+}
+
+
+# Combined capacity FIS definition (see Comb_FIS.comb_cap_fis)
+COMB_FIS = {
+    'inputs': [
+        ('ovc', (0, 45, 0.01), [('none', 'trimf', [0, 0, 0.1]),
+                                ('rare', 'trapmf', [0, 0.1, 0.5, 1.5]),
+                                ('occasional', 'trapmf', [0.5, 1.5, 4, 8]),
+                                ('frequent', 'trapmf', [4, 8, 12, 25]),
+                                ('pervasive', 'trapmf', [12, 25, 45, 45])]),
+        ('sp2', (0, 10000, 1), [('persists', 'trapmf', [0, 0, 1000, 1200]),
+                                ('breach', 'trimf', [1000, 1200, 1600]),
+                                ('oblowout', 'trimf', [1200, 1600, 2400]),
+                                ('blowout', 'trapmf', [1600, 2400, 10000, 10000])]),
+        ('splow', (0, 10000, 1), [('can', 'trapmf', [0, 0, 150, 175]),
+                                  ('probably', 'trapmf', [150, 175, 180, 190]),
+                                  ('cannot', 'trapmf', [180, 190, 10000, 10000])]),
+        ('slope', (0, 1, 0.0001), [('flat', 'trapmf', [0, 0, 0.0002, 0.005]),
+                                   ('can', 'trapmf', [0.0002, 0.005, 0.12, 0.15]),
+                                   ('probably', 'trapmf', [0.12, 0.15, 0.17, 0.23]),
+                                   ('cannot', 'trapmf', [0.17, 0.23, 1, 1])])
+    ],
+    'output': ('density', (0, 45, 0.01), [('none', 'trimf', [0, 0, 0.1]),
+                                          ('rare', 'trapmf', [0, 0.1, 0.5, 1.5]),
+                                          ('occasional', 'trapmf', [0.5, 1.5, 4, 8]),
+                                          ('frequent', 'trapmf', [4, 8, 12, 25]),
+                                          ('pervasive', 'trapmf', [12, 25, 45, 45])]),
+    'rules': [
+        (('none', None, None, None), 'none'),
+        ((None, None, 'cannot', None), 'none'),
+        ((None, None, None, 'cannot'), 'none'),
+        (('rare', 'persists', 'can', '~cannot'), 'rare'),
+        (('rare', 'persists', 'probably', '~cannot'), 'rare'),
+        (('rare', 'breach', 'can', '~cannot'), 'rare'),
+        (('rare', 'breach', 'probably', '~cannot'), 'rare'),
+        (('rare', 'oblowout', 'can', '~cannot'), 'rare'),
+        (('rare', 'oblowout', 'probably', '~cannot'), 'rare'),
+        (('rare', 'blowout', 'can', '~cannot'), 'none'),
+        (('rare', 'blowout', 'probably', '~cannot'), 'none'),
+        (('occasional', 'persists', 'can', '~cannot'), 'occasional'),
+        (('occasional', 'persists', 'probably', '~cannot'), 'occasional'),
+        (('occasional', 'breach', 'can', '~cannot'), 'occasional'),
+        (('occasional', 'breach', 'probably', '~cannot'), 'occasional'),
+        (('occasional', 'oblowout', 'can', '~cannot'), 'occasional'),
+        (('occasional', 'oblowout', 'probably', '~cannot'), 'occasional'),
+        (('occasional', 'blowout', 'can', '~cannot'), 'rare'),
+        (('occasional', 'blowout', 'probably', '~cannot'), 'rare'),
+        (('frequent', 'persists', 'can', 'flat'), 'occasional'),
+        (('frequent', 'persists', 'can', 'can'), 'frequent'),
+        (('frequent', 'persists', 'can', 'probably'), 'occasional'),
+        (('frequent', 'persists', 'probably', 'flat'), 'occasional'),
+        (('frequent', 'persists', 'probably', 'can'), 'frequent'),
+        (('frequent', 'persists', 'probably', 'probably'), 'occasional'),
+        (('frequent', 'breach', 'can', 'flat'), 'occasional'),
+        (('frequent', 'breach', 'can', 'can'), 'frequent'),
+        (('frequent', 'breach', 'can', 'probably'), 'occasional'),
+        (('frequent', 'breach', 'probably', 'flat'), 'occasional'),
+        (('frequent', 'breach', 'probably', 'can'), 'frequent'),
+        (('frequent', 'breach', 'probably', 'probably'), 'occasional'),
+        (('frequent', 'oblowout', 'can', 'flat'), 'occasional'),
+        (('frequent', 'oblowout', 'can', 'can'), 'frequent'),
+        (('frequent', 'oblowout', 'can', 'probably'), 'occasional'),
+        (('frequent', 'oblowout', 'probably', 'flat'), 'rare'),
+        (('frequent', 'oblowout', 'probably', 'can'), 'occasional'),
+        (('frequent', 'oblowout', 'probably', 'probably'), 'rare'),
+        (('frequent', 'blowout', 'can', 'flat'), 'rare'),
+        (('frequent', 'blowout', 'can', 'can'), 'rare'),
+        (('frequent', 'blowout', 'can', 'probably'), 'rare'),
+        (('frequent', 'blowout', 'probably', 'flat'), 'rare'),
+        (('frequent', 'blowout', 'probably', 'can'), 'rare'),
+        (('frequent', 'blowout', 'probably', 'probably'), 'rare'),
+        (('pervasive', 'persists', 'can', 'flat'), 'frequent'),
+        (('pervasive', 'persists', 'can', 'can'), 'pervasive'),
+        (('pervasive', 'persists', 'can', 'probably'), 'frequent'),
+        (('pervasive', 'persists', 'probably', 'flat'), 'frequent'),
+        (('pervasive', 'persists', 'probably', 'can'), 'pervasive'),
+        (('pervasive', 'persists', 'probably', 'probably'), 'frequent'),
+        (('pervasive', 'breach', 'can', 'flat'), 'frequent'),
+        (('pervasive', 'breach', 'can', 'can'), 'pervasive'),
+        (('pervasive', 'breach', 'can', 'probably'), 'frequent'),
+        (('pervasive', 'breach', 'probably', 'flat'), 'frequent'),
+        (('pervasive', 'breach', 'probably', 'can'), 'pervasive'),
+        (('pervasive', 'breach', 'probably', 'probably'), 'frequent'),
+        (('pervasive', 'oblowout', 'can', 'flat'), 'frequent'),
+        (('pervasive', 'oblowout', 'can', 'can'), 'pervasive'),
+        (('pervasive', 'oblowout', 'can', 'probably'), 'frequent'),
+        (('pervasive', 'oblowout', 'probably', 'flat'), 'occasional'),
+        (('pervasive', 'oblowout', 'probably', 'can'), 'frequent'),
+        (('pervasive', 'oblowout', 'probably', 'probably'), 'occasional'),
+        (('pervasive', 'blowout', 'can', 'flat'), 'occasional'),
+        (('pervasive', 'blowout', 'can', 'can'), 'occasional'),
+        (('pervasive', 'blowout', 'can', 'probably'), 'rare'),
+        (('pervasive', 'blowout', 'probably', 'flat'), 'occasional'),
+        (('pervasive', 'blowout', 'probably', 'can'), 'occasional'),
+        (('pervasive', 'blowout', 'probably', 'probably'), 'rare')
+    ]
+}
+
+
+def make_universe(universe_range):
+    """
+    Builds the sampled universe for a FIS variable, the same way skfuzzy does from np.arange
+    :param universe_range: A (start, stop, step) tuple
+    :return: The universe as a 1-D array
+    """
+    start, stop, step = universe_range
+    return np.arange(start, stop, step)
+
+
+def membership(x, mf_type, params):
+    """
+    Evaluates a triangular or trapezoidal membership function, matching skfuzzy's trimf and trapmf
+    :param x: Array of values to find the membership of
+    :param mf_type: Either 'trimf' or 'trapmf'
+    :param params: The [a, b, c] or [a, b, c, d] breakpoints of the membership function
+    :return: Array of membership values the same shape as x
+    """
+    if mf_type == 'trimf':
+        a, b, c = params
+        d = c
+        c = b
+    elif mf_type == 'trapmf':
+        a, b, c, d = params
+    else:
+        raise Exception("Unsupported membership function: " + str(mf_type))
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.zeros(x.shape, dtype=np.float64)
+
+    # rising edge
+    if b > a:
+        rising = (x > a) & (x < b)
+        y[rising] = (x[rising] - a) / float(b - a)
+    # plateau
+    y[(x >= b) & (x <= c)] = 1.0
+    # falling edge
+    if d > c:
+        falling = (x > c) & (x < d)
+        y[falling] = (d - x[falling]) / float(d - c)
+
+    return y
+
+
+def trapezoid_params(mf_type, params):
+    """
+    Converts the breakpoints of a membership function to the four breakpoints of a trapezoid
+    :param mf_type: Either 'trimf' or 'trapmf'
+    :param params: The [a, b, c] or [a, b, c, d] breakpoints of the membership function
+    :return: The [a, b, c, d] breakpoints of the equivalent trapezoid
+    """
+    if mf_type == 'trimf':
+        return [params[0], params[1], params[1], params[2]]
+    elif mf_type == 'trapmf':
+        return list(params)
+    else:
+        raise Exception("Unsupported membership function: " + str(mf_type))
+
+
+def definition_hash(fis):
+    """
+    Finds a hash of the rules and membership functions of a FIS, used to tell cached results apart
+    :param fis: The FIS definition (see COMB_FIS)
+    :return: A hex string that changes whenever any part of the definition or ENGINE_VERSION changes
+    """
+    return hashlib.md5(json.dumps([ENGINE_VERSION, fis], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class CompiledFIS:
+    """
+    A FIS definition compiled into dense arrays, so that every rule can be evaluated for every reach at once
+    """
+
+    def __init__(self, key, input_bounds, term_inputs, term_params, rule_columns, rule_consequents,
+                 output_bounds, output_edges, output_points):
+        """
+        :param key: The hash of the FIS definition this was compiled from
+        :param input_bounds: A (number of inputs x 2) array of the first and last sample of each input universe
+        :param term_inputs: For each input term, the index of the input it belongs to
+        :param term_params: A (number of input terms x 4) array of trapezoid breakpoints
+        :param rule_columns: A (number of rules x number of inputs) array of membership table columns. Column 0 is
+            always 1 (the input isn't used by the rule), columns 1 to T are the input terms and columns T + 1 to 2T
+            are their complements
+        :param rule_consequents: For each rule, the index of its output term
+        :param output_bounds: The first and last sample of the output universe
+        :param output_edges: A (number of output terms x 2 x 2) array of the (base, span) of the rising and falling
+            edge of each output term, so an edge reaches membership m at base + m * span
+        :param output_points: The places where output term edges cross each other, which are breakpoints of the
+            aggregated output whatever the firing strengths are
+        """
+        self.key = key
+        self.input_bounds = input_bounds
+        self.term_inputs = term_inputs
+        self.term_params = term_params
+        self.rule_columns = rule_columns
+        self.rule_consequents = rule_consequents
+        self.output_bounds = output_bounds
+        self.output_edges = output_edges
+        self.output_points = output_points
+
+    def save(self, file_name):
+        """
+        Saves the compiled arrays to an .npz file
+        :param file_name: The path to save to
+        :return:
+        """
+        np.savez(file_name, key=self.key, input_bounds=self.input_bounds, term_inputs=self.term_inputs,
+                 term_params=self.term_params, rule_columns=self.rule_columns,
+                 rule_consequents=self.rule_consequents, output_bounds=self.output_bounds,
+                 output_edges=self.output_edges, output_points=self.output_points)
+
+    @staticmethod
+    def load(file_name):
+        """
+        Loads compiled arrays saved by save()
+        :param file_name: The path to the .npz file
+        :return: The CompiledFIS
+        """
+        saved = np.load(file_name)
+        return CompiledFIS(str(saved['key']), saved['input_bounds'], saved['term_inputs'], saved['term_params'],
+                           saved['rule_columns'], saved['rule_consequents'], saved['output_bounds'],
+                           saved['output_edges'], saved['output_points'])
+
+
+# Compiled FIS definitions already built in this session, keyed by definition hash
+_compiled_fis = {}
+
+
+def build_compiled_fis(fis):
+    """
+    Compiles a FIS definition into dense rule and term arrays
+    :param fis: The FIS definition (see COMB_FIS)
+    :return: The CompiledFIS
+    """
+    input_bounds = []
+    term_inputs = []
+    term_params = []
+    term_columns = []
+    for i, (name, universe_range, terms) in enumerate(fis['inputs']):
+        universe = make_universe(universe_range)
+        input_bounds.append([universe[0], universe[-1]])
+        columns = {}
+        for term, mf_type, params in terms:
+            columns[term] = len(term_params) + 1
+            term_inputs.append(i)
+            term_params.append(trapezoid_params(mf_type, params))
+        term_columns.append(columns)
+
+    num_terms = len(term_params)
+    output_terms = [term[0] for term in fis['output'][2]]
+    rule_columns = np.zeros((len(fis['rules']), len(fis['inputs'])), dtype=np.int64)
+    rule_consequents = np.zeros(len(fis['rules']), dtype=np.int64)
+    for r, (antecedents, consequent) in enumerate(fis['rules']):
+        for i, term in enumerate(antecedents):
+            if term is None:
+                continue
+            if term.startswith('~'):
+                rule_columns[r, i] = term_columns[i][term[1:]] + num_terms
+            else:
+                rule_columns[r, i] = term_columns[i][term]
+        rule_consequents[r] = output_terms.index(consequent)
+
+    # a vertical edge inside the output universe is a one step ramp to the sampled universe that skfuzzy uses
+    output_universe = make_universe(fis['output'][1])
+    first, last, step = output_universe[0], output_universe[-1], fis['output'][1][2]
+    output_edges = []
+    for term, mf_type, params in fis['output'][2]:
+        a, b, c, d = trapezoid_params(mf_type, params)
+        if a == b and a > first:
+            a -= step
+        if c == d and d < last:
+            d += step
+        output_edges.append([[a, b - a], [d, c - d]])
+    output_edges = np.array(output_edges, dtype=np.float64)
+
+    # every term breakpoint, plus every place where two sloped edges cross
+    output_points = [first, last] + list(output_edges[:, :, 0].ravel()) + \
+        list((output_edges[:, :, 0] + output_edges[:, :, 1]).ravel())
+    edges = output_edges.reshape(-1, 2)
+    for i in range(len(edges)):
+        for j in range(i + 1, len(edges)):
+            if edges[i, 1] != edges[j, 1]:
+                level = (edges[j, 0] - edges[i, 0]) / (edges[i, 1] - edges[j, 1])
+                if 0 < level < 1:
+                    output_points.append(edges[i, 0] + level * edges[i, 1])
+    output_points = np.unique(np.clip(output_points, first, last))
+
+    return CompiledFIS(definition_hash(fis), np.array(input_bounds, dtype=np.float64),
+                       np.array(term_inputs, dtype=np.int64), np.array(term_params, dtype=np.float64),
+                       rule_columns, rule_consequents, np.array([first, last]), output_edges, output_points)
+
+
+def compile_fis(fis, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Returns the compiled form of a FIS definition, from this session's cache or the disk cache if it has been
+    compiled before
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param cache_folder: The folder that compiled FIS definitions are saved in. If None, nothing is saved to disk
+    :return: The CompiledFIS
+    """
+    if isinstance(fis, CompiledFIS):
+        return fis
+
+    key = definition_hash(fis)
+    if key in _compiled_fis:
+        return _compiled_fis[key]
+
+    cache_file = None
+    if cache_folder is not None:
+        cache_file = os.path.join(cache_folder, "fis_" + key + ".npz")
+
+    if cache_file is not None and os.path.exists(cache_file):
+        compiled = CompiledFIS.load(cache_file)
+    else:
+        compiled = build_compiled_fis(fis)
+        if cache_file is not None:
+            if not os.path.exists(cache_folder):
+                os.makedirs(cache_folder)
+            compiled.save(cache_file)
+
+    _compiled_fis[key] = compiled
+    return compiled
+
+
+def trapezoid_membership(x, params):
+    """
+    Evaluates many trapezoids at once
+    :param x: Array of values, broadcastable against each column of params
+    :param params: A (... x 4) array of trapezoid breakpoints
+    :return: Array of membership values
+    """
+    a, b, c, d = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+    # a trapezoid with a vertical edge is 1 up to that edge rather than dividing by zero
+    rising = np.where(b > a, (x - a) / np.where(b > a, b - a, 1.0), 1.0)
+    falling = np.where(d > c, (d - x) / np.where(d > c, d - c, 1.0), 1.0)
+    y = np.clip(np.fmin(rising, falling), 0.0, 1.0)
+    y[(x < a) | (x > d)] = 0.0
+    return y
+
+
+def rule_strengths(fis, inputs, term_params=None):
+    """
+    Finds the firing strength of every output term, aggregated over all rules with that consequent
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param term_params: A (number of reaches x number of input terms x 4) array of trapezoid breakpoints to use
+        instead of the FIS definition's, so each reach can have its own membership functions
+    :return: A (number of reaches x number of output terms) array of firing strengths
+    """
+    compiled = compile_fis(fis)
+
+    # clip inputs to the first and last samples of their universes, like skfuzzy's clip_to_bounds
+    values = np.column_stack([np.asarray(array, dtype=np.float64) for array in inputs])
+    values = np.clip(values, compiled.input_bounds[:, 0], compiled.input_bounds[:, 1])
+    num_reaches = len(values)
+
+    # membership table: a column of ones, then every input term, then every input term's complement
+    if term_params is None:
+        term_params = compiled.term_params
+    term_memberships = trapezoid_membership(values[:, compiled.term_inputs], term_params)
+    table = np.hstack((np.ones((num_reaches, 1)), term_memberships, 1.0 - term_memberships))
+
+    # AND is the minimum over each rule's columns, and rules with the same consequent are combined with the maximum
+    firing = table[:, compiled.rule_columns].min(axis=2)
+    strengths = np.zeros((num_reaches, len(compiled.output_edges)), dtype=np.float64)
+    for term in range(len(compiled.output_edges)):
+        term_rules = compiled.rule_consequents == term
+        if term_rules.any():
+            strengths[:, term] = firing[:, term_rules].max(axis=1)
+
+    return strengths
+
+
+def output_membership(compiled, x):
+    """
+    Evaluates every output term of a compiled FIS
+    :param compiled: The CompiledFIS
+    :param x: Array of places in the output universe
+    :return: Array with one more trailing axis than x, holding the membership of each output term
+    """
+    x = x[..., np.newaxis]
+    base = compiled.output_edges[:, :, 0]
+    span = compiled.output_edges[:, :, 1]
+    rising = np.where(span[:, 0] > 0, (x - base[:, 0]) / np.where(span[:, 0] > 0, span[:, 0], 1.0), 1.0)
+    falling = np.where(span[:, 1] < 0, (x - base[:, 1]) / np.where(span[:, 1] < 0, span[:, 1], 1.0), 1.0)
+    y = np.clip(np.fmin(rising, falling), 0.0, 1.0)
+    y[(x < base[:, 0]) | (x > base[:, 1])] = 0.0
+    return y
+
+
+def defuzzify(fis, strengths):
+    """
+    Clips each output term by its firing strength, aggregates them with the maximum, and finds the centroid.
+    The aggregated output is piecewise linear, so it is integrated exactly between its breakpoints rather than
+    over the sampled output universe
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param strengths: A (number of reaches x number of output terms) array of firing strengths
+    :return: Array of defuzzified values. Reaches where no rule fires get 0
+    """
+    compiled = compile_fis(fis)
+    num_reaches = len(strengths)
+    first, last = compiled.output_bounds
+
+    # besides the fixed breakpoints, the aggregated output bends wherever an edge reaches any term's clip level
+    bases = compiled.output_edges[:, :, 0].ravel()
+    spans = compiled.output_edges[:, :, 1].ravel()
+    cuts = bases[np.newaxis, :, np.newaxis] + strengths[:, np.newaxis, :] * spans[np.newaxis, :, np.newaxis]
+    x = np.hstack((np.tile(compiled.output_points, (num_reaches, 1)), cuts.reshape(num_reaches, -1)))
+    x = np.sort(np.clip(x, first, last), axis=1)
+
+    y = np.fmin(output_membership(compiled, x), strengths[:, np.newaxis, :]).max(axis=2)
+
+    # integrate each linear piece as a trapezoid
+    left = x[:, :-1]
+    right = x[:, 1:]
+    widths = right - left
+    y1 = y[:, :-1]
+    y2 = y[:, 1:]
+    area = ((y1 + y2) * widths).sum(axis=1) / 2.0
+    moment = ((y1 * (2.0 * left + right) + y2 * (left + 2.0 * right)) * widths).sum(axis=1) / 6.0
+
+    out = np.zeros(num_reaches, dtype=np.float64)
+    has_area = area > 0
+    out[has_area] = moment[has_area] / area[has_area]
+    return out
+
+
+def term_centroid(fis, term):
+    """
+    Finds the defuzzified value of an output when only one of its terms fires, fully
+    :param fis: The FIS definition (see COMB_FIS)
+    :param term: The name of the output term
+    :return: The centroid of the term over the output universe
+    """
+    output_terms = [output_term[0] for output_term in fis['output'][2]]
+    strengths = np.zeros((1, len(output_terms)), dtype=np.float64)
+    strengths[0, output_terms.index(term)] = 1.0
+    return defuzzify(fis, strengths)[0]
+
+
+def evaluate_block(args):
+    """
+    Runs the FIS on one block of reaches. This is what each worker process runs in evaluate
+    :param args: The CompiledFIS and a list of input arrays for the block
+    :return: Array of defuzzified values for the block
+    """
+    compiled, block = args
+    return defuzzify(compiled, rule_strengths(compiled, block))
+
+
+def make_pool(processes):
+    """
+    Starts a pool of worker processes
+    :param processes: The number of processes. If None, one per CPU
+    :return: The multiprocessing Pool
+    """
+    # inside ArcMap or ArcCatalog sys.executable is the application, so workers have to be started with python
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    return multiprocessing.Pool(processes)
+
+
+def evaluate(fis, inputs, chunk_size=DEFAULT_CHUNK_SIZE, processes=1):
+    """
+    Runs the FIS on every reach, a block of reaches at a time. Every reach is evaluated independently of the
+    others, so the output is identical whatever the chunk size and number of processes
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param chunk_size: The number of reaches to evaluate at once, which bounds the memory used by each process
+    :param processes: The number of worker processes to spread blocks across. If None, one per CPU
+    :return: Array of defuzzified values, one for each reach
+    """
+    compiled = compile_fis(fis)
+    num_reaches = len(inputs[0])
+    out = np.zeros(num_reaches, dtype=np.float64)
+    starts = range(0, num_reaches, chunk_size)
+    blocks = ((compiled, [array[start:start + chunk_size] for array in inputs]) for start in starts)
+
+    if (processes is None or processes > 1) and len(starts) > 1:
+        pool = make_pool(processes)
+        try:
+            # imap hands out blocks as workers free up and returns them in order, so only the output is kept
+            for start, block_out in zip(starts, pool.imap(evaluate_block, blocks)):
+                out[start:start + chunk_size] = block_out
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start, block in zip(starts, blocks):
+            out[start:start + chunk_size] = evaluate_block(block)
+    return out
+
+
+def input_steps(fis, multiple=1.0):
+    """
+    Finds a quantization resolution for each input of a FIS, as a multiple of the step of its universe
+    :param fis: The FIS definition (see COMB_FIS)
+    :param multiple: The number of universe steps inputs are rounded to
+    :return: A list of resolutions, one for each input
+    """
+    return [multiple * universe_range[2] for name, universe_range, terms in fis['inputs']]
+
+
+def unique_inputs(fis, inputs, resolution=None):
+    """
+    Finds the distinct input tuples among all reaches, after clipping inputs to their universes and rounding them
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param resolution: A list with the resolution to round each input to, or a single resolution for every input.
+        If None, only reaches with exactly the same inputs are combined
+    :return: A list of arrays holding the unique inputs, and the index into them of each reach
+    """
+    compiled = compile_fis(fis)
+    values = np.column_stack([np.asarray(array, dtype=np.float64) for array in inputs])
+    values = np.clip(values, compiled.input_bounds[:, 0], compiled.input_bounds[:, 1])
+    if resolution is not None:
+        resolution = np.asarray(resolution, dtype=np.float64) * np.ones(values.shape[1])
+        rounded = resolution > 0
+        values[:, rounded] = np.round(values[:, rounded] / resolution[rounded]) * resolution[rounded]
+        values = np.clip(values, compiled.input_bounds[:, 0], compiled.input_bounds[:, 1])
+
+    # sort the rows so identical tuples are next to each other, then number each run of identical rows
+    order = np.lexsort(values.T[::-1])
+    sorted_values = values[order]
+    is_new = np.ones(len(values), dtype=bool)
+    is_new[1:] = np.any(sorted_values[1:] != sorted_values[:-1], axis=1)
+    index = np.empty(len(values), dtype=np.int64)
+    index[order] = np.cumsum(is_new) - 1
+
+    unique = sorted_values[is_new]
+    return [unique[:, i] for i in range(unique.shape[1])], index
+
+
+def evaluate_unique(fis, inputs, resolution=None, chunk_size=DEFAULT_CHUNK_SIZE, processes=1):
+    """
+    Runs the FIS once for each distinct input tuple and copies the results back to every reach that shares it
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param resolution: The resolution to round inputs to before finding distinct tuples (see unique_inputs)
+    :param chunk_size: The number of distinct tuples to evaluate at once
+    :param processes: The number of worker processes to spread blocks across (see evaluate)
+    :return: Array of defuzzified values, one for each reach, and the fraction of reaches that reused the result
+        of another reach
+    """
+    num_reaches = len(inputs[0])
+    if num_reaches == 0:
+        return np.zeros(0, dtype=np.float64), 0.0
+
+    unique, index = unique_inputs(fis, inputs, resolution)
+    out = evaluate(fis, unique, chunk_size, processes)[index]
+    hit_rate = 1.0 - float(len(unique[0])) / num_reaches
+    return out, hit_rate
+
+
+def evaluate_incremental(fis, reach_ids, inputs, sidecar_file, resolution=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                         processes=1):
+    """
+    Runs the FIS only on reaches whose inputs changed since the last run, and reuses the previous output for the
+    rest. The fingerprint of each reach, its exact FIS inputs, is kept with its output in a sidecar file keyed by
+    ReachID
+    :param fis: The FIS definition (see COMB_FIS)
+    :param reach_ids: Array of the ReachID of each reach
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param sidecar_file: The .npz file the fingerprints and outputs are read from and saved to
+    :param resolution: The resolution to round inputs to before finding distinct tuples (see unique_inputs)
+    :param chunk_size: The number of distinct tuples to evaluate at once
+    :param processes: The number of worker processes to spread blocks across (see evaluate)
+    :return: Array of defuzzified values, one for each reach, the number of reaches that were evaluated, and the
+        fraction of those that reused the result of another reach
+    """
+    reach_ids = np.asarray(reach_ids, dtype=np.int64)
+    fingerprints = np.column_stack([np.asarray(array, dtype=np.float64) for array in inputs])
+    key = definition_hash([fis, resolution])
+    out = np.zeros(len(reach_ids), dtype=np.float64)
+    changed = np.ones(len(reach_ids), dtype=bool)
+
+    if os.path.exists(sidecar_file):
+        previous = np.load(sidecar_file)
+        if str(previous['key']) == key and len(previous['reach_ids']) > 0:
+            # find each reach in the previous run, and keep its output if its inputs are exactly the same
+            order = np.argsort(previous['reach_ids'])
+            previous_ids = previous['reach_ids'][order]
+            position = np.clip(np.searchsorted(previous_ids, reach_ids), 0, len(previous_ids) - 1)
+            found = previous_ids[position] == reach_ids
+            previous_row = order[position]
+            same = found & np.all(previous['fingerprints'][previous_row] == fingerprints, axis=1)
+            out[same] = previous['out'][previous_row[same]]
+            changed = ~same
+
+    hit_rate = 0.0
+    if changed.any():
+        out[changed], hit_rate = evaluate_unique(fis, [fingerprints[changed, i] for i in range(len(inputs))],
+                                                 resolution, chunk_size, processes)
+
+    np.savez(sidecar_file, key=key, reach_ids=reach_ids, fingerprints=fingerprints, out=out)
+    return out, int(changed.sum()), hit_rate
+
+
+def perturbed_term_params(fis, num_sets, spread, seed=None):
+    """
+    Makes random sets of input membership functions by moving each breakpoint by up to a fraction of its value.
+    Breakpoints shared by neighbouring terms move together, breakpoints at the ends of a universe stay put, and
+    each input's breakpoints stay in order. Output terms are not perturbed
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param num_sets: The number of parameter sets
+    :param spread: The largest relative change to any breakpoint, e.g. 0.1 moves 1000 to between 900 and 1100
+    :param seed: Seed for the random number generator, so a sensitivity run can be repeated
+    :return: A (number of sets x number of input terms x 4) array of trapezoid breakpoints
+    """
+    compiled = compile_fis(fis)
+    random_state = np.random.RandomState(seed)
+    term_params = np.tile(compiled.term_params, (num_sets, 1, 1))
+    for i, (first, last) in enumerate(compiled.input_bounds):
+        input_terms = compiled.term_inputs == i
+        params = compiled.term_params[input_terms]
+        breakpoints = np.unique(params)
+        moved = breakpoints * (1.0 + random_state.uniform(-spread, spread, (num_sets, len(breakpoints))))
+        moved = np.clip(moved, first, last)
+        fixed = (breakpoints <= first) | (breakpoints >= last)
+        moved[:, fixed] = breakpoints[fixed]
+        moved = np.sort(moved, axis=1)
+        term_params[:, input_terms] = moved[:, np.searchsorted(breakpoints, params)]
+    return term_params
+
+
+def evaluate_perturbed(fis, inputs, term_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Runs the FIS on every reach for every set of input membership functions. Each block of reaches is evaluated
+    for all of the sets at once
+    :param fis: The FIS definition (see COMB_FIS), or an already compiled FIS
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :param term_params: A (number of sets x number of input terms x 4) array of trapezoid breakpoints (see
+        perturbed_term_params)
+    :param chunk_size: The number of (set, reach) pairs to evaluate at once
+    :return: A (number of sets x number of reaches) array of defuzzified values
+    """
+    compiled = compile_fis(fis)
+    num_sets = len(term_params)
+    num_reaches = len(inputs[0])
+    block_size = max(1, chunk_size // num_sets)
+    out = np.zeros((num_sets, num_reaches), dtype=np.float64)
+    for start in range(0, num_reaches, block_size):
+        # every reach in the block is repeated once for each set, and paired with that set's breakpoints
+        block = [np.tile(np.asarray(array[start:start + block_size], dtype=np.float64), num_sets)
+                 for array in inputs]
+        block_reaches = len(block[0]) // num_sets
+        block_params = np.repeat(term_params, block_reaches, axis=0)
+        strengths = rule_strengths(compiled, block, block_params)
+        out[:, start:start + block_size] = defuzzify(compiled, strengths).reshape(num_sets, block_reaches)
+    return out
+
+
+def build_lookup_surface(fis, resolution=DEFAULT_SURFACE_RESOLUTION):
+    """
+    Evaluates a two input FIS on a regular grid covering both input universes
+    :param fis: The FIS definition, which must have exactly two inputs (see VEG_FIS)
+    :param resolution: The spacing between grid nodes
+    :return: The grid nodes along each input, the (x nodes x y nodes) surface, and the maximum interpolation error
+    """
+    if len(fis['inputs']) != 2:
+        raise Exception("Lookup surfaces can only be built for a FIS with two inputs")
+
+    grids = []
+    for fis_input in fis['inputs']:
+        universe = make_universe(fis_input[1])
+        num_nodes = int(round((universe[-1] - universe[0]) / resolution)) + 1
+        grids.append(np.linspace(universe[0], universe[-1], num_nodes))
+    x_grid, y_grid = grids
+
+    x_nodes, y_nodes = np.meshgrid(x_grid, y_grid, indexing='ij')
+    surface = evaluate(fis, [x_nodes.ravel(), y_nodes.ravel()]).reshape(x_nodes.shape)
+
+    # bilinear interpolation is exact at the nodes, so check it against the exact engine at the cell centres and
+    # edge midpoints, the points furthest from any node
+    x_mid = (x_grid[:-1] + x_grid[1:]) / 2.0
+    y_mid = (y_grid[:-1] + y_grid[1:]) / 2.0
+    max_error = 0.0
+    for check_x, check_y in [(x_mid, y_mid), (x_mid, y_grid), (x_grid, y_mid)]:
+        x_check, y_check = np.meshgrid(check_x, check_y, indexing='ij')
+        exact = evaluate(fis, [x_check.ravel(), y_check.ravel()])
+        interpolated = interpolate_surface(x_grid, y_grid, surface, x_check.ravel(), y_check.ravel())
+        max_error = max(max_error, float(np.max(np.abs(exact - interpolated))))
+
+    return x_grid, y_grid, surface, max_error
+
+
+def load_lookup_surface(fis, resolution=DEFAULT_SURFACE_RESOLUTION, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Loads the lookup surface for a FIS from the cache, building and caching it first if it doesn't exist yet
+    :param fis: The FIS definition, which must have exactly two inputs (see VEG_FIS)
+    :param resolution: The spacing between grid nodes
+    :param cache_folder: The folder that lookup surfaces are saved in
+    :return: The grid nodes along each input, the (x nodes x y nodes) surface, and the maximum interpolation error
+    """
+    key = definition_hash(fis) + "_" + repr(float(resolution)).replace('.', 'p')
+    cache_file = os.path.join(cache_folder, "surface_" + key + ".npz")
+
+    if os.path.exists(cache_file):
+        cached = np.load(cache_file)
+        return cached['x_grid'], cached['y_grid'], cached['surface'], float(cached['max_error'])
+
+    x_grid, y_grid, surface, max_error = build_lookup_surface(fis, resolution)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    np.savez(cache_file, x_grid=x_grid, y_grid=y_grid, surface=surface, max_error=max_error)
+    return x_grid, y_grid, surface, max_error
+
+
+def interpolate_surface(x_grid, y_grid, surface, x, y):
+    """
+    Bilinearly interpolates a lookup surface at every (x, y) pair
+    :param x_grid: The grid nodes along the first input
+    :param y_grid: The grid nodes along the second input
+    :param surface: The (x nodes x y nodes) surface
+    :param x: Array of values for the first input
+    :param y: Array of values for the second input
+    :return: Array of interpolated values
+    """
+    x = np.clip(np.asarray(x, dtype=np.float64), x_grid[0], x_grid[-1])
+    y = np.clip(np.asarray(y, dtype=np.float64), y_grid[0], y_grid[-1])
+
+    i = np.clip(np.searchsorted(x_grid, x, side='right') - 1, 0, len(x_grid) - 2)
+    j = np.clip(np.searchsorted(y_grid, y, side='right') - 1, 0, len(y_grid) - 2)
+    tx = (x - x_grid[i]) / (x_grid[i + 1] - x_grid[i])
+    ty = (y - y_grid[j]) / (y_grid[j + 1] - y_grid[j])
+
+    return (surface[i, j] * (1 - tx) * (1 - ty) + surface[i + 1, j] * tx * (1 - ty) +
+            surface[i, j + 1] * (1 - tx) * ty + surface[i + 1, j + 1] * tx * ty)
+
+
+def evaluate_with_surface(fis, inputs, resolution=DEFAULT_SURFACE_RESOLUTION, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Answers a two input FIS for every reach from its cached lookup surface
+    :param fis: The FIS definition, which must have exactly two inputs (see VEG_FIS)
+    :param inputs: A list of the two input arrays
+    :param resolution: The spacing between grid nodes
+    :param cache_folder: The folder that lookup surfaces are saved in
+    :return: Array of interpolated values, and the maximum interpolation error of the surface
+    """
+    x_grid, y_grid, surface, max_error = load_lookup_surface(fis, resolution, cache_folder)
+    return interpolate_surface(x_grid, y_grid, surface, inputs[0], inputs[1]), max_error
+
+
+def evaluate_skfuzzy(fis, inputs):
+    """
+    Runs the FIS one reach at a time through skfuzzy's ControlSystemSimulation. This is the reference that the
+    vectorized engine is checked against, and is much slower
+    :param fis: The FIS definition (see COMB_FIS)
+    :param inputs: A list of arrays, one for each input in the FIS definition, all the same length
+    :return: Array of defuzzified values, one for each reach
+    """
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    def build_variable(variable, definition):
+        name, universe_range, terms = definition
+        for term, mf_type, params in terms:
+            variable[term] = getattr(fuzz, mf_type)(variable.universe, params)
+        return variable
+
+    antecedents = [build_variable(ctrl.Antecedent(make_universe(fis_input[1]), 'input' + str(i + 1)), fis_input)
+                   for i, fis_input in enumerate(fis['inputs'])]
+    consequent = build_variable(ctrl.Consequent(make_universe(fis['output'][1]), 'result'), fis['output'])
+
+    rules = []
+    for rule_antecedents, rule_consequent in fis['rules']:
+        clause = None
+        for antecedent, term in zip(antecedents, rule_antecedents):
+            if term is None:
+                continue
+            if term.startswith('~'):
+                term_clause = ~antecedent[term[1:]]
+            else:
+                term_clause = antecedent[term]
+            clause = term_clause if clause is None else clause & term_clause
+        rules.append(ctrl.Rule(clause, consequent[rule_consequent]))
+
+    simulation = ctrl.ControlSystemSimulation(ctrl.ControlSystem(rules))
+
+    out = np.zeros(len(inputs[0]))
+    for i in range(len(out)):
+        for j, values in enumerate(inputs):
+            simulation.input['input' + str(j + 1)] = values[i]
+        simulation.compute()
+        out[i] = simulation.output['result']
+    return out
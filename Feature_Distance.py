@@ -0,0 +1,286 @@
+# -------------------------------------------------------------------------------
+# Name:        Feature Distance
+# Purpose:     Finds the distance from each reach to nearby features, such as roads and canals, from their vertices
+#              instead of a distance raster
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import numpy as np
+import SpatialIndex
+reload(SpatialIndex)
+
+
+# The distance between the points sampled along and across each reach, in meters
+DEFAULT_SAMPLE_SPACING = 10.0
+
+# The number of sample points searched at once, which bounds the memory a search uses
+DEFAULT_CHUNK_SIZE = 20000
+
+
+def distances_from_features(network, features, buffer_distance=0.0, spacing=DEFAULT_SAMPLE_SPACING):
+    """
+    Finds the minimum and mean distance from each reach to each of a set of features, by sampling points along each
+    reach (and across its buffer) and finding the distance from each point to the nearest feature. The reaches are
+    sampled once for every set of features
+    :param network: The stream network
+    :param features: A list of (name, feature class) pairs. The feature classes can be points, lines or polygons, and
+        points inside a polygon are 0 from it
+    :param buffer_distance: The distance in meters either side of each reach to sample, so the results are over the
+        reach's buffer rather than its line. If 0, only points on the line are sampled
+    :param spacing: The distance in meters between sample points
+    :return: Array of the ReachID of each reach, and a dictionary of each set of features' name to arrays of the
+        minimum and mean distance for each reach in the network's units, or to None if it has no features. Reaches
+        without sample points are NaN
+    """
+    spatial_reference = arcpy.Describe(network).spatialReference
+    # the points are sampled in the network's units
+    buffer_distance = buffer_distance / spatial_reference.metersPerUnit
+    spacing = spacing / spatial_reference.metersPerUnit
+    reach_ids, sample_reaches, x, y = sample_reaches_and_buffers(network, spatial_reference, buffer_distance, spacing)
+
+    distances = {}
+    for name, feature in features:
+        segments, is_polygon = read_feature_segments(feature, spatial_reference)
+        if len(segments[0]) == 0:
+            distances[name] = None
+            continue
+        sample_distances = nearest_distances(x, y, segments, is_polygon, spacing=spacing)
+        distances[name] = reach_statistics(sample_reaches, sample_distances, len(reach_ids))
+    return reach_ids, distances
+
+
+def sample_reaches_and_buffers(network, spatial_reference, buffer_distance=0.0, spacing=DEFAULT_SAMPLE_SPACING):
+    """
+    Samples points evenly along each reach, including both its ends, and across it out to a distance either side
+    :param network: The stream network
+    :param spatial_reference: The coordinate system to give the points in
+    :param buffer_distance: The distance either side of each reach to sample
+    :param spacing: The distance between sample points
+    :return: Array of the ReachID of each reach, then arrays of the reach (as an index into the ReachIDs) and the x and
+        y coordinates of each sample point
+    """
+    vertices = arcpy.da.FeatureClassToNumPyArray(network, ['ReachID', 'SHAPE@X', 'SHAPE@Y'],
+                                                 spatial_reference=spatial_reference, explode_to_points=True)
+    vertex_ids = vertices['ReachID']
+    x = np.asarray(vertices['SHAPE@X'], np.float64)
+    y = np.asarray(vertices['SHAPE@Y'], np.float64)
+    if len(vertex_ids) == 0:
+        return vertex_ids, np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+
+    # each reach's vertices are listed together, in order along the reach
+    firsts = np.nonzero(np.append(True, vertex_ids[1:] != vertex_ids[:-1]))[0]
+    lasts = np.append(firsts[1:], len(vertex_ids)) - 1
+    segment_lengths = np.hypot(np.diff(x), np.diff(y))
+    segment_lengths[vertex_ids[1:] != vertex_ids[:-1]] = 0
+    distances = np.append(0.0, np.cumsum(segment_lengths))
+    reach_lengths = distances[lasts] - distances[firsts]
+
+    # samples every spacing along each reach, plus one at its end
+    num_samples = np.floor(reach_lengths / spacing).astype(np.int64) + 1
+    num_samples += (reach_lengths > (num_samples - 1) * spacing)
+    reaches = np.repeat(np.arange(len(firsts)), num_samples)
+    steps = np.arange(num_samples.sum()) - np.repeat(np.cumsum(num_samples) - num_samples, num_samples)
+    along = np.minimum(steps * spacing, reach_lengths[reaches]) + distances[firsts][reaches]
+
+    # the segment each sample is on ends at the first vertex of its reach at least that far along
+    ends = np.clip(np.searchsorted(distances, along, 'left'), firsts[reaches] + 1,
+                   np.maximum(lasts[reaches], firsts[reaches] + 1))
+    ends = np.minimum(ends, len(x) - 1)
+    starts = np.maximum(ends - 1, firsts[reaches])
+    lengths = distances[ends] - distances[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(lengths > 0, (along - distances[starts]) / lengths, 0.0)
+        direction_x = np.where(lengths > 0, (x[ends] - x[starts]) / lengths, 0.0)
+        direction_y = np.where(lengths > 0, (y[ends] - y[starts]) / lengths, 0.0)
+    sample_x = x[starts] + t * (x[ends] - x[starts])
+    sample_y = y[starts] + t * (y[ends] - y[starts])
+
+    # and across the reach, square to the segment the sample is on
+    if buffer_distance > 0:
+        num_offsets = int(np.ceil(buffer_distance / spacing))
+        offsets = np.linspace(-buffer_distance, buffer_distance, 2 * num_offsets + 1)
+        sample_x = (sample_x[:, np.newaxis] - direction_y[:, np.newaxis] * offsets).ravel()
+        sample_y = (sample_y[:, np.newaxis] + direction_x[:, np.newaxis] * offsets).ravel()
+        reaches = np.repeat(reaches, len(offsets))
+
+    return vertex_ids[firsts], reaches, sample_x, sample_y
+
+
+def read_feature_segments(feature, spatial_reference):
+    """
+    Reads the line segments of a feature class, with each point feature as a segment of no length
+    :param feature: The feature class
+    :param spatial_reference: The coordinate system to read the segments in
+    :return: Arrays of the start and end coordinates of each segment, as (x0, y0, x1, y1), and whether the features
+        are polygons. Polygon rings are read in their stored order: clockwise for outer rings and counterclockwise for
+        holes
+    """
+    shape_type = arcpy.Describe(feature).shapeType
+    x0 = []
+    y0 = []
+    x1 = []
+    y1 = []
+    if shape_type in ['Point', 'Multipoint']:
+        with arcpy.da.SearchCursor(feature, ['SHAPE@XY'], spatial_reference=spatial_reference,
+                                   explode_to_points=True) as cursor:
+            for row in cursor:
+                if row[0] is not None and row[0][0] is not None:
+                    x0.append(row[0][0])
+                    y0.append(row[0][1])
+        x1 = x0
+        y1 = y0
+    else:
+        with arcpy.da.SearchCursor(feature, ['SHAPE@'], spatial_reference=spatial_reference) as cursor:
+            for row in cursor:
+                if row[0] is None:
+                    continue
+                for part in row[0]:
+                    # polygon parts list their rings one after another, split by None
+                    ring = []
+                    for point in list(part) + [None]:
+                        if point is not None:
+                            ring.append((point.X, point.Y))
+                            continue
+                        if shape_type == 'Polygon' and len(ring) > 1 and ring[0] != ring[-1]:
+                            ring.append(ring[0])
+                        for start, end in zip(ring[:-1], ring[1:]):
+                            x0.append(start[0])
+                            y0.append(start[1])
+                            x1.append(end[0])
+                            y1.append(end[1])
+                        ring = []
+    segments = (np.array(x0, np.float64), np.array(y0, np.float64), np.array(x1, np.float64),
+                np.array(y1, np.float64))
+    return segments, shape_type == 'Polygon'
+
+
+def nearest_distances(x, y, segments, is_polygon=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                      spacing=DEFAULT_SAMPLE_SPACING):
+    """
+    Finds the distance from each point to the nearest segment. Points are searched for in a small box around them
+    first, and the points with nothing in it are searched for again in a box twice the size, using a spatial index
+    with cells as large as the box, until every point has found a segment
+    :param x: Array of the x coordinate of each point
+    :param y: Array of the y coordinate of each point
+    :param segments: Arrays of the start and end coordinates of each segment, as (x0, y0, x1, y1). There must be at
+        least one
+    :param is_polygon: If True, the segments are polygon rings, and points inside a polygon are 0 from it
+    :param chunk_size: The number of points searched at once
+    :param spacing: The distance between the points, which is the smallest box searched
+    :return: Array of the distance from each point to the nearest segment
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    x0, y0, x1, y1 = segments
+    owners = np.arange(len(x0))
+
+    # the first box is at least as wide as the gap between points, and the average gap between segments if they were
+    # spread evenly over their extent, so point features (whose segments have no length) don't start at a tiny box
+    median_length = np.median(np.hypot(x1 - x0, y1 - y0))
+    extent_area = (max(x0.max(), x1.max()) - min(x0.min(), x1.min())) * \
+        (max(y0.max(), y1.max()) - min(y0.min(), y1.min()))
+    cell_size = max(2 * median_length, spacing, np.sqrt(extent_area / len(x0)))
+    indexes = [SpatialIndex.SegmentIndex(x0, y0, x1, y1, owners, cell_size)]
+    distances = np.full(len(x), np.inf)
+    if len(x) == 0:
+        return distances
+
+    # no point can be further from every segment than the size of everything together
+    x_min = min(x.min(), x0.min(), x1.min())
+    x_max = max(x.max(), x0.max(), x1.max())
+    y_min = min(y.min(), y0.min(), y1.min())
+    y_max = max(y.max(), y0.max(), y1.max())
+    max_distance = np.hypot(x_max - x_min, y_max - y_min)
+
+    for start in range(0, len(x), chunk_size):
+        points = np.arange(start, min(start + chunk_size, len(x)))
+        level = 0
+        while len(points) > 0:
+            if level >= len(indexes):
+                indexes.append(SpatialIndex.SegmentIndex(x0, y0, x1, y1, owners, indexes[0].cell_size * 2 ** level))
+            radius = indexes[level].cell_size
+            # once the box holds everything, points without a segment (with no coordinates) never will have one
+            searched_all = radius > max_distance
+            if searched_all:
+                radius = max_distance + indexes[0].cell_size
+            found, inside = search_box(indexes[level], x[points], y[points], radius, is_polygon)
+            distances[points] = np.where(inside, 0.0, found)
+            points = points[np.isinf(found) & ~searched_all]
+            level += 1
+    return distances
+
+
+def search_box(index, x, y, radius, is_polygon=False):
+    """
+    Finds the distance from each point to the nearest segment within a distance of it
+    :param index: The SpatialIndex.SegmentIndex of the segments
+    :param x: Array of the x coordinate of each point
+    :param y: Array of the y coordinate of each point
+    :param radius: The largest distance to search
+    :param is_polygon: If True, also finds whether each point is inside a polygon, from which side of its nearest
+        segments it is on. A point nearest a vertex is tested against both of the vertex's segments together
+    :return: Arrays of the distance to the nearest segment (inf if there is none within radius) and whether the point
+        is inside a polygon
+    """
+    col_min, row_min = index.cells(x - radius, y - radius)
+    col_max, row_max = index.cells(x + radius, y + radius)
+    queries, segments = index.candidates(col_min, row_min, col_max, row_max)
+    if is_polygon:
+        # a segment listed under more than one cell would be counted twice for a point
+        keys = np.unique(queries * len(index.x0) + segments)
+        queries = keys // len(index.x0)
+        segments = keys % len(index.x0)
+
+    distances = SpatialIndex.point_segment_distance(x[queries], y[queries], index.x0[segments], index.y0[segments],
+                                                    index.x1[segments], index.y1[segments])
+    within = distances <= radius
+    queries = queries[within]
+    segments = segments[within]
+    distances = distances[within]
+
+    nearest = np.full(len(x), np.inf)
+    order = np.lexsort((distances, queries))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = queries[order][1:] != queries[order][:-1]
+    nearest[queries[order][first]] = distances[order][first]
+
+    inside = np.zeros(len(x), dtype=bool)
+    if is_polygon and len(queries) > 0:
+        tolerance = 1e-9 * max(radius, 1.0)
+        near = distances <= nearest[queries] + tolerance
+        queries = queries[near]
+        segments = segments[near]
+        dx = index.x1[segments] - index.x0[segments]
+        dy = index.y1[segments] - index.y0[segments]
+        lengths = np.hypot(dx, dy)
+        # the distance to the left of the segment's line, which is outside a clockwise ring
+        cross = dx * (y[queries] - index.y0[segments]) - dy * (x[queries] - index.x0[segments])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sides = np.where(lengths > 0, cross / lengths, 0.0)
+        inside = np.bincount(queries, sides, minlength=len(x)) < 0
+        inside &= nearest > 0
+    return nearest, inside
+
+
+def reach_statistics(sample_reaches, sample_distances, num_reaches):
+    """
+    Combines the distances of each reach's sample points
+    :param sample_reaches: Array of the reach of each sample point
+    :param sample_distances: Array of the distance of each sample point
+    :param num_reaches: The number of reaches
+    :return: Arrays of the minimum and mean distance for each reach, NaN for reaches without sample points
+    """
+    counts = np.bincount(sample_reaches, minlength=num_reaches)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(sample_reaches, sample_distances, minlength=num_reaches) / counts
+    minimums = np.full(num_reaches, np.inf)
+    order = np.lexsort((sample_distances, sample_reaches))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sample_reaches[order][1:] != sample_reaches[order][:-1]
+    minimums[sample_reaches[order][first]] = sample_distances[order][first]
+    minimums[counts == 0] = np.nan
+    return minimums, means
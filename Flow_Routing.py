@@ -0,0 +1,260 @@
+# -------------------------------------------------------------------------------
+# Name:        Flow Routing
+# Purpose:     Works out D8 flow directions and flow accumulation over NumPy arrays, without Spatial Analyst
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import Depression_Filling
+
+
+# The neighbours of a cell, in the same order bdws uses: row by row from the top left, with the cell itself (no flow
+# direction) in the middle
+ROW_OFFSET = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+COL_OFFSET = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+NO_DIRECTION = 4
+
+# The flag of each neighbour in the flags of which neighbours are at the same elevation as a cell
+FLAT_BITS = np.array([1, 2, 4, 8, 0, 16, 32, 64, 128], dtype=np.uint8)
+
+# The most cells routed in memory. Routing holds about 11 bytes a cell (a byte each for the flow directions, the
+# flats and the donor counts, and 8 for the accumulation), so larger DEMs could run 32-bit ArcMap out of memory
+MAX_ROUTED_CELLS = 25000000
+
+# The flow direction code of each neighbour, as written by ArcGIS FlowDirection and by TauDEM D8FlowDir
+FLOW_DIR_ESRI = np.array([32, 64, 128, 16, 0, 1, 8, 4, 2])
+FLOW_DIR_TAUDEM = np.array([4, 3, 2, 5, 0, 1, 6, 7, 8])
+
+
+def flow_directions(filled, cell_width, cell_height):
+    """
+    Finds the D8 flow direction of every cell, which is the neighbour with the steepest drop to it. Cells on flats
+    flow toward the nearest cell on the flat that has somewhere lower to go, and cells on the DEM's edge or next to
+    NoData with nowhere lower to go flow off the DEM
+    :param filled: A 2D array of elevations with depressions filled, with NaN for NoData
+    :param cell_width: The width of a cell
+    :param cell_height: The height of a cell
+    :return: A 2D array of the index of the neighbour each cell flows to (see ROW_OFFSET and COL_OFFSET), with
+        NO_DIRECTION for cells that don't flow anywhere and -1 for NoData
+    """
+    num_rows, num_cols = filled.shape
+    padded = np.full((num_rows + 2, num_cols + 2), np.nan)
+    padded[1:-1, 1:-1] = filled
+    directions, flat_neighbours = band_flow_directions(padded, cell_width, cell_height)
+    resolve_flats(directions, flat_neighbours)
+    return directions
+
+
+def flow_directions_in_bands(dem, cell_width, cell_height, block_rows=Depression_Filling.DEFAULT_BLOCK_ROWS):
+    """
+    Finds the D8 flow direction of every cell like flow_directions, reading the DEM a band of rows at a time, so the
+    DEM is never held whole. Only the directions and which neighbours of each cell are at the same elevation are
+    kept, at a byte a cell each, and flats that cross bands are resolved from them
+    :param dem: The filled DEM, as a DEM_Processing.FilledDEM or anything else with num_rows, num_cols and a
+        read_window like RasterSampler's
+    :param cell_width: The width of a cell
+    :param cell_height: The height of a cell
+    :param block_rows: The number of rows read at once. Reading the bands of a FilledDEM in order fills each once
+    :return: A 2D array of flow directions (see flow_directions)
+    """
+    num_rows, num_cols = dem.num_rows, dem.num_cols
+    directions = np.empty((num_rows, num_cols), dtype=np.int8)
+    flat_neighbours = np.empty((num_rows, num_cols), dtype=np.uint8)
+    row_above = np.full(num_cols, np.nan)
+    for row_start in range(0, num_rows, block_rows):
+        band_rows = min(block_rows, num_rows - row_start)
+        window = np.full((band_rows + 2, num_cols + 2), np.nan)
+        window[0, 1:-1] = row_above
+        window[1:-1, 1:-1] = dem.read_window(row_start, 0, band_rows, num_cols)
+        if row_start + band_rows < num_rows:
+            # the band below is read after this one, so a FilledDEM keeps it for the next band
+            window[-1, 1:-1] = dem.read_window(row_start + band_rows, 0, 1, num_cols)[0]
+        row_above = window[-2, 1:-1].copy()
+        directions[row_start:row_start + band_rows], flat_neighbours[row_start:row_start + band_rows] = \
+            band_flow_directions(window, cell_width, cell_height)
+    resolve_flats(directions, flat_neighbours)
+    return directions
+
+
+def band_flow_directions(padded, cell_width, cell_height):
+    """
+    Finds the flow direction of every cell of a band that has a lower neighbour or is next to the DEM's edge or
+    NoData, and which of each cell's neighbours are at the same elevation as it
+    :param padded: A 2D array of the band's filled elevations with a border one cell wide of its neighbouring cells,
+        with NaN for NoData and cells off the DEM
+    :param cell_width: The width of a cell
+    :param cell_height: The height of a cell
+    :return: A 2D array of the flow directions of the band (see flow_directions), with NO_DIRECTION for cells on
+        flats, and a 2D array of flags of the neighbours at the same elevation (see FLAT_BITS)
+    """
+    num_rows = padded.shape[0] - 2
+    num_cols = padded.shape[1] - 2
+    filled = padded[1:-1, 1:-1]
+    has_data = ~np.isnan(filled)
+
+    directions = np.full(filled.shape, NO_DIRECTION, dtype=np.int8)
+    flat_neighbours = np.zeros(filled.shape, dtype=np.uint8)
+    steepest = np.zeros(filled.shape)
+    next_to_outside = np.zeros(filled.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for neighbour in range(9):
+            if neighbour == NO_DIRECTION:
+                continue
+            neighbour_values = padded[1 + ROW_OFFSET[neighbour]:num_rows + 1 + ROW_OFFSET[neighbour],
+                                      1 + COL_OFFSET[neighbour]:num_cols + 1 + COL_OFFSET[neighbour]]
+            distance = np.hypot(ROW_OFFSET[neighbour] * cell_height, COL_OFFSET[neighbour] * cell_width)
+            drops = (filled - neighbour_values) / distance
+            steeper = drops > steepest
+            directions[steeper] = neighbour
+            steepest[steeper] = drops[steeper]
+            flat_neighbours |= (neighbour_values == filled).astype(np.uint8) * FLAT_BITS[neighbour]
+
+            # cells with nowhere lower to go flow to the first cell off the DEM they touch
+            outside = np.isnan(neighbour_values) & ~next_to_outside
+            next_to_outside |= outside
+            directions[outside & has_data & (steepest <= 0)] = neighbour
+    directions[~has_data] = -1
+    return directions, flat_neighbours
+
+
+def resolve_flats(directions, flat_neighbours):
+    """
+    Gives the cells on flats a flow direction, by searching outward from the cells that already have one across cells
+    of the same elevation, so each flat cell flows one step closer to where the flat drains. Each step of the search
+    handles every cell it reaches at once
+    :param directions: The 2D array of flow directions, with NO_DIRECTION for cells on flats, which is updated
+    :param flat_neighbours: A 2D array of flags of the neighbours of each cell at the same elevation (see FLAT_BITS)
+    :return:
+    """
+    num_cols = directions.shape[1]
+    flat_directions = directions.ravel()
+    flags = flat_neighbours.ravel()
+    offsets = ROW_OFFSET * num_cols + COL_OFFSET
+    if not np.any(flat_directions == NO_DIRECTION):
+        return
+
+    # cells with a direction that are next to a flat cell of the same elevation start the search
+    search = np.nonzero((flat_directions >= 0) & (flat_directions != NO_DIRECTION) & (flags > 0))[0]
+    while len(search) > 0:
+        reached = []
+        for neighbour in range(9):
+            if neighbour == NO_DIRECTION:
+                continue
+            cells = search[(flags[search] & FLAT_BITS[neighbour]) > 0] + offsets[neighbour]
+            cells = cells[flat_directions[cells] == NO_DIRECTION]
+            # the other cell flows back the way the search came
+            flat_directions[cells] = 8 - neighbour
+            reached.append(cells)
+        search = np.unique(np.concatenate(reached))
+
+
+def find_receivers(directions, cells=None):
+    """
+    Finds the cell each cell flows into
+    :param directions: A 2D array of flow directions from flow_directions
+    :param cells: An optional array of the flat indices of the cells to find receivers for. Defaults to every cell
+    :return: A 1D array of the flat index of the cell each cell flows into, or -1 for cells that flow off the DEM,
+        don't flow anywhere, or are NoData
+    """
+    num_rows, num_cols = directions.shape
+    flat_directions = directions.ravel()
+    if cells is None:
+        cells = np.arange(flat_directions.size)
+    cell_directions = flat_directions[cells]
+    flows = (cell_directions >= 0) & (cell_directions != NO_DIRECTION)
+    safe_directions = np.where(flows, cell_directions, NO_DIRECTION)
+    to_rows = cells // num_cols + ROW_OFFSET[safe_directions]
+    to_cols = cells % num_cols + COL_OFFSET[safe_directions]
+    on_dem = flows & (to_rows >= 0) & (to_rows < num_rows) & (to_cols >= 0) & (to_cols < num_cols)
+    receivers = np.where(on_dem, to_rows * num_cols + to_cols, -1)
+    receivers[on_dem] = np.where(flat_directions[receivers[on_dem]] >= 0, receivers[on_dem], -1)
+    return receivers
+
+
+def count_donors(directions):
+    """
+    Counts the cells that flow into each cell
+    :param directions: A 2D array of flow directions from flow_directions
+    :return: A 2D array of the number of neighbours flowing into each cell
+    """
+    num_rows, num_cols = directions.shape
+    donors = np.zeros(directions.shape, dtype=np.int8)
+    has_data = directions >= 0
+    for neighbour in range(9):
+        if neighbour == NO_DIRECTION:
+            continue
+        # cells flowing to this neighbour, and the cells they flow into
+        from_rows = slice(max(0, -ROW_OFFSET[neighbour]), num_rows - max(0, ROW_OFFSET[neighbour]))
+        from_cols = slice(max(0, -COL_OFFSET[neighbour]), num_cols - max(0, COL_OFFSET[neighbour]))
+        to_rows = slice(max(0, ROW_OFFSET[neighbour]), num_rows - max(0, -ROW_OFFSET[neighbour]))
+        to_cols = slice(max(0, COL_OFFSET[neighbour]), num_cols - max(0, -COL_OFFSET[neighbour]))
+        donors[to_rows, to_cols] += (directions[from_rows, from_cols] == neighbour) & has_data[to_rows, to_cols]
+    return donors
+
+
+def accumulate_flow(directions, weights=None, block_rows=Depression_Filling.DEFAULT_BLOCK_ROWS):
+    """
+    Accumulates flow down the flow directions, like FlowAccumulation: each cell gets the total weight of the cells
+    that flow into it, not counting itself. Cells are passed on in topological order, starting from cells nothing
+    flows into, and a cell is only passed on once every cell flowing into it has been, so each cell is passed on
+    once. The cells are passed on a step at a time, every cell that is ready at once, and the starting cells are
+    taken a band of rows at a time, so besides the output only a byte a cell is held
+    :param directions: A 2D array of flow directions from flow_directions
+    :param weights: A 2D array of the weight of each cell, such as its area. Defaults to 1 for every cell
+    :param block_rows: The number of rows whose starting cells are taken at once
+    :return: A 2D array of the accumulated weight of each cell, with NaN for NoData
+    """
+    num_rows, num_cols = directions.shape
+    flat_directions = directions.ravel()
+    donors = count_donors(directions).ravel()
+    if weights is None:
+        totals = (flat_directions >= 0).astype(np.float64)
+    else:
+        totals = np.where(flat_directions >= 0, np.asarray(weights, np.float64).ravel(), 0.0)
+
+    for row_start in range(0, num_rows, block_rows):
+        cell_start = row_start * num_cols
+        cell_stop = min(row_start + block_rows, num_rows) * num_cols
+        cells = np.nonzero((donors[cell_start:cell_stop] == 0) & (flat_directions[cell_start:cell_stop] >= 0))[0]
+        cells += cell_start
+        while len(cells) > 0:
+            # mark the cells as passed on, so a later band doesn't start from them again
+            donors[cells] = -1
+            receivers = find_receivers(directions, cells)
+            flows = receivers >= 0
+            cells = cells[flows]
+            receivers = receivers[flows]
+            # several cells can flow into the same receiver in one step
+            receivers, positions = np.unique(receivers, return_inverse=True)
+            totals[receivers] += np.bincount(positions, totals[cells], len(receivers))
+            donors[receivers] -= np.bincount(positions, minlength=len(receivers)).astype(np.int8)
+            cells = receivers[donors[receivers] == 0]
+
+    # take each cell's own weight back off, without another array the size of the DEM
+    if weights is None:
+        totals -= 1.0
+    else:
+        totals -= np.asarray(weights, np.float64).ravel()
+    totals[flat_directions < 0] = np.nan
+    return totals.reshape(directions.shape)
+
+
+def direction_codes(directions, coding='ESRI'):
+    """
+    Converts flow directions to the codes written to a flow direction raster
+    :param directions: A 2D array of flow directions from flow_directions
+    :param coding: 'ESRI' for the codes ArcGIS uses (1 for east, doubling clockwise to 128 for northeast) or 'TAUDEM'
+        for the codes TauDEM uses (1 for east, counting counterclockwise to 8 for southeast). bdws accepts either
+    :return: A 2D array of the codes, with 0 for cells that don't flow anywhere and NaN for NoData
+    """
+    if coding == 'ESRI':
+        codes = FLOW_DIR_ESRI
+    elif coding == 'TAUDEM':
+        codes = FLOW_DIR_TAUDEM
+    else:
+        raise Exception("Unknown flow direction coding: " + str(coding))
+    return np.where(directions >= 0, codes[np.maximum(directions, 0)], np.nan)
+
@@ -0,0 +1,257 @@
+# -------------------------------------------------------------------------------
+# Name:        Raster Sampler
+# Purpose:     Samples raster values at many points at once, reading only the raster blocks the points fall in
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import numpy as np
+from collections import OrderedDict
+
+
+# The width and height in cells of the raster blocks that are read
+DEFAULT_BLOCK_SIZE = 512
+
+# The number of blocks kept in memory. Points are sampled in block order, so each block is normally read once
+DEFAULT_CACHE_BLOCKS = 16
+
+
+class RasterSampler:
+    """
+    Samples a raster at points by working out each point's cell from the raster's extent and cell size, then reading
+    the raster in square blocks, only where there are points. Only a few blocks are held in memory at once, so a
+    large raster never has to be read whole
+    """
+
+    def __init__(self, raster, block_size=DEFAULT_BLOCK_SIZE, cache_blocks=DEFAULT_CACHE_BLOCKS):
+        """
+        :param raster: The raster, as a path or a Raster object
+        :param block_size: The width and height in cells of the blocks that are read
+        :param cache_blocks: The number of blocks kept in memory
+        """
+        self.raster = arcpy.Raster(raster) if not isinstance(raster, arcpy.Raster) else raster
+        self.x_min = self.raster.extent.XMin
+        self.y_max = self.raster.extent.YMax
+        self.cell_width = self.raster.meanCellWidth
+        self.cell_height = self.raster.meanCellHeight
+        self.num_rows = self.raster.height
+        self.num_cols = self.raster.width
+        self.no_data = self.raster.noDataValue
+        self.spatial_reference = self.raster.spatialReference
+        self.block_size = int(block_size)
+        self.cache_blocks = int(cache_blocks)
+        self.cache = OrderedDict()
+
+    def find_cells(self, x, y):
+        """
+        Finds the cell each point is in
+        :param x: Array of the x coordinate of each point, in the raster's coordinate system
+        :param y: Array of the y coordinate of each point, in the raster's coordinate system
+        :return: Arrays of the row and column of each point's cell, and whether the point is on the raster
+        """
+        rows = np.floor((self.y_max - np.asarray(y, np.float64)) / self.cell_height).astype(np.int64)
+        cols = np.floor((np.asarray(x, np.float64) - self.x_min) / self.cell_width).astype(np.int64)
+        on_raster = (rows >= 0) & (rows < self.num_rows) & (cols >= 0) & (cols < self.num_cols)
+        return rows, cols, on_raster
+
+    def read_block(self, block_row, block_col, halo=0):
+        """
+        Reads one block of the raster, from the cache if it was read recently
+        :param block_row: The row of the block, counted in blocks
+        :param block_col: The column of the block, counted in blocks
+        :param halo: The number of extra cells read on each side of the block
+        :return: Array of the block's values as doubles, with NoData as NaN. Its first row and column are halo cells
+            before the block, and any cells off the raster are NaN
+        """
+        key = (block_row, block_col, halo)
+        if key in self.cache:
+            block = self.cache.pop(key)
+            self.cache[key] = block
+            return block
+
+        size = self.block_size + 2 * halo
+        block = self.read_window(block_row * self.block_size - halo, block_col * self.block_size - halo, size, size)
+
+        self.cache[key] = block
+        if len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+        return block
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        """
+        Reads a window of the raster, which can reach off the raster
+        :param row_start: The first row of the window
+        :param col_start: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: Array of the window's values as doubles, with NoData and cells off the raster as NaN
+        """
+        window = np.full((num_rows, num_cols), np.nan)
+
+        # only read the part of the window that is on the raster
+        read_row_start = max(row_start, 0)
+        read_col_start = max(col_start, 0)
+        read_row_stop = min(row_start + num_rows, self.num_rows)
+        read_col_stop = min(col_start + num_cols, self.num_cols)
+        if read_row_stop > read_row_start and read_col_stop > read_col_start:
+            lower_left = arcpy.Point(self.x_min + read_col_start * self.cell_width,
+                                     self.y_max - read_row_stop * self.cell_height)
+            values = arcpy.RasterToNumPyArray(self.raster, lower_left, read_col_stop - read_col_start,
+                                              read_row_stop - read_row_start).astype(np.float64)
+            if self.no_data is not None:
+                values[values == self.no_data] = np.nan
+            window[read_row_start - row_start:read_row_stop - row_start,
+                   read_col_start - col_start:read_col_stop - col_start] = values
+        return window
+
+    def window_offsets(self, radius):
+        """
+        Finds the cells around a cell whose centers are within a distance of its center
+        :param radius: The distance, in the raster's units
+        :return: Arrays of the row and column offset of each cell, including the center cell
+        """
+        row_radius = int(np.floor(radius / self.cell_height))
+        col_radius = int(np.floor(radius / self.cell_width))
+        row_offsets, col_offsets = np.mgrid[-row_radius:row_radius + 1, -col_radius:col_radius + 1]
+        within = (row_offsets * self.cell_height) ** 2 + (col_offsets * self.cell_width) ** 2 <= radius ** 2
+        return row_offsets[within], col_offsets[within]
+
+    def sample(self, x, y, radius=0, stat_type='VALUE'):
+        """
+        Samples the raster at every point
+        :param x: Array of the x coordinate of each point, in the raster's coordinate system
+        :param y: Array of the y coordinate of each point, in the raster's coordinate system
+        :param radius: The distance around each point to sample, in the raster's units. Cells whose centers are within
+            this distance of the center of the point's cell are sampled. If 0, only the point's cell is sampled
+        :param stat_type: How the cells around each point are combined: 'VALUE' (only the point's cell), 'MINIMUM',
+            'MAXIMUM' or 'MEAN'. NoData cells are left out
+        :return: Array of the value for each point. Points off the raster, or with only NoData cells, are NaN
+        """
+        if stat_type not in ['VALUE', 'MINIMUM', 'MAXIMUM', 'MEAN']:
+            raise Exception("Unknown raster sample statistic: " + str(stat_type))
+        if stat_type == 'VALUE':
+            radius = 0
+        rows, cols, on_raster = self.find_cells(x, y)
+        row_offsets, col_offsets = self.window_offsets(radius)
+        halo = int(max(np.abs(row_offsets).max(), np.abs(col_offsets).max()))
+
+        values = np.full(len(rows), np.nan)
+        with np.errstate(invalid='ignore'):
+            for block_points in self.group_by_block(rows, cols, np.nonzero(on_raster)[0]):
+                block_row = int(rows[block_points[0]] // self.block_size)
+                block_col = int(cols[block_points[0]] // self.block_size)
+                block = self.read_block(block_row, block_col, halo)
+                local_rows = rows[block_points] - block_row * self.block_size + halo
+                local_cols = cols[block_points] - block_col * self.block_size + halo
+                values[block_points] = combine_window(block, local_rows, local_cols, row_offsets, col_offsets,
+                                                      stat_type)
+        return values
+
+    def read_cells(self, rows, cols):
+        """
+        Reads the values of a set of cells
+        :param rows: Array of the row of each cell
+        :param cols: Array of the column of each cell
+        :return: Array of the value of each cell, as doubles. Cells off the raster, or NoData, are NaN
+        """
+        rows = np.asarray(rows, np.int64)
+        cols = np.asarray(cols, np.int64)
+        on_raster = (rows >= 0) & (rows < self.num_rows) & (cols >= 0) & (cols < self.num_cols)
+        values = np.full(len(rows), np.nan)
+        for block_cells in self.group_by_block(rows, cols, np.nonzero(on_raster)[0]):
+            block_row = int(rows[block_cells[0]] // self.block_size)
+            block_col = int(cols[block_cells[0]] // self.block_size)
+            block = self.read_block(block_row, block_col)
+            values[block_cells] = block[rows[block_cells] - block_row * self.block_size,
+                                        cols[block_cells] - block_col * self.block_size]
+        return values
+
+    def group_by_block(self, rows, cols, cells):
+        """
+        Sorts cells by the block they are in, so each block only has to be read once
+        :param rows: Array of the row of every cell
+        :param cols: Array of the column of every cell
+        :param cells: Array of the indices of the cells to sort, which must be on the raster
+        :return: A list of arrays of cell indices, one for each block with cells in it
+        """
+        if len(cells) == 0:
+            return []
+        block_rows = rows[cells] // self.block_size
+        block_cols = cols[cells] // self.block_size
+        keys = block_rows * ((self.num_cols + self.block_size - 1) // self.block_size) + block_cols
+        order = np.argsort(keys, kind='mergesort')
+        cells = cells[order]
+        keys = keys[order]
+        starts = np.nonzero(np.append(True, keys[1:] != keys[:-1]))[0]
+        stops = np.append(starts[1:], len(cells))
+        return [cells[start:stop] for start, stop in zip(starts.tolist(), stops.tolist())]
+
+
+def combine_window(block, rows, cols, row_offsets, col_offsets, stat_type):
+    """
+    Combines the cells around each of a set of cells in a block
+    :param block: The block of raster values, with NaN for NoData
+    :param rows: Array of the row of each cell in the block
+    :param cols: Array of the column of each cell in the block
+    :param row_offsets: Array of the row offset of each cell to combine
+    :param col_offsets: Array of the column offset of each cell to combine
+    :param stat_type: 'VALUE', 'MINIMUM', 'MAXIMUM' or 'MEAN'
+    :return: Array of the combined value for each cell
+    """
+    if stat_type == 'VALUE':
+        return block[rows, cols]
+    elif stat_type == 'MINIMUM' or stat_type == 'MAXIMUM':
+        combine = np.fmin if stat_type == 'MINIMUM' else np.fmax
+        result = np.full(len(rows), np.nan)
+        for row_offset, col_offset in zip(row_offsets.tolist(), col_offsets.tolist()):
+            combine(result, block[rows + row_offset, cols + col_offset], out=result)
+        return result
+    total = np.zeros(len(rows))
+    count = np.zeros(len(rows))
+    for row_offset, col_offset in zip(row_offsets.tolist(), col_offsets.tolist()):
+        window_values = block[rows + row_offset, cols + col_offset]
+        has_data = ~np.isnan(window_values)
+        total[has_data] += window_values[has_data]
+        count[has_data] += 1
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def find_reach_points(network, spatial_reference=None):
+    """
+    Finds the start, middle and end point of each reach from its vertices, without geoprocessing tools
+    :param network: The stream network
+    :param spatial_reference: The coordinate system to give the points in. Defaults to the network's
+    :return: Array of the ReachID of each reach, and arrays of the x and y coordinates of its start, middle and end,
+        as ((start_x, start_y), (mid_x, mid_y), (end_x, end_y))
+    """
+    if spatial_reference is None:
+        spatial_reference = arcpy.Describe(network).spatialReference
+    vertices = arcpy.da.FeatureClassToNumPyArray(network, ['ReachID', 'SHAPE@X', 'SHAPE@Y'],
+                                                 spatial_reference=spatial_reference, explode_to_points=True)
+    vertex_ids = vertices['ReachID']
+    x = np.asarray(vertices['SHAPE@X'], np.float64)
+    y = np.asarray(vertices['SHAPE@Y'], np.float64)
+
+    # each reach's vertices are listed together, in order along the reach
+    firsts = np.nonzero(np.append(True, vertex_ids[1:] != vertex_ids[:-1]))[0]
+    lasts = np.append(firsts[1:], len(vertex_ids)) - 1
+
+    # the middle is half way along the reach's length
+    segment_lengths = np.hypot(np.diff(x), np.diff(y))
+    segment_lengths[vertex_ids[1:] != vertex_ids[:-1]] = 0
+    distances = np.append(0.0, np.cumsum(segment_lengths))
+    half_distances = (distances[firsts] + distances[lasts]) / 2
+    # the segment the middle is on ends at the first vertex of the reach at least half way along it
+    ends = np.clip(np.searchsorted(distances, half_distances, 'left'), firsts + 1, np.maximum(lasts, firsts + 1))
+    ends = np.minimum(ends, len(x) - 1)
+    starts = np.maximum(ends - 1, firsts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(distances[ends] > distances[starts],
+                     (half_distances - distances[starts]) / (distances[ends] - distances[starts]), 0.0)
+    mid_x = x[starts] + t * (x[ends] - x[starts])
+    mid_y = y[starts] + t * (y[ends] - y[starts])
+
+    return vertex_ids[firsts], ((x[firsts], y[firsts]), (mid_x, mid_y), (x[lasts], y[lasts]))
@@ -0,0 +1,184 @@
+# -------------------------------------------------------------------------------
+# Name:        Reach Table
+# Purpose:     Holds the attributes of a BRAT network in memory, so the model stages can share one copy of them
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import numpy as np
+from SupportingFunctions import write_fields_by_reach_id
+
+
+class ReachTable:
+    """
+    A structured NumPy array of reach attributes, one row per reach, indexed by ReachID. The model stages read and
+    add fields through it, and only the fields they change are written back to the network, in one pass, by flush.
+    Field names are matched without regard to case, like shapefile field names
+    """
+
+    def __init__(self, data, field_types=None):
+        """
+        :param data: A structured array with a ReachID field
+        :param field_types: A dictionary of field name to the type it should be written as, for fields that don't
+            exist in the network yet. Fields not listed are written as doubles
+        """
+        self.data = data
+        self.field_types = field_types if field_types is not None else {}
+        self.changed_fields = []
+        self.sorted_order = np.argsort(data['ReachID'])
+
+    @staticmethod
+    def load(in_network, fields):
+        """
+        Reads fields from a network, in one pass
+        :param in_network: The BRAT network
+        :param fields: The fields to read. ReachID is always read
+        :return: The ReachTable
+        """
+        return ReachTable(arcpy.da.FeatureClassToNumPyArray(in_network, ['ReachID'] + unique_fields(fields)))
+
+    def load_fields(self, in_network, fields):
+        """
+        Reads any of the given fields that aren't already in the table from a network
+        :param in_network: The BRAT network
+        :param fields: The fields that need to be in the table
+        :return:
+        """
+        missing_fields = [field for field in unique_fields(fields) if field not in self]
+        if len(missing_fields) == 0:
+            return
+        new_data = arcpy.da.FeatureClassToNumPyArray(in_network, ['ReachID'] + missing_fields)
+        rows = self.find_rows(new_data['ReachID'])
+        for field in missing_fields:
+            values = np.zeros(len(self.data), dtype=new_data.dtype[field])
+            values[rows] = new_data[field]
+            self.add_field(field, values)
+
+    def find_field(self, field):
+        """
+        Finds the name a field has in the table
+        :param field: The field name, in any case
+        :return: The field name as it is in the table, or None if the table doesn't have the field
+        """
+        for name in self.data.dtype.names:
+            if name.lower() == field.lower():
+                return name
+        return None
+
+    def fields(self):
+        """
+        :return: A list of the fields in the table
+        """
+        return list(self.data.dtype.names)
+
+    def reach_ids(self):
+        """
+        :return: Array of the ReachID of each row
+        """
+        return self.data['ReachID']
+
+    def find_rows(self, reach_ids):
+        """
+        Finds the rows of the given reaches
+        :param reach_ids: Array of ReachIDs
+        :return: Array of row indices
+        """
+        sorted_ids = self.data['ReachID'][self.sorted_order]
+        positions = np.clip(np.searchsorted(sorted_ids, reach_ids), 0, len(sorted_ids) - 1)
+        if not np.all(sorted_ids[positions] == reach_ids):
+            raise Exception("Some ReachIDs are not in the reach table")
+        return self.sorted_order[positions]
+
+    def add_field(self, field, values):
+        """
+        Adds a new field to the table
+        :param field: The field name
+        :param values: Array of values, one for each row
+        :return:
+        """
+        field = str(field)
+        values = np.asarray(values)
+        new_data = np.empty(len(self.data), dtype=[(name, self.data.dtype[name]) for name in self.data.dtype.names] +
+                                                  [(field, values.dtype)])
+        for name in self.data.dtype.names:
+            new_data[name] = self.data[name]
+        new_data[field] = values
+        self.data = new_data
+
+    def set_field(self, field, values, field_type='DOUBLE'):
+        """
+        Sets a field's values, adding it to the table if needed, and marks it to be written by flush
+        :param field: The field name
+        :param values: Array of values, one for each row
+        :param field_type: The type the field is added to the network as, if it isn't already there
+        :return:
+        """
+        name = self.find_field(field)
+        values = np.asarray(values)
+        if name is None or self.data.dtype[name] != values.dtype:
+            if name is not None:
+                self.data = remove_field(self.data, name)
+            name = str(field)
+            self.add_field(name, values)
+        else:
+            self.data[name] = values
+        self.field_types[name] = field_type
+        if name not in self.changed_fields:
+            self.changed_fields.append(name)
+
+    def __contains__(self, field):
+        return self.find_field(field) is not None
+
+    def __getitem__(self, field):
+        name = self.find_field(field)
+        if name is None:
+            raise KeyError(field)
+        return self.data[name]
+
+    def __setitem__(self, field, values):
+        self.set_field(field, values)
+
+    def flush(self, out_network):
+        """
+        Writes every field set since the last flush to a network, in one pass
+        :param out_network: The network to write to
+        :return:
+        """
+        if len(self.changed_fields) == 0:
+            return
+        write_fields_by_reach_id(out_network, self.data['ReachID'],
+                                 [(name, self.data[name], self.field_types.get(name, 'DOUBLE'))
+                                  for name in self.changed_fields])
+        self.changed_fields = []
+
+
+def unique_fields(fields):
+    """
+    Removes ReachID and repeated fields, ignoring case
+    :param fields: A list of field names
+    :return: The list without repeats, in the same order
+    """
+    found = ['reachid']
+    unique = []
+    for field in fields:
+        if field.lower() not in found:
+            found.append(field.lower())
+            unique.append(field)
+    return unique
+
+
+def remove_field(data, field):
+    """
+    Makes a copy of a structured array without one of its fields
+    :param data: The structured array
+    :param field: The field to remove
+    :return: The new structured array
+    """
+    names = [name for name in data.dtype.names if name != field]
+    new_data = np.empty(len(data), dtype=[(name, data.dtype[name]) for name in names])
+    for name in names:
+        new_data[name] = data[name]
+    return new_data
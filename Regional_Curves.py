@@ -0,0 +1,69 @@
+# -------------------------------------------------------------------------------
+# Name:        Regional Curves
+# Purpose:     Calculates discharge from the regional curve equations, and stream power from discharge, over NumPy
+#              arrays. Doesn't use arcpy, so it can run outside ArcGIS
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import Equation_Engine
+
+
+# --regional curve equations for Qlow (baseflow) and Q2 (annual peak streamflow)--
+# # # Add in regional curve equations here, as region code: (Qlow equation, Q2 equation) # # #
+REGIONAL_EQUATIONS = {
+    # example 1 (box elder county)
+    101: ("0.019875 * (DAsqm ** 0.6634) * (10 ** (0.6068 * 2.04))", "14.5 * DAsqm ** 0.328"),
+    # example 2 (upper green generic)
+    102: ("4.2758 * (DAsqm ** 0.299)", "22.2 * (DAsqm ** 0.608) * ((42 - 40) ** 0.1)"),
+    # oregon region 5
+    24: ("0.000133 * (DAsqm ** 1.05) * (15.3 ** 2.1)", "0.000258 * (DAsqm ** 0.893) * (15.3 ** 3.15)")
+}
+
+# The equations used for any other region
+DEFAULT_EQUATIONS = ("(DAsqm ** 0.2098) + 1", "14.7 * (DAsqm ** 0.815)")
+
+
+def calc_discharge(DAsqm, region, q_low_eqtn, q2_eqtn, covariates=None, equations=None):
+    """
+    Calculates Qlow and Q2 for every reach from the regional curve equations
+    :param DAsqm: Array of drainage areas, in square miles
+    :param region: The region code to identify an already existing equation
+    :param q_low_eqtn: The Qlow equation to be calculated, or None to use the region's equation
+    :param q2_eqtn: The Q2 equation to be calculated, or None to use the region's equation
+    :param covariates: An optional dictionary of equation variable to a single value or an array with a value for
+        each reach
+    :param equations: An optional dictionary of region code to (Qlow equation, Q2 equation), used instead of
+        REGIONAL_EQUATIONS
+    :return: Arrays of Qlow and Q2
+    """
+    if equations is None:
+        equations = REGIONAL_EQUATIONS
+    region_q_low_eqtn, region_q2_eqtn = equations.get(region, equations.get('default', DEFAULT_EQUATIONS))
+    if q_low_eqtn is None:
+        q_low_eqtn = region_q_low_eqtn
+    if q2_eqtn is None:
+        q2_eqtn = region_q2_eqtn
+
+    # the equations are compiled once and cached, and can only use the variables in Equation_Engine
+    variables = dict(covariates) if covariates is not None else {}
+    variables['DAsqm'] = DAsqm
+    q_low = Equation_Engine.evaluate_equation(q_low_eqtn, variables)
+    q2 = Equation_Engine.evaluate_equation(q2_eqtn, variables)
+
+    return q_low, q2
+
+
+def calc_stream_power(slope, discharge):
+    """
+    Calculates stream power as density of water (1000 kg/m3) * acceleration due to gravity (9.80665 m/s2) *
+    discharge (m3/s) * channel slope. Slopes under 0.001 are raised to 0.001
+    :param slope: The channel slope, as a single value or an array
+    :param discharge: The discharge in cubic feet per second, as a single value or an array
+    :return: The stream power
+    """
+    slope = np.where(slope < 0.001, 0.001, slope)
+    return (1000 * 9.80665) * slope * (discharge * 0.028316846592)
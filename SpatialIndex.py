@@ -0,0 +1,194 @@
+# -------------------------------------------------------------------------------
+# Name:        Spatial Index
+# Purpose:     Finds the reaches near points and boxes without geoprocessing tools, using a grid index over the
+#              line segments of a stream network
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+
+class SegmentIndex:
+    """
+    A uniform grid over the line segments of a set of polylines. Each segment is listed under every grid cell its
+    bounding box touches, so a query only measures the segments in the cells around it
+    """
+
+    def __init__(self, x0, y0, x1, y1, owners, cell_size=None):
+        """
+        :param x0: Array of the x coordinate of the start of each segment
+        :param y0: Array of the y coordinate of the start of each segment
+        :param x1: Array of the x coordinate of the end of each segment
+        :param y1: Array of the y coordinate of the end of each segment
+        :param owners: Array of the index of the polyline each segment belongs to
+        :param cell_size: The width of the grid cells. Defaults to twice the median segment length
+        """
+        self.x0 = np.asarray(x0, np.float64)
+        self.y0 = np.asarray(y0, np.float64)
+        self.x1 = np.asarray(x1, np.float64)
+        self.y1 = np.asarray(y1, np.float64)
+        self.owners = np.asarray(owners, np.int64)
+
+        if cell_size is None:
+            lengths = np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+            cell_size = 2 * np.median(lengths) if len(lengths) > 0 else 1.0
+        self.cell_size = max(float(cell_size), 1e-9)
+        self.box_x_min = np.fmin(self.x0, self.x1)
+        self.box_y_min = np.fmin(self.y0, self.y1)
+        self.box_x_max = np.fmax(self.x0, self.x1)
+        self.box_y_max = np.fmax(self.y0, self.y1)
+        if len(self.x0) > 0:
+            self.extent = (self.box_x_min.min(), self.box_y_min.min(), self.box_x_max.max(), self.box_y_max.max())
+        else:
+            self.extent = (0.0, 0.0, 0.0, 0.0)
+        self.origin = self.extent[:2]
+
+        # the segments sorted by the left of their bounding boxes, for boxes too large to look up cell by cell
+        self.x_min_order = np.argsort(self.box_x_min, kind='mergesort')
+        self.sorted_x_min = self.box_x_min[self.x_min_order]
+
+        # list every segment under each cell its bounding box touches, sorted by cell
+        col_min, row_min = self.cells(self.box_x_min, self.box_y_min)
+        col_max, row_max = self.cells(self.box_x_max, self.box_y_max)
+        num_cols = col_max - col_min + 1
+        num_cells = num_cols * (row_max - row_min + 1)
+        segments = np.repeat(np.arange(len(self.x0)), num_cells)
+        offsets = np.arange(num_cells.sum()) - np.repeat(np.cumsum(num_cells) - num_cells, num_cells)
+        keys = self.cell_keys(col_min[segments] + offsets % num_cols[segments],
+                              row_min[segments] + offsets // num_cols[segments])
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.segments = segments[order]
+
+    @staticmethod
+    def from_polylines(vertex_owners, vertex_x, vertex_y, cell_size=None, vertex_parts=None):
+        """
+        Makes an index from the vertices of polylines, listed in order along each polyline
+        :param vertex_owners: Array of the index of the polyline each vertex belongs to
+        :param vertex_x: Array of the x coordinate of each vertex
+        :param vertex_y: Array of the y coordinate of each vertex
+        :param cell_size: The width of the grid cells (see __init__)
+        :param vertex_parts: An optional array of the part each vertex belongs to, for multipart polylines. The last
+            vertex of one part and the first of the next don't make a segment
+        :return: The SegmentIndex
+        """
+        vertex_owners = np.asarray(vertex_owners)
+        vertex_x = np.asarray(vertex_x, np.float64)
+        vertex_y = np.asarray(vertex_y, np.float64)
+        # consecutive vertices of the same part of the same polyline make a segment
+        same_line = vertex_owners[:-1] == vertex_owners[1:]
+        if vertex_parts is not None:
+            vertex_parts = np.asarray(vertex_parts)
+            same_line &= vertex_parts[:-1] == vertex_parts[1:]
+        starts = np.nonzero(same_line)[0]
+        return SegmentIndex(vertex_x[starts], vertex_y[starts], vertex_x[starts + 1], vertex_y[starts + 1],
+                            vertex_owners[starts], cell_size)
+
+    def cells(self, x, y):
+        """
+        :return: Arrays of the grid column and row of each point
+        """
+        return (np.floor((np.asarray(x, np.float64) - self.origin[0]) / self.cell_size).astype(np.int64),
+                np.floor((np.asarray(y, np.float64) - self.origin[1]) / self.cell_size).astype(np.int64))
+
+    @staticmethod
+    def cell_keys(cols, rows):
+        """
+        :return: Array of a single integer key for each grid cell
+        """
+        return (rows + 2 ** 30) * 2 ** 31 + (cols + 2 ** 30)
+
+    def candidates(self, col_min, row_min, col_max, row_max):
+        """
+        Finds the segments listed under any cell in each of a set of cell ranges
+        :return: Arrays of the query each candidate belongs to and the candidate segment. A segment can be listed
+            more than once for a query
+        """
+        num_cols = col_max - col_min + 1
+        num_cells = num_cols * (row_max - row_min + 1)
+        queries = np.repeat(np.arange(len(col_min)), num_cells)
+        offsets = np.arange(num_cells.sum()) - np.repeat(np.cumsum(num_cells) - num_cells, num_cells)
+        keys = self.cell_keys(col_min[queries] + offsets % num_cols[queries],
+                              row_min[queries] + offsets // num_cols[queries])
+
+        first = np.searchsorted(self.keys, keys, 'left')
+        count = np.searchsorted(self.keys, keys, 'right') - first
+        cell_queries = np.repeat(queries, count)
+        positions = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)
+        return cell_queries, self.segments[positions]
+
+    def nearest(self, x, y, max_distance):
+        """
+        Finds the nearest polyline to each point, if there is one within a distance
+        :param x: Array of the x coordinate of each point
+        :param y: Array of the y coordinate of each point
+        :param max_distance: The largest distance to search
+        :return: Arrays of the index of the nearest polyline to each point (-1 if none are within max_distance) and
+            its distance (inf if none are within max_distance)
+        """
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        col_min, row_min = self.cells(x - max_distance, y - max_distance)
+        col_max, row_max = self.cells(x + max_distance, y + max_distance)
+        queries, segments = self.candidates(col_min, row_min, col_max, row_max)
+
+        distances = point_segment_distance(x[queries], y[queries], self.x0[segments], self.y0[segments],
+                                           self.x1[segments], self.y1[segments])
+        within = distances <= max_distance
+        queries = queries[within]
+        segments = segments[within]
+        distances = distances[within]
+
+        # keep the closest segment of each point
+        order = np.lexsort((distances, queries))
+        queries = queries[order]
+        first = np.ones(len(queries), dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+
+        nearest_owner = np.full(len(x), -1, dtype=np.int64)
+        nearest_distance = np.full(len(x), np.inf)
+        nearest_owner[queries[first]] = self.owners[segments[order][first]]
+        nearest_distance[queries[first]] = distances[order][first]
+        return nearest_owner, nearest_distance
+
+    def owners_in_box(self, x_min, y_min, x_max, y_max):
+        """
+        Finds the polylines with a segment whose bounding box overlaps a box. The box is clipped to the extent of the
+        segments first, and if it still covers more grid cells than there are segments, the segments are filtered by
+        their bounding boxes instead of being looked up cell by cell
+        :return: Array of the indices of the polylines, without repeats
+        """
+        x_min = max(x_min, self.extent[0])
+        y_min = max(y_min, self.extent[1])
+        x_max = min(x_max, self.extent[2])
+        y_max = min(y_max, self.extent[3])
+        if len(self.x0) == 0 or x_min > x_max or y_min > y_max:
+            return np.zeros(0, dtype=np.int64)
+
+        col_min, row_min = self.cells(np.array([x_min]), np.array([y_min]))
+        col_max, row_max = self.cells(np.array([x_max]), np.array([y_max]))
+        num_cells = (col_max[0] - col_min[0] + 1) * (row_max[0] - row_min[0] + 1)
+        if num_cells > len(self.x0):
+            segments = self.x_min_order[:np.searchsorted(self.sorted_x_min, x_max, 'right')]
+        else:
+            segments = self.candidates(col_min, row_min, col_max, row_max)[1]
+        overlaps = ((self.box_x_min[segments] <= x_max) & (self.box_x_max[segments] >= x_min) &
+                    (self.box_y_min[segments] <= y_max) & (self.box_y_max[segments] >= y_min))
+        return np.unique(self.owners[segments[overlaps]])
+
+
+def point_segment_distance(x, y, x0, y0, x1, y1):
+    """
+    Finds the distance from each point to a line segment
+    :return: Array of distances
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    length_squared = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length_squared > 0, ((x - x0) * dx + (y - y0) * dy) / length_squared, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(x - (x0 + t * dx), y - (y0 + t * dy))
@@ -10,6 +10,7 @@
 import os
 import arcpy
 import uuid
+import numpy as np
 
 
 def find_folder(folder_location, folder_name):
@@ -171,3 +172,49 @@ def write_xml_element_with_path(xml_file, base_element, xml_element_name, item_n
     xml_file.add_sub_element(new_element, "Name", item_name)
     relative_path = find_relative_path(path, project_root)
     xml_file.add_sub_element(new_element, "Path", relative_path)
+
+
+def write_fields_by_reach_id(in_network, reach_ids, field_arrays, field_type='DOUBLE'):
+    """
+    Writes arrays of values to a feature class in a single UpdateCursor pass, matching each value to its feature
+    by ReachID. Fields that don't exist yet are added
+    :param in_network: The feature class to write to
+    :param reach_ids: Array of the ReachID that each value belongs to
+    :param field_arrays: A list of (field name, array of values) pairs, each array in the same order as reach_ids.
+        A pair can also have a third item, the type to add that field as
+    :param field_type: The type of any fields that have to be added
+    :return: A list of the ReachIDs that have no feature, and the number of features whose ReachID has no value
+    """
+    field_names = [field_array[0] for field_array in field_arrays]
+    existing_fields = [f.name.lower() for f in arcpy.ListFields(in_network)]
+    for field_array in field_arrays:
+        if field_array[0].lower() not in existing_fields:
+            new_field_type = field_array[2] if len(field_array) > 2 else field_type
+            arcpy.AddField_management(in_network, field_array[0], new_field_type)
+
+    reach_ids = np.asarray(reach_ids)
+    index = dict((reach_id, i) for i, reach_id in enumerate(reach_ids.tolist()))
+    columns = [np.asarray(field_array[1]).tolist() for field_array in field_arrays]
+    written = np.zeros(len(reach_ids), dtype=bool)
+    num_unmatched_features = 0
+
+    with arcpy.da.UpdateCursor(in_network, ['ReachID'] + field_names) as cursor:
+        for row in cursor:
+            i = index.get(row[0])
+            if i is None:
+                num_unmatched_features += 1
+                continue
+            row[1:] = [column[i] for column in columns]
+            cursor.updateRow(row)
+            written[i] = True
+
+    unmatched_reach_ids = reach_ids[~written].tolist()
+    if len(unmatched_reach_ids) > 0:
+        arcpy.AddWarning(str(len(unmatched_reach_ids)) + " ReachIDs have no feature in " + in_network +
+                         ", so their " + ", ".join(field_names) + " values were not written: " +
+                         ", ".join(str(reach_id) for reach_id in unmatched_reach_ids[:10]) +
+                         (", ..." if len(unmatched_reach_ids) > 10 else ""))
+    if num_unmatched_features > 0:
+        arcpy.AddWarning(str(num_unmatched_features) + " features in " + in_network + " have a ReachID with no " +
+                         ", ".join(field_names) + " value")
+    return unmatched_reach_ids, num_unmatched_features
@@ -15,10 +15,22 @@ import os
 import sys
 sys.path.append('C:/Users/a02046349/Desktop/pyBRAT')
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path
+import Equation_Engine
 import XMLBuilder
+reload(Equation_Engine)
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
 
+# regional regression equations, as region code: (Qlow equation, Q2 equation)
+GYE_EQUATIONS = {
+    0: ("(DAsqm**0.2098) + 1", "14.7 * (DAsqm**0.815)"),  # default
+    21: ("(10**-0.695) * (DAsqm**1.093)",
+         "0.313 * (DAsqm**0.866) * (((ELEV_FT-3000)/1000)**2.32) * ((LONGITUDE-100)**-0.069)"),  # Rocky Mountains
+    22: ("(10**-0.324) * (DAsqm**0.885)", "29.9 * (DAsqm**0.475)"),  # Central Basin and Northern Plains
+    25: ("(10**-0.301) * (DAsqm**1.008)", "3.07*(DAsqm**0.869) * (JAN_PRECIP**0.884)"),  # Overthrust belt
+    26: ("(10**-2.277) * (DAsqm**1.308)", "22.2*(DAsqm**0.608) * ((LATITUDE-40)**-1.24)")  # High desert
+}
+
 def main(
     in_network,
     region,
@@ -105,37 +117,20 @@ def main(
     # set regional regression equations
     if region is None:
         region = 0
-    if Qlow_eqtn is not None:
-        Qlow = eval(Qlow_eqtn)
-    elif float(region) == 0:
-        Qlow = (DAsqm**0.2098) + 1 # default
-    elif float(region) == 21:
-        Qlow = (10**-0.695) * (DAsqm**1.093) # Rocky Mountains
-    elif float(region) == 22:
-        Qlow = (10**-0.324) * (DAsqm**0.885) # Central Basin and Northern Plains
-    elif float(region) == 25:
-        Qlow = (10**-0.301) * (DAsqm**1.008) # Overthrust belt
-    elif float(region) == 26:
-        Qlow = (10**-2.277) * (DAsqm**1.308) # High desert
-    else:
-        arcpy.AddMessage("WARNING: Region is not part of project area. Quitting iHyd script.")
-        return
-
-    if Q2_eqtn is not None:
-        Q2 = eval(Q2_eqtn)
-    elif float(region) == 0:
-        Q2 = 14.7 * (DAsqm**0.815) # default
-    elif float(region) == 21:
-        Q2 = 0.313 * (DAsqm**0.866) * (((ELEV_FT-3000)/1000)**2.32) * ((LONGITUDE-100)**-0.069) # Rocky Mountains
-    elif float(region) == 22:
-        Q2 = 29.9 * (DAsqm**0.475) # Central Basin and Northern Plains
-    elif float(region) == 25:
-        Q2 = 3.07*(DAsqm**0.869) * (JAN_PRECIP**0.884) # Overthrust belt
-    elif float(region) == 26:
-        Q2 = 22.2*(DAsqm**0.608) * ((LATITUDE-40)**-1.24) # High desert
-    else:
+    if int(float(region)) not in GYE_EQUATIONS:
         arcpy.AddMessage("WARNING: Region is not part of project area. Quitting iHyd script.")
         return
+    region_Qlow_eqtn, region_Q2_eqtn = GYE_EQUATIONS[int(float(region))]
+    if Qlow_eqtn is None:
+        Qlow_eqtn = region_Qlow_eqtn
+    if Q2_eqtn is None:
+        Q2_eqtn = region_Q2_eqtn
+
+    # the equations are compiled once and cached, so batch runs don't re-parse them for each HUC
+    variables = {'DAsqm': DAsqm, 'ELEV_FT': ELEV_FT, 'LONGITUDE': LONGITUDE, 'LATITUDE': LATITUDE,
+                 'JAN_PRECIP': JAN_PRECIP}
+    Qlow = Equation_Engine.evaluate_equation(Qlow_eqtn, variables)
+    Q2 = Equation_Engine.evaluate_equation(Q2_eqtn, variables)
 
         
     # save segid, Qlow, Q2 as single table
@@ -15,11 +15,61 @@ import os
 import sys
 sys.path.append('C:/Users/a02046349/Desktop/pyBRAT')
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path
+import Equation_Engine
 import XMLBuilder
+reload(Equation_Engine)
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
 symbologyFolder = 'C:/Users/a02046349/Desktop/pyBRAT/BRATSymbology'
 
+# regional regression equations, as region code: (Qlow equation, Q2 equation)
+IDAHO_EQUATIONS = {
+    # default
+    0: ("(DAsqm**0.2098) + 1",
+        "14.7 * (DAsqm**0.815)"),
+    # northern panhandle
+    11: ("1.02 * (DAsqm**0.914) * ((RELIEF/1000)**-0.934)",
+         "0.00238 * (DAsqm**0.930) * (PRECIP**2.34)"),
+    # eastern panhandle
+    12: ("3.75 * (10**-11) * (DAsqm**0.962) * ((ELEV_FT/1000)**2.06) * (FOREST_PLUS_ONE**3.28) * (PRECIP**1.43)",
+         "0.00238 * (DAsqm**0.930) * (PRECIP**2.34)"),
+    # southwestern panhandle
+    13: ("0.000195 * (DAsqm**0.337) * ((ELEV_FT/1000)**7.32)",
+         "17.2 * (DAsqm**0.796)"),
+    # western border
+    14: ("4.93 * (10**-6) * (DAsqm**1.04) * (BASIN_SLOPE**1.30) * (PRECIP**1.58)",
+         "0.00272 * (DAsqm**0.962) * (((FOREST/100)+1)**-1.93) * (PRECIP**2.57)"),
+    # central mountains
+    15: ("0.265 * (DAsqm**0.777) * (BASIN_SLOPE**6.71) * (SLOPE_THIRTY**-5.57)",
+         "0.000802 * (DAsqm**0.943) * (PRECIP**2.67)"),
+    # northeastern forests
+    # Qlow = 0.000133 * (DAsqm**1.05) * (PRECIP**2.10) #Wood 2009
+    16: ("3.18 * (10**-5) * (DAsqm**1.14) * (BASIN_SLOPE**2.17)",
+         "0.00557 * (DAsqm**0.754) * (PRECIP**2.34)"),
+    # southern range
+    17: ("0.0000115 * (DAsqm**0.837) * ((ELEV_FT/1000)**4.658)",
+         "17.2 * (DAsqm**0.529) * ((MIN_ELEV/1000)**0.104)"),
+    10: ("0.0000115 * (DAsqm**0.837) * ((ELEV_FT/1000)**4.658)",
+         "17.2 * (DAsqm**0.529) * ((MIN_ELEV/1000)**0.104)"),
+    # eastern range
+    # Qlow = 0.0000115 * (DAsqm**0.837) * ((ELEV_FT/1000)**4.658) #Wood 2009
+    18: ("0.0247 * (DAsqm**1.05) * ((ELEV_FT/1000)**-3.86) * (FOREST_PLUS_ONE**-0.947) * (PRECIP**3.99)",
+         "0.00557 * (DAsqm**0.754) * (PRECIP**2.34)"),
+    # Qlow: Utah region 1, Q2: Little Bear Logan, Kenney et al. 2007
+    21: ("5.7876 * (10**-16) * (DAsqm**0.2398) * (ELEV_FT**3.5772) * ((BASIN_SLOPE+0.001)**1.5323)",
+         "1.52 * (DAsqm**0.677) * (1.39**(ELEV_FT/1000))"),
+    # Qlow: Wood 2009, "problem" watersheds region, Q2: central mountains
+    22: ("0.334 * (DAsqm**0.963)",
+         "0.000802 * (DAsqm**0.943) * (PRECIP**2.67)"),
+    # Big Lost, in-house equations Sara Bangen
+    # Q2 = 0.000258 * (DAsqm**0.893) * (PRECIP**3.15) # Big Lost, Berenbrock et al. 2002
+    23: ("60.8472281 * (DAsqm / 441.547716)",
+         "2118.882 * (DAsqm / 441.547716)"),
+    # Qlow: Hortness 2006; Bruneau, Q2: southern range
+    24: ("0.0329 * (DAsqm**0.678) * (SLOPE_FIFTY**0.796)",
+         "17.2 * (DAsqm**0.529) * ((MIN_ELEV/1000)**0.104)")
+}
+
 def main(
     in_network,
     region,
@@ -116,68 +166,21 @@ def main(
     # set regional regression equations
     if region is None:
         region = 0
-    if Qlow_eqtn is not None:
-        Qlow = eval(Qlow_eqtn)
-    elif float(region) == 0:
-        Qlow = (DAsqm**0.2098) + 1 # default
-    elif float(region) == 11:
-        Qlow = 1.02 * (DAsqm**0.914) * ((RELIEF/1000)**-0.934) # northern panhandle
-    elif float(region) == 12:
-        Qlow = 3.75 * (10**-11) * (DAsqm**0.962) * ((ELEV_FT/1000)**2.06) * (FOREST_PLUS_ONE**3.28) * (PRECIP**1.43) # eastern panhandle
-    elif float(region) == 13:
-        Qlow = 0.000195 * (DAsqm**0.337) * ((ELEV_FT/1000)**7.32) # southwestern panhandle
-    elif float(region) == 14:
-        Qlow = 4.93 * (10**-6) * (DAsqm**1.04) * (BASIN_SLOPE**1.30) * (PRECIP**1.58) # western border
-    elif float(region) == 15:
-        Qlow = 0.265 * (DAsqm**0.777) * (BASIN_SLOPE**06.71) * (SLOPE_THIRTY**-5.57) # central mountains
-    elif float(region) == 16:
-        #Qlow = 0.000133 * (DAsqm**1.05) * (PRECIP**2.10) #Wood 2009
-        Qlow = 3.18 * (10**-05) * (DAsqm**1.14) * (BASIN_SLOPE**2.17) # northeastern forests
-    elif float(region) == 17 or float(region) == 10:
-        Qlow = 0.0000115 * (DAsqm**0.837) * ((ELEV_FT/1000)**4.658) # southern range
-    elif float(region) == 18:
-        #Qlow =  0.0000115 * (DAsqm**0.837) * ((ELEV_FT/1000)**4.658) #Wood 2009
-        Qlow = 0.0247 * (DAsqm**1.05) * ((ELEV_FT/1000)**-3.86) * (FOREST_PLUS_ONE**-0.947) * (PRECIP**3.99) # eastern range
-    elif float(region) == 21:
-        Qlow = 5.7876 * (10**-16) * (DAsqm**0.2398) * (ELEV_FT**3.5772) * ((BASIN_SLOPE+0.001)**1.5323) # Utah region 1
-    elif float(region) == 22:
-        Qlow = 0.334 * (DAsqm**0.963) #Wood 2009, "problem" watersheds region
-    elif float(region) == 23:
-        Qlow = 60.8472281 * (DAsqm / 441.547716) # Big Lost, in-house equation Sara Bangen
-    elif float(region) == 24:
-        Qlow = 0.0329 * (DAsqm**0.678) * (SLOPE_FIFTY**0.796) #Hortness 2006; Bruneau
-    else:
-        arcpy.AddMessage("WARNING: Region is not part of project area. Quitting iHyd script.")
-        return
-
-    if Q2_eqtn is not None:
-        Q2 = eval(Q2_eqtn)
-    elif float(region) == 0:
-        Q2 = 14.7 * (DAsqm**0.815) # default
-    elif float(region) == 11:
-        Q2 = 0.00238 * (DAsqm**0.930) * (PRECIP**2.34) # northern panhandle
-    elif float(region) == 12:
-        Q2 = 0.00238 * (DAsqm**0.930) * (PRECIP**2.34) # eastern panhandle
-    elif float(region) == 13:
-        Q2 = 17.2 * (DAsqm**0.796) # southwestern panhandle
-    elif float(region) == 14:
-        Q2 = 0.00272 * (DAsqm**0.962) * (((FOREST/100)+1)**-1.93) * (PRECIP**2.57) # western border
-    elif float(region) == 15 or float(region)==22:
-        Q2 = 0.000802 * (DAsqm**0.943) * (PRECIP**2.67) # central mountains
-    elif float(region) == 16:
-        Q2 = 0.00557 * (DAsqm**0.754) * (PRECIP**2.34) # northeastern forests
-    elif float(region) == 17 or float(region)==10 or float(region) == 24:
-        Q2 = 17.2 * (DAsqm**0.529) * ((MIN_ELEV/1000)**0.104) # southern range
-    elif float(region) == 18: # or float(region)==21:
-        Q2 = 0.00557 * (DAsqm**0.754) * (PRECIP**2.34) # eastern range
-    elif float(region) == 21:
-        Q2 = 1.52 * (DAsqm**0.677) * (1.39**(ELEV_FT/1000)) # Little Bear Logan, Kenney et al. 2007
-    elif float(region) == 23:
-        Q2 = 2118.882 * (DAsqm / 441.547716) # Big Lost, in-house equation Sara Bangen
-        #Q2 = 0.000258 * (DAsqm**0.893) * (PRECIP**3.15) # Big Lost, Berenbrock et al. 2002
-    else:
+    if int(float(region)) not in IDAHO_EQUATIONS:
         arcpy.AddMessage("WARNING: Region is not part of project area. Quitting iHyd script.")
         return
+    region_Qlow_eqtn, region_Q2_eqtn = IDAHO_EQUATIONS[int(float(region))]
+    if Qlow_eqtn is None:
+        Qlow_eqtn = region_Qlow_eqtn
+    if Q2_eqtn is None:
+        Q2_eqtn = region_Q2_eqtn
+
+    # the equations are compiled once and cached, so batch runs don't re-parse them for each HUC
+    variables = {'DAsqm': DAsqm, 'RELIEF': RELIEF, 'ELEV_FT': ELEV_FT, 'SLOPE_THIRTY': SLOPE_THIRTY, 'PRECIP': PRECIP,
+                 'MIN_ELEV': MIN_ELEV, 'FOREST': FOREST, 'FOREST_PLUS_ONE': FOREST_PLUS_ONE,
+                 'BASIN_SLOPE': BASIN_SLOPE, 'SLOPE_FIFTY': SLOPE_FIFTY}
+    Qlow = Equation_Engine.evaluate_equation(Qlow_eqtn, variables)
+    Q2 = Equation_Engine.evaluate_equation(Q2_eqtn, variables)
 
         
     # save segid, Qlow, Q2 as single table
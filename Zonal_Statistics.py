@@ -0,0 +1,196 @@
+# -------------------------------------------------------------------------------
+# Name:        Zonal Statistics
+# Purpose:     Summarizes a raster within each polygon of a feature class in one pass, whether or not the polygons
+#              overlap
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+import os
+import numpy as np
+import Raster_Sampler
+import Zone_Cells
+reload(Raster_Sampler)
+reload(Zone_Cells)
+
+
+# The statistics zonal_statistics can find
+ZONAL_STAT_TYPES = ['MINIMUM', 'MAXIMUM', 'MEAN']
+
+# The zones' cells, finding them from polygons, and summarizing them are in Zone_Cells
+COVERAGE_SUBDIVISIONS = Zone_Cells.COVERAGE_SUBDIVISIONS
+ZoneCells = Zone_Cells.ZoneCells
+polygon_cells = Zone_Cells.polygon_cells
+polygon_edges = Zone_Cells.polygon_edges
+scanline_fill = Zone_Cells.scanline_fill
+
+
+def zonal_statistics(zones, raster, stat_types, zone_field='ReachID', weighted=False):
+    """
+    Finds statistics of a raster within each zone of a polygon feature class. Each polygon is rasterized on its own,
+    to the cells whose centers are inside it, so overlapping polygons each get all of their cells. A polygon too small
+    to hold a cell center gets the cell its label point is in. NoData cells are left out, like the DATA option of
+    ZonalStatisticsAsTable. The zones' cells are found once for each raster grid (see find_zone_cells), so other
+    rasters on the same grid only have to be read
+    :param zones: The polygon feature class, such as reach buffers
+    :param raster: The raster, as a path or a Raster object
+    :param stat_types: A list of statistics to find, from ZONAL_STAT_TYPES
+    :param zone_field: The field that identifies each zone. Polygons with the same value are one zone
+    :param weighted: If True, every cell a polygon touches is used, and the mean is weighted by how much of each cell
+        the polygon covers
+    :return: Array of the value of each zone, and a dictionary of statistic to an array of that statistic for each
+        zone. Zones with no cells with data are NaN
+    """
+    for stat_type in stat_types:
+        if stat_type not in ZONAL_STAT_TYPES:
+            raise Exception("Unknown zonal statistic: " + str(stat_type))
+
+    sampler = Raster_Sampler.RasterSampler(raster)
+    zone_cells = find_zone_cells(zones, sampler, zone_field, weighted)
+    values = sampler.read_cells(zone_cells.rows, zone_cells.cols)
+    return zone_cells.zone_ids, dict((stat_type, zone_cells.summarize(values, stat_type)) for stat_type in stat_types)
+
+
+def multi_zonal_statistics(requests, zone_field='ReachID'):
+    """
+    Finds many zonal statistics at once, for any mix of zone feature classes and rasters. Rasters on the same grid are
+    handled together: the cells of every zone set are found once (see find_zone_cells), and each raster's blocks are
+    read once for all of the zone sets and statistics that use it
+    :param requests: A list of (name, zones, raster, stat type) for each statistic to find. The stat type is one of
+        ZONAL_STAT_TYPES, or 'HISTOGRAM' to count the cells of each raster value (see zonal_histogram). A request can
+        add True as a fifth item to weight the zones' cells by how much of them the polygons cover (see
+        find_zone_cells)
+    :param zone_field: The field that identifies each zone
+    :return: A dictionary of name to the array of the value of each zone and the array of the statistic for each zone.
+        For a histogram, the statistic is the array of raster values, the counts and the totals zonal_histogram returns
+    """
+    samplers = {}
+    for request in requests:
+        if request[3] not in ZONAL_STAT_TYPES + ['HISTOGRAM']:
+            raise Exception("Unknown zonal statistic: " + str(request[3]))
+        if str(request[2]) not in samplers:
+            samplers[str(request[2])] = Raster_Sampler.RasterSampler(request[2])
+
+    grids = {}
+    for raster_key, sampler in samplers.items():
+        grids.setdefault(grid_key(sampler), []).append(raster_key)
+
+    results = {}
+    for raster_keys in grids.values():
+        grid_requests = [request for request in requests if str(request[2]) in raster_keys]
+        sampler = samplers[raster_keys[0]]
+
+        # every cell any of the zone sets needs, each listed once
+        zone_sets = []
+        for request in grid_requests:
+            zone_set_key = (str(request[1]), is_weighted(request))
+            if zone_set_key not in [key for key, zone_cells in zone_sets]:
+                zone_sets.append((zone_set_key, find_zone_cells(request[1], sampler, zone_field, zone_set_key[1])))
+        cell_keys = np.concatenate([zone_cells.rows * sampler.num_cols + zone_cells.cols
+                                    for key, zone_cells in zone_sets])
+        unique_keys, cell_index = np.unique(cell_keys, return_inverse=True)
+        zone_set_starts = np.cumsum([0] + [len(zone_cells.rows) for key, zone_cells in zone_sets])
+
+        for raster_key in raster_keys:
+            values = samplers[raster_key].read_cells(unique_keys // sampler.num_cols, unique_keys % sampler.num_cols)
+            for request in grid_requests:
+                if str(request[2]) != raster_key:
+                    continue
+                i = [key for key, zone_cells in zone_sets].index((str(request[1]), is_weighted(request)))
+                zone_cells = zone_sets[i][1]
+                zone_values = values[cell_index[zone_set_starts[i]:zone_set_starts[i + 1]]]
+                if request[3] == 'HISTOGRAM':
+                    raster_values, counts = zone_cells.histogram(zone_values)
+                    results[request[0]] = (zone_cells.zone_ids, (raster_values, counts, zone_cells.totals()))
+                else:
+                    results[request[0]] = (zone_cells.zone_ids, zone_cells.summarize(zone_values, request[3]))
+    return results
+
+
+def is_weighted(request):
+    """
+    :return: True if a multi_zonal_statistics request weights its zones' cells by coverage
+    """
+    return len(request) > 4 and bool(request[4])
+
+
+def zonal_histogram(zones, raster, zone_field='ReachID', weighted=False):
+    """
+    Counts the cells of each value of a categorical raster, such as land use classes, in each zone of a polygon
+    feature class, straight from the raster's blocks. The zones' cells are found the same way as for
+    zonal_statistics, and come from the cache if another raster on the same grid has already been summarized
+    :param zones: The polygon feature class, such as reach buffers
+    :param raster: The categorical raster, as a path or a Raster object
+    :param zone_field: The field that identifies each zone
+    :param weighted: If True, every cell a polygon touches is counted by how much of it the polygon covers
+    :return: Array of the value of each zone, array of the raster values found, a 2D array of the (weighted) count of
+        each raster value's cells in each zone, with a row for each zone and a column for each raster value, and array
+        of the (weighted) count of all of each zone's cells, including NoData
+    """
+    sampler = Raster_Sampler.RasterSampler(raster)
+    zone_cells = find_zone_cells(zones, sampler, zone_field, weighted)
+    values = sampler.read_cells(zone_cells.rows, zone_cells.cols)
+    raster_values, counts = zone_cells.histogram(values)
+    return zone_cells.zone_ids, raster_values, counts, zone_cells.totals()
+
+
+def grid_key(sampler):
+    """
+    :return: A key that is the same for rasters on the same grid
+    """
+    return (sampler.x_min, sampler.y_max, sampler.cell_width, sampler.cell_height, sampler.num_rows, sampler.num_cols)
+
+
+_zone_cells = {}
+
+
+def find_zone_cells(zones, sampler, zone_field='ReachID', weighted=False):
+    """
+    Finds the cells of a raster grid in each zone, or gets them from the cache if they have already been found for the
+    same zones and grid
+    :param zones: The polygon feature class
+    :param sampler: The RasterSampler of a raster on the grid
+    :param zone_field: The field that identifies each zone
+    :param weighted: If True, every cell a polygon touches is in its zone, weighted by how much of the cell the
+        polygon covers. If False, only cells whose centers are inside are in its zone, each with a weight of 1
+    :return: The ZoneCells
+    """
+    key = (str(zones), zone_field, weighted, grid_key(sampler),
+           os.path.getmtime(str(zones)) if os.path.exists(str(zones)) else None)
+    if key in _zone_cells:
+        return _zone_cells[key]
+
+    zone_ids = np.unique(arcpy.da.TableToNumPyArray(zones, [zone_field])[zone_field])
+    entry_zones = []
+    entry_rows = []
+    entry_cols = []
+    entry_weights = []
+    with arcpy.da.SearchCursor(zones, [zone_field, 'SHAPE@'], spatial_reference=sampler.spatial_reference) as cursor:
+        for row in cursor:
+            if row[1] is None:
+                continue
+            rows, cols, weights = polygon_cells(row[1], sampler, weighted)
+            entry_zones.append(np.full(len(rows), np.searchsorted(zone_ids, row[0]), dtype=np.int64))
+            entry_rows.append(rows)
+            entry_cols.append(cols)
+            entry_weights.append(weights)
+
+    if len(entry_zones) == 0:
+        zone_cells = ZoneCells(zone_ids, np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64),
+                               np.zeros(0))
+    else:
+        zone_cells = ZoneCells(zone_ids, np.concatenate(entry_zones), np.concatenate(entry_rows),
+                               np.concatenate(entry_cols), np.concatenate(entry_weights))
+    _zone_cells[key] = zone_cells
+    return zone_cells
+
+
+def clear_zone_cells():
+    """
+    Empties the cache of zone cells, once the zones they were found for are no longer needed
+    :return:
+    """
+    _zone_cells.clear()
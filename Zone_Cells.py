@@ -0,0 +1,197 @@
+# -------------------------------------------------------------------------------
+# Name:        Zone Cells
+# Purpose:     Finds the raster cells inside polygons, and summarizes raster values over the cells of each zone.
+#              Doesn't use arcpy, so it can run outside ArcGIS
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# The number of sub-cells along each side of a cell used to work out how much of it a polygon covers
+COVERAGE_SUBDIVISIONS = 4
+
+
+class ZoneCells:
+    """
+    The cells of a raster grid in each zone, as a sparse zone-by-cell incidence matrix: one entry per zone and cell,
+    with the weight of the cell in the zone. Summarizing any raster on the grid is then a weighted sum or a
+    minimum/maximum over runs of entries, without looking at the polygons again
+    """
+
+    def __init__(self, zone_ids, zones, rows, cols, weights):
+        """
+        :param zone_ids: Array of the value of each zone, sorted
+        :param zones: Array of the zone index of each entry
+        :param rows: Array of the raster row of each entry
+        :param cols: Array of the raster column of each entry
+        :param weights: Array of the weight of each entry
+        """
+        # sort the entries by zone, so each zone's entries are one run
+        order = np.argsort(zones, kind='mergesort')
+        self.zone_ids = zone_ids
+        self.zones = zones[order]
+        self.rows = rows[order]
+        self.cols = cols[order]
+        self.weights = weights[order]
+
+    def summarize(self, values, stat_type):
+        """
+        Summarizes the values of the entries' cells for each zone
+        :param values: Array of the raster value of each entry's cell, with NaN for NoData
+        :param stat_type: The statistic: 'MINIMUM', 'MAXIMUM' or 'MEAN'
+        :return: Array of the statistic for each zone, NaN for zones with no cells with data
+        """
+        num_zones = len(self.zone_ids)
+        has_data = ~np.isnan(values)
+        zones = self.zones[has_data]
+        values = values[has_data]
+        if stat_type == 'MEAN':
+            weights = self.weights[has_data]
+            totals = np.bincount(zones, values * weights, num_zones)
+            total_weights = np.bincount(zones, weights, num_zones)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(total_weights > 0, totals / total_weights, np.nan)
+
+        result = np.full(num_zones, np.nan)
+        if len(values) == 0:
+            return result
+        starts = np.nonzero(np.append(True, zones[1:] != zones[:-1]))[0]
+        reduce_function = np.minimum if stat_type == 'MINIMUM' else np.maximum
+        result[zones[starts]] = reduce_function.reduceat(values, starts)
+        return result
+
+    def histogram(self, values):
+        """
+        Adds up the weights of the entries of each distinct value for each zone, as one bincount over (zone, value)
+        pairs
+        :param values: Array of the raster value of each entry's cell, with NaN for NoData
+        :return: Array of the distinct values, and a 2D array of the total weight of each value's entries in each
+            zone, with a row for each zone and a column for each value
+        """
+        num_zones = len(self.zone_ids)
+        has_data = ~np.isnan(values)
+        distinct_values, value_index = np.unique(values[has_data], return_inverse=True)
+        pairs = self.zones[has_data] * len(distinct_values) + value_index.ravel()
+        counts = np.bincount(pairs, self.weights[has_data], num_zones * len(distinct_values))
+        return distinct_values, counts.reshape(num_zones, len(distinct_values))
+
+    def totals(self):
+        """
+        :return: Array of the total weight of each zone's entries, including those of NoData cells
+        """
+        return np.bincount(self.zones, self.weights, len(self.zone_ids))
+
+
+def polygon_cells(polygon, sampler, weighted=False):
+    """
+    Finds the cells of a raster that are in a polygon
+    :param polygon: The arcpy Polygon, in the raster's coordinate system
+    :param sampler: The RasterSampler of the raster, or anything else with its grid attributes and find_cells
+    :param weighted: If True, finds every cell the polygon covers any of, with the share of the cell it covers.
+        If False, finds the cells whose centers are inside it
+    :return: Arrays of the row, column and weight of each cell
+    """
+    x0, y0, x1, y1 = polygon_edges(polygon)
+    extent = polygon.extent
+
+    # the window of cells the polygon's extent covers
+    row_min = max(int(np.floor((sampler.y_max - extent.YMax) / sampler.cell_height)), 0)
+    row_max = min(int(np.floor((sampler.y_max - extent.YMin) / sampler.cell_height)), sampler.num_rows - 1)
+    col_min = max(int(np.floor((extent.XMin - sampler.x_min) / sampler.cell_width)), 0)
+    col_max = min(int(np.floor((extent.XMax - sampler.x_min) / sampler.cell_width)), sampler.num_cols - 1)
+    if row_max < row_min or col_max < col_min:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+
+    if weighted:
+        # the share of each cell's sub-cell centers that are inside
+        subdivisions = COVERAGE_SUBDIVISIONS
+        inside = scanline_fill(x0, y0, x1, y1, sampler.y_max - row_min * sampler.cell_height,
+                               sampler.x_min + col_min * sampler.cell_width, sampler.cell_height / subdivisions,
+                               sampler.cell_width / subdivisions, (row_max - row_min + 1) * subdivisions,
+                               (col_max - col_min + 1) * subdivisions)
+        coverage = inside.reshape(row_max - row_min + 1, subdivisions, col_max - col_min + 1, subdivisions)
+        coverage = coverage.sum(axis=(1, 3)) / float(subdivisions * subdivisions)
+    else:
+        coverage = scanline_fill(x0, y0, x1, y1, sampler.y_max - row_min * sampler.cell_height,
+                                 sampler.x_min + col_min * sampler.cell_width, sampler.cell_height,
+                                 sampler.cell_width, row_max - row_min + 1, col_max - col_min + 1)
+    rows, cols = np.nonzero(coverage)
+    weights = np.asarray(coverage[rows, cols], np.float64)
+    rows += row_min
+    cols += col_min
+
+    if len(rows) == 0:
+        label_point = polygon.labelPoint
+        rows, cols, on_raster = sampler.find_cells(np.array([label_point.X]), np.array([label_point.Y]))
+        rows = rows[on_raster]
+        cols = cols[on_raster]
+        weights = np.ones(len(rows))
+    return rows, cols, weights
+
+
+def polygon_edges(polygon):
+    """
+    Lists the edges of every ring of a polygon
+    :param polygon: The arcpy Polygon
+    :return: Arrays of the start x, start y, end x and end y of each edge
+    """
+    rings = []
+    for part in polygon:
+        ring = []
+        for point in part:
+            # interior rings follow the exterior ring, after a None
+            if point is None:
+                rings.append(ring)
+                ring = []
+            else:
+                ring.append((point.X, point.Y))
+        rings.append(ring)
+
+    x0, y0, x1, y1 = [], [], [], []
+    for ring in rings:
+        if len(ring) < 2:
+            continue
+        ring = np.array(ring, np.float64)
+        # close the ring, in case its last point isn't its first
+        closed = np.vstack((ring, ring[:1]))
+        x0.append(closed[:-1, 0])
+        y0.append(closed[:-1, 1])
+        x1.append(closed[1:, 0])
+        y1.append(closed[1:, 1])
+    if len(x0) == 0:
+        return [np.zeros(0)] * 4
+    return np.concatenate(x0), np.concatenate(y0), np.concatenate(x1), np.concatenate(y1)
+
+
+def scanline_fill(x0, y0, x1, y1, top, left, cell_height, cell_width, num_rows, num_cols):
+    """
+    Finds which cells of a grid have centers inside a polygon, by the even-odd rule along each row of cell centers
+    :param x0: Array of the start x of each edge of the polygon
+    :param y0: Array of the start y of each edge of the polygon
+    :param x1: Array of the end x of each edge of the polygon
+    :param y1: Array of the end y of each edge of the polygon
+    :param top: The y coordinate of the top of the grid
+    :param left: The x coordinate of the left of the grid
+    :param cell_height: The height of the grid's cells
+    :param cell_width: The width of the grid's cells
+    :param num_rows: The number of rows in the grid
+    :param num_cols: The number of columns in the grid
+    :return: A 2D boolean array over the grid of whether each cell is inside
+    """
+    center_y = top - (np.arange(num_rows) + 0.5) * cell_height
+
+    # the edges that cross each row of cell centers, and where they cross it
+    crosses = (y0[np.newaxis, :] > center_y[:, np.newaxis]) != (y1[np.newaxis, :] > center_y[:, np.newaxis])
+    rows, edges = np.nonzero(crosses)
+    crossing_x = x0[edges] + (center_y[rows] - y0[edges]) * (x1[edges] - x0[edges]) / (y1[edges] - y0[edges])
+
+    # each crossing flips inside/outside for every cell center to its right
+    first_cols = np.floor((crossing_x - left) / cell_width - 0.5).astype(np.int64) + 1
+    first_cols = np.clip(first_cols, 0, num_cols)
+    flips = np.bincount(rows * (num_cols + 1) + first_cols, minlength=num_rows * (num_cols + 1))
+    flips = flips.reshape(num_rows, num_cols + 1)[:, :num_cols]
+    return np.cumsum(flips, axis=1) % 2 == 1
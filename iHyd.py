@@ -10,125 +10,129 @@
 # -------------------------------------------------------------------------------
 
 import arcpy
+import json
 import numpy as np
 import os
 import sys
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path
+import Equation_Engine
+import Regional_Curves
+import ReachTable
 import XMLBuilder
+reload(Equation_Engine)
+reload(Regional_Curves)
+reload(ReachTable)
 reload(XMLBuilder)
+ReachTable = ReachTable.ReachTable
 XMLBuilder = XMLBuilder.XMLBuilder
 
+# The fields calc_hydrology reads
+IHYD_FIELDS = ['iGeo_DA', 'iGeo_Slope']
 
-def main(in_network, region, q_low_eqtn, q2_eqtn):
+# The regional curve equations, and the discharge and stream power calculations, are in Regional_Curves
+REGIONAL_EQUATIONS = Regional_Curves.REGIONAL_EQUATIONS
+DEFAULT_EQUATIONS = Regional_Curves.DEFAULT_EQUATIONS
+calc_discharge = Regional_Curves.calc_discharge
+calc_stream_power = Regional_Curves.calc_stream_power
+
+
+def main(in_network, region, q_low_eqtn, q2_eqtn, region_polygons=None, region_field=None, covariate_fields=None,
+         equation_file=None):
     """
     The main function, adds all hydrologic attributes to the BRAT table
     :param in_network: The input BRAT table to add hydrologic values to
-    :param region: The optional region code to identify an already existing equation
+    :param region: The optional region code to identify an already existing equation. If region polygons are given,
+        this is the region of reaches outside every polygon
     :param q_low_eqtn: The Qlow equation to be calculated
     :param q2_eqtn: The Q2 equation to be calculated
+    :param region_polygons: An optional polygon feature class of hydrologic regions. Each reach uses the equations of
+        the region its center is in
+    :param region_field: The field of the region polygons that holds the region code
+    :param covariate_fields: Optional per-reach values for the equation variables other than DAsqm, written as
+        "VARIABLE=field;VARIABLE=field", such as "ELEV_FT=iBas_Elev;JAN_PRECIP=iBas_JanP"
+    :param equation_file: An optional JSON file of regional curve equations (see load_equations)
     :return:
     """
-    if region is None or region == "None":
+    if region is None or region == "None" or region == '' or region == '#':
         region = 0
     else:
-        region = int(region)
-    if q_low_eqtn == "None":
+        region = int(float(region))
+    if q_low_eqtn == "None" or q_low_eqtn == '' or q_low_eqtn == '#':
         q_low_eqtn = None
-    if q2_eqtn == "None":
+    if q2_eqtn == "None" or q2_eqtn == '' or q2_eqtn == '#':
         q2_eqtn = None
-
-    scratch = 'in_memory'
+    if region_polygons == "None" or region_polygons == '' or region_polygons == '#':
+        region_polygons = None
+    if equation_file == "None" or equation_file == '' or equation_file == '#':
+        equation_file = None
 
     arcpy.env.overwriteOutput = True
 
-    # create segid array for joining output to input network
-    segid_np = arcpy.da.FeatureClassToNumPyArray(in_network, "ReachID")
-    segid = np.asarray(segid_np, np.int64)
+    covariate_fields = parse_covariate_fields(covariate_fields)
+    table = ReachTable.load(in_network, IHYD_FIELDS + list(covariate_fields.values()))
+
+    reach_regions = None
+    if region_polygons is not None:
+        if region_field is None or region_field == '' or region_field == '#':
+            raise Exception("A region field is needed to use region polygons")
+        reach_regions = assign_regions(in_network, table, region_polygons, region_field, region)
+
+    equations = None
+    if equation_file is not None:
+        equations = load_equations(equation_file)
+
+    covariates = dict((variable, table[field]) for variable, field in covariate_fields.items())
+    calc_hydrology(table, region, q_low_eqtn, q2_eqtn, reach_regions, covariates, equations)
+
+    # check for and delete if output fields already included in flowline network
+    remove_existing_output(in_network)
+
+    # write Qlow, Q2 and stream power to the flowline network
+    table.flush(in_network)
+
+    make_layers(in_network)
+
+    # add equations to XML
+    # if q_low_eqtn is not None and q2_eqtn is not None and region is not None:
+    #    xml_add_equations(in_network, region, q_low_eqtn, q2_eqtn)
+
 
+def calc_hydrology(table, region, q_low_eqtn, q2_eqtn, reach_regions=None, covariates=None, equations=None):
+    """
+    Adds Qlow, Q2 and their stream powers (iHyd_QLow, iHyd_Q2, iHyd_SPLow and iHyd_SP2) to a reach table
+    :param table: The ReachTable of the BRAT network, which must have iGeo_DA and iGeo_Slope
+    :param region: The region code to identify an already existing equation
+    :param q_low_eqtn: The Qlow equation to be calculated, or None to use the region's equation
+    :param q2_eqtn: The Q2 equation to be calculated, or None to use the region's equation
+    :param reach_regions: An optional array of the region code of each reach, which replaces region. The region of
+        each reach is also added to the table, as iHyd_Reg
+    :param covariates: An optional dictionary of equation variable to an array with a value for each reach
+    :param equations: An optional dictionary of region code to (Qlow equation, Q2 equation), used instead of
+        REGIONAL_EQUATIONS
+    :return:
+    """
     # create array for input network drainage area ("iGeo_DA")
-    da_array = arcpy.da.FeatureClassToNumPyArray(in_network, "iGeo_DA")
-    da = np.asarray(da_array, np.float32)
+    da = np.asarray(table['iGeo_DA'], np.float32)
 
     # convert drainage area (in square kilometers) to square miles
     # note: this assumes that streamflow equations are in US customary units (e.g., inches, feet)
-
-    # TODO Why do these get need to be initialized? Is it necessary to set them to zero first?
-    DAsqm = np.zeros_like(da)
     DAsqm = da * 0.3861021585424458
 
-    # create Qlow and Q2
-    q_low = np.zeros_like(da)
-    q2 = np.zeros_like(da)
-
     arcpy.AddMessage("Adding Qlow and Q2 to network...")
 
-    # --regional curve equations for Qlow (baseflow) and Q2 (annual peak streamflow)--
-    # # # Add in regional curve equations here # # #
-    if q_low_eqtn is not None:
-        q_low = eval(q_low_eqtn)
-    elif region == 101:  # example 1 (box elder county)
-        q_low = 0.019875 * (DAsqm ** 0.6634) * (10 ** (0.6068 * 2.04))
-    elif region == 102:  # example 2 (upper green generic)
-        q_low = 4.2758 * (DAsqm ** 0.299)
-    elif region == 24:  # oregon region 5
-        q_low = 0.000133 * (DAsqm ** 1.05) * (15.3 ** 2.1)
+    if reach_regions is None:
+        q_low, q2 = calc_discharge(DAsqm, region, q_low_eqtn, q2_eqtn, covariates, equations)
     else:
-        q_low = (DAsqm ** 0.2098) + 1
-
-    if q2_eqtn is not None:
-        q2 = eval(q2_eqtn)
-    elif region == 101:  # example 1 (box elder county)
-        q2 = 14.5 * DAsqm ** 0.328
-    elif region == 102:  # example 2 (upper green generic)
-        q2 = 22.2 * (DAsqm ** 0.608) * ((42 - 40) ** 0.1)
-    elif region == 24:  # oregon region 5
-        q2 = 0.000258 * (DAsqm ** 0.893) * (15.3 ** 3.15)
-    else:
-        q2 = 14.7 * (DAsqm ** 0.815)
-
-    # save segid, Qlow, Q2 as single table
-    columns = np.column_stack((segid, q_low, q2))
-    tmp_table = os.path.dirname(in_network) + "/ihyd_Q_Table.txt"
-    np.savetxt(tmp_table, columns, delimiter=",", header="ReachID, iHyd_QLow, iHyd_Q2", comments="")
-    ihyd_table = scratch + "/ihyd_table"
-    arcpy.CopyRows_management(tmp_table, ihyd_table)
-
-    # join Qlow and Q2 output to the flowline network
-    # create empty dictionary to hold input table field values
-    tbl_dict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(ihyd_table, ['ReachID', "iHyd_QLow", "iHyd_Q2"]) as cursor:
-        for row in cursor:
-            tbl_dict[row[0]] = [row[1], row[2]]
-    # check for and delete if output fields already included in flowline network
-    remove_existing_output(in_network)
-    # populate flowline network out field
-    arcpy.AddField_management(in_network, "iHyd_QLow", 'DOUBLE')
-    arcpy.AddField_management(in_network, "iHyd_Q2", 'DOUBLE')
-    with arcpy.da.UpdateCursor(in_network, ['ReachID', "iHyd_QLow", "iHyd_Q2"]) as cursor:
-        for row in cursor:
-            try:
-                a_key = row[0]
-                row[1] = tbl_dict[a_key][0]
-                row[2] = tbl_dict[a_key][1]
-                cursor.updateRow(row)
-            # TODO There should not be any blank exceptions. What error is this supposed to throw?
-            except:
-                pass
-    tbl_dict.clear()
-
-    # delete temporary table
-    arcpy.Delete_management(tmp_table)
+        q_low, q2 = calc_discharge_by_region(DAsqm, reach_regions, q_low_eqtn, q2_eqtn, covariates, equations)
+        table.set_field("iHyd_Reg", np.asarray(reach_regions, np.int32), 'LONG')
+
+    # the fields are doubles, so work with the discharges at double precision from here on
+    q_low = np.asarray(q_low, np.float64)
+    q2 = np.asarray(q2, np.float64)
 
     # check that Q2 is greater than Qlow
     # if not, re-calculate Q2 as Qlow + 0.001
-    with arcpy.da.UpdateCursor(in_network, ["iHyd_QLow", "iHyd_Q2"]) as cursor:
-        for row in cursor:
-            if row[1] < row[0]:
-                row[1] = row[0] + 0.001
-            else:
-                pass
-            cursor.updateRow(row)
+    q2 = np.where(q2 < q_low, q_low + 0.001, q2)
 
     arcpy.AddMessage("Adding stream power to network...")
 
@@ -139,24 +143,140 @@ def main(in_network, region, q_low_eqtn, q2_eqtn):
 
     # note: we assume that discharge ("iHyd_QLow", "iHyd_Q2") was calculated in cubic feet per second
     # and handle conversion to cubic meters per second (e.g., "iHyd_QLow" * 0.028316846592
+    slope = np.asarray(table['iGeo_Slope'], np.float64)
 
-    arcpy.AddField_management(in_network, "iHyd_SPLow", "DOUBLE")
-    arcpy.AddField_management(in_network, "iHyd_SP2", "DOUBLE")
-    with arcpy.da.UpdateCursor(in_network, ["iGeo_Slope", "iHyd_QLow", "iHyd_SPLow", "iHyd_Q2", "iHyd_SP2"]) as cursor:
-        for row in cursor:
-            if row[0] < 0.001:
-                slope = 0.001
-            else:
-                slope = row[0]
-            row[2] = (1000 * 9.80665) * slope * (row[1] * 0.028316846592)
-            row[4] = (1000 * 9.80665) * slope * (row[3] * 0.028316846592)
-            cursor.updateRow(row)
+    table.set_field("iHyd_QLow", q_low)
+    table.set_field("iHyd_Q2", q2)
+    table.set_field("iHyd_SPLow", calc_stream_power(slope, q_low))
+    table.set_field("iHyd_SP2", calc_stream_power(slope, q2))
 
-    make_layers(in_network)
 
-    # add equations to XML
-    # if q_low_eqtn is not None and q2_eqtn is not None and region is not None:
-    #    xml_add_equations(in_network, region, q_low_eqtn, q2_eqtn)
+def calc_discharge_by_region(DAsqm, reach_regions, q_low_eqtn, q2_eqtn, covariates=None, equations=None):
+    """
+    Calculates Qlow and Q2 for every reach from the equations of its own region. The reaches are grouped by region,
+    and each region's equations are evaluated once over all of its reaches
+    :param DAsqm: Array of drainage areas, in square miles
+    :param reach_regions: Array of the region code of each reach
+    :param q_low_eqtn: The Qlow equation to be calculated for every reach, or None to use each region's equation
+    :param q2_eqtn: The Q2 equation to be calculated for every reach, or None to use each region's equation
+    :param covariates: An optional dictionary of equation variable to a single value or an array with a value for
+        each reach
+    :param equations: An optional dictionary of region code to (Qlow equation, Q2 equation), used instead of
+        REGIONAL_EQUATIONS
+    :return: Arrays of Qlow and Q2
+    """
+    if equations is None:
+        equations = REGIONAL_EQUATIONS
+    if covariates is None:
+        covariates = {}
+    DAsqm = np.asarray(DAsqm)
+    reach_regions = np.asarray(reach_regions)
+
+    q_low = np.zeros(len(DAsqm), dtype=np.float64)
+    q2 = np.zeros(len(DAsqm), dtype=np.float64)
+
+    # sort the reaches by region, so each region's reaches are one run of the sorted order
+    order = np.argsort(reach_regions, kind='mergesort')
+    codes, starts = np.unique(reach_regions[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+    for code, start, stop in zip(codes.tolist(), starts.tolist(), stops.tolist()):
+        rows = order[start:stop]
+        if code != 0 and code not in equations and (q_low_eqtn is None or q2_eqtn is None):
+            arcpy.AddWarning("There are no equations for region " + str(code) + ", so its " + str(len(rows)) +
+                             " reaches use the default equations")
+        region_covariates = {}
+        for variable, values in covariates.items():
+            values = np.asarray(values)
+            region_covariates[variable] = values[rows] if values.ndim > 0 else values
+        q_low[rows], q2[rows] = calc_discharge(DAsqm[rows], code, q_low_eqtn, q2_eqtn, region_covariates, equations)
+
+    return q_low, q2
+
+
+def assign_regions(in_network, table, region_polygons, region_field, outside_region=0):
+    """
+    Finds the hydrologic region of each reach with a spatial join. A reach is in the region polygon its center is in
+    :param in_network: The BRAT network
+    :param table: The ReachTable of the BRAT network
+    :param region_polygons: The polygon feature class of hydrologic regions
+    :param region_field: The field of the region polygons that holds the region code
+    :param outside_region: The region code of reaches outside every polygon
+    :return: Array of the region code of each reach in the table
+    """
+    arcpy.AddMessage("Finding the hydrologic region of each reach...")
+
+    # only keep ReachID and the region code in the join, so the region field can't clash with a network field
+    field_mappings = arcpy.FieldMappings()
+    reach_id_map = arcpy.FieldMap()
+    reach_id_map.addInputField(in_network, "ReachID")
+    field_mappings.addFieldMap(reach_id_map)
+    region_map = arcpy.FieldMap()
+    region_map.addInputField(region_polygons, region_field)
+    region_output = region_map.outputField
+    region_output.name = "RegionCode"
+    region_map.outputField = region_output
+    field_mappings.addFieldMap(region_map)
+
+    joined = "in_memory/ReachRegions"
+    arcpy.SpatialJoin_analysis(in_network, region_polygons, joined, "JOIN_ONE_TO_ONE", "KEEP_ALL", field_mappings,
+                               "HAVE_THEIR_CENTER_IN")
+    join_array = arcpy.da.TableToNumPyArray(joined, ["ReachID", "RegionCode", "Join_Count"], null_value=-1)
+    arcpy.Delete_management(joined)
+
+    reach_regions = np.full(len(table.reach_ids()), outside_region, dtype=np.int64)
+    inside = join_array["Join_Count"] > 0
+    reach_regions[table.find_rows(join_array["ReachID"][inside])] = \
+        np.asarray(join_array["RegionCode"][inside]).astype(np.float64).astype(np.int64)
+
+    num_outside = len(reach_regions) - np.count_nonzero(inside)
+    if num_outside > 0:
+        arcpy.AddWarning(str(num_outside) + " reaches are outside every region polygon, so they use region " +
+                         str(outside_region))
+    return reach_regions
+
+
+def parse_covariate_fields(covariate_fields):
+    """
+    Reads which network field holds each per-reach equation variable
+    :param covariate_fields: The variables and fields, written as "VARIABLE=field;VARIABLE=field", or None
+    :return: A dictionary of equation variable to field name
+    """
+    fields = {}
+    if covariate_fields is None or covariate_fields == "None" or covariate_fields == '#':
+        return fields
+    for pair in covariate_fields.split(';'):
+        if pair.strip() == '':
+            continue
+        if '=' not in pair:
+            raise Exception("Could not read the covariate '" + pair + "'. Write each one as VARIABLE=field")
+        variable, field = [part.strip() for part in pair.split('=', 1)]
+        if variable not in Equation_Engine.ALLOWED_VARIABLES or variable == 'DAsqm':
+            raise Exception(variable + " is not an equation variable that can be read from a field. Variables are " +
+                            ", ".join([name for name in Equation_Engine.ALLOWED_VARIABLES if name != 'DAsqm']))
+        fields[variable] = field
+    return fields
+
+
+def load_equations(equation_file):
+    """
+    Reads regional curve equations from a JSON file, so a network covering many regions can be run without editing
+    code. The file holds an entry for each region code, such as
+        {"21": {"Qlow": "(10**-0.695) * (DAsqm**1.093)", "Q2": "29.9 * (DAsqm**0.475)"}}
+    and can hold a "default" entry for regions without one. Its regions are added to REGIONAL_EQUATIONS, replacing
+    any with the same code
+    :param equation_file: The JSON file
+    :return: A dictionary of region code (or 'default') to (Qlow equation, Q2 equation)
+    """
+    with open(equation_file) as f:
+        file_equations = json.load(f)
+    equations = dict(REGIONAL_EQUATIONS)
+    for code, region_equations in file_equations.items():
+        key = 'default' if code == 'default' else int(float(code))
+        equations[key] = (str(region_equations["Qlow"]), str(region_equations["Q2"]))
+        # compile now, so a bad equation is found before any reaches are run
+        Equation_Engine.compile_equation(equations[key][0])
+        Equation_Engine.compile_equation(equations[key][1])
+    return equations
 
 
 def remove_existing_output(in_network):
@@ -173,6 +293,8 @@ def remove_existing_output(in_network):
         arcpy.DeleteField_management(in_network, "iHyd_SPLow")
     if "iHyd_SP2" in [field.name for field in arcpy.ListFields(in_network)]:
         arcpy.DeleteField_management(in_network, "iHyd_SP2")
+    if "iHyd_Reg" in [field.name for field in arcpy.ListFields(in_network)]:
+        arcpy.DeleteField_management(in_network, "iHyd_Reg")
 
 
 def make_layers(input_network):
@@ -234,7 +356,7 @@ def xml_add_equations(in_network, region, q_low_eqtn, q2_eqtn):
 
     # add base flow equation to XML if specified or using generic
     if q_low_eqtn is None and region is 0:
-        xml_file.add_sub_element(ihyd_element, name="Baseflow equation", text="(DAsqm ** 0.2098) + 1")
+        xml_file.add_sub_element(ihyd_element, name="Baseflow equation", text=DEFAULT_EQUATIONS[0])
     elif q2_eqtn is None and region is not 0:
         xml_file.add_sub_element(ihyd_element, name="Baseflow equation", text="Not specified - see iHyd code.")
     else:
@@ -242,7 +364,7 @@ def xml_add_equations(in_network, region, q_low_eqtn, q2_eqtn):
 
     # add high flow equation to XML if specified or using generic
     if q2_eqtn is None and region is 0:
-        xml_file.add_sub_element(ihyd_element, name="Highflow equation", text="14.7 * (DAsqm ** 0.815)")
+        xml_file.add_sub_element(ihyd_element, name="Highflow equation", text=DEFAULT_EQUATIONS[1])
     elif q2_eqtn is None and region is not 0:
         xml_file.add_sub_element(ihyd_element, name="Highflow equation", text="Not specified - see iHyd code.")
     else:
@@ -252,8 +374,4 @@ def xml_add_equations(in_network, region, q_low_eqtn, q2_eqtn):
 
     
 if __name__ == '__main__':
-    main(
-        sys.argv[1],
-        sys.argv[2],
-        sys.argv[3],
-        sys.argv[4])
+    main(*sys.argv[1:])
@@ -0,0 +1,103 @@
+# -------------------------------------------------------------------------------
+# Name:        Conflict Curves Tests
+# Purpose:     Checks that the conflict potential scoring curves give the scores Conflict_Potential's original
+#              per-reach loops gave, at and around every threshold
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Conflict_Curves
+
+
+def old_distance_score(distance, low, high):
+    """
+    Scores a distance the way find_oPC_Score's loops did, one value at a time
+    :param distance: The distance to a human feature
+    :param low: The distance at and below which conflict potential is highest
+    :param high: The distance above which conflict potential is lowest
+    :return: The conflict potential score
+    """
+    m = (0.01 - 0.99) / (high - low)
+    b = 0.99 - m * low
+    if distance >= 0 and distance <= low:
+        return 0.99
+    elif distance > low and distance <= high:
+        return m * distance + b
+    elif distance > high:
+        return 0.01
+    else:
+        return 0.01
+
+
+def old_landuse_score(lu):
+    """
+    Scores a land use intensity the way find_oPC_Score's loop did
+    :param lu: The land use intensity
+    :return: The conflict potential score
+    """
+    if lu >= 1.0:
+        return 0.99
+    elif lu >= 0.66 and lu < 1.0:
+        return 0.75
+    elif lu >= 0.33 and lu < 0.66:
+        return 0.5
+    elif lu > 0 and lu < 0.33:
+        return 0.25
+    else:
+        return 0.01
+
+
+class ConflictCurvesTest(unittest.TestCase):
+
+    def test_distance_thresholds(self):
+        low, high = 50.0, 200.0
+        distances = np.array([0, 1e-9, 25, low, low + 1e-9, 51, 125, high - 1e-9, high, high + 1e-9, 201, 1e6])
+        expected = [old_distance_score(d, low, high) for d in distances]
+        np.testing.assert_allclose(Conflict_Curves.find_distance_score(distances, low, high), expected, atol=1e-12)
+        self.assertEqual(Conflict_Curves.find_distance_score(np.array([low]), low, high)[0], 0.99)
+        self.assertAlmostEqual(Conflict_Curves.find_distance_score(np.array([high]), low, high)[0], 0.01)
+
+    def test_landuse_steps(self):
+        lu = np.array([0, 1e-9, 0.2, 0.33 - 1e-9, 0.33, 0.5, 0.66 - 1e-9, 0.66, 0.9, 1.0 - 1e-9, 1.0, 1.5, 2.0])
+        expected = [old_landuse_score(value) for value in lu]
+        np.testing.assert_array_equal(Conflict_Curves.find_landuse_score(lu), expected)
+        # a land use intensity of exactly 0 is below the lowest step, which is strictly greater than
+        self.assertEqual(Conflict_Curves.find_landuse_score(np.array([0.0]))[0], 0.01)
+
+    def test_missing_and_negative_get_default(self):
+        values = np.array([np.nan, -1, -1e-9, -1000])
+        np.testing.assert_array_equal(Conflict_Curves.find_distance_score(values, 10, 100), 0.01)
+        np.testing.assert_array_equal(Conflict_Curves.find_landuse_score(values), 0.01)
+
+    def test_random_values_match_loops(self):
+        random_state = np.random.RandomState(0)
+        curves = Conflict_Curves.default_curves()
+        thresholds = {"iPC_RoadX": (10, 100), "iPC_RoadAd": (10, 100), "iPC_Canal": (50, 200), "iPC_RR": (30, 100)}
+        table = {"ReachID": np.arange(2000)}
+        for field in thresholds:
+            table[field] = random_state.uniform(-20, 300, 2000)
+            table[field][random_state.rand(2000) < 0.05] = np.nan
+        table["iPC_LU"] = np.round(random_state.uniform(-0.5, 2, 2000), 2)
+
+        expected = np.array([old_landuse_score(value) for value in table["iPC_LU"]])
+        for field, (low, high) in thresholds.items():
+            old = np.array([old_distance_score(value, low, high) for value in table[field]])
+            np.testing.assert_allclose(Conflict_Curves.score_curve(table[field], curves[field]), old, atol=1e-12)
+            expected = np.fmax(expected, old)
+        np.testing.assert_allclose(Conflict_Curves.score_conflict(table, curves), expected, atol=1e-12)
+
+    def test_no_inputs(self):
+        table = {"ReachID": np.arange(5)}
+        np.testing.assert_array_equal(Conflict_Curves.score_conflict(table, Conflict_Curves.default_curves()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
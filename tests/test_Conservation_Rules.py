@@ -0,0 +1,172 @@
+# -------------------------------------------------------------------------------
+# Name:        Conservation Rules Tests
+# Purpose:     Checks that the ordered rule tables give the categories the constraints and opportunities model's
+#              original if/elif chains gave, one case for each branch
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Conservation_Rules
+
+
+def make_columns(base, cases):
+    """
+    Builds a column for each field, with a row for each case: the case's values, and the base values for the rest
+    :param base: A dictionary of field name to the value every case has unless it says otherwise
+    :param cases: A list of (dictionary of field name to value, expected category)
+    :return: A dictionary of field name to array, and the list of expected categories
+    """
+    columns = {}
+    for field, value in base.items():
+        columns[field] = np.array([values.get(field, value) for values, expected in cases])
+    return columns, [expected for values, expected in cases]
+
+
+# the values that fall through every branch, and one case for each branch of the old chains
+RISK_BASE = {'oCC_EX': 3.0, 'iPC_Canal': 500000.0, 'oPC_Dist': 1000.0, 'iPC_LU': 0.0}
+RISK_CASES = [
+    ({'oCC_EX': 0.0, 'iPC_Canal': 10.0, 'oPC_Dist': 10.0}, "Negligible Risk"),
+    ({'iPC_Canal': 20.0}, "Major Risk"),
+    ({'oPC_Dist': 30.0, 'oCC_EX': 5.0}, "Major Risk"),
+    ({'iPC_LU': 0.66, 'oCC_EX': 6.0}, "Major Risk"),
+    ({'oPC_Dist': 30.0}, "Considerable Risk"),
+    ({'iPC_LU': 0.7}, "Considerable Risk"),
+    ({'oPC_Dist': 100.0, 'oCC_EX': 5.0}, "Considerable Risk"),
+    ({'oPC_Dist': 100.0}, "Minor Risk"),
+    ({'oPC_Dist': 300.0, 'oCC_EX': 20.0}, "Minor Risk"),
+    ({'iPC_LU': 0.33}, "Minor Risk"),
+    ({}, "Negligible Risk")]
+
+UNSUITABLE_BASE = {'oVC_HPE': 10.0, 'oVC_EX': 5.0, 'iGeo_Slope': 0.05, 'oCC_EX': 3.0, 'iPC_LU': 0.0,
+                   'iHyd_SPLow': 50.0, 'iHyd_SP2': 500.0}
+UNSUITABLE_CASES = [
+    ({'oVC_HPE': 0.0, 'oVC_EX': 2.0, 'iGeo_Slope': 0.5}, "Potential Reservoir or Landuse Conversion"),
+    ({'oVC_HPE': 0.0, 'oVC_EX': 0.0, 'iGeo_Slope': 0.5}, "Naturally Vegetation Limited"),
+    ({'iGeo_Slope': 0.24, 'oCC_EX': 0.0}, "Slope Limited"),
+    ({'oCC_EX': 0.0, 'iPC_LU': 0.31, 'iHyd_SPLow': 500.0}, "Anthropogenically Limited"),
+    ({'oCC_EX': 0.0, 'iHyd_SPLow': 190.0}, "Stream Power Limited"),
+    ({'oCC_EX': 0.0, 'iHyd_SP2': 2400.0}, "Stream Power Limited"),
+    ({'oCC_EX': 0.0}, "Stream Size Limited"),
+    ({'iGeo_Slope': 0.23}, "Dam Building Possible")]
+
+OPPORTUNITY_BASE = {'oPBRC_UI': "Negligible Risk", 'oCC_EX': 3.0, 'mCC_HisDep': 5.0, 'oCC_HPE': 3.0,
+                    'iPC_VLowLU': 50.0, 'iPC_HighLU': 20.0}
+OPPORTUNITY_CASES = [
+    ({'oPBRC_UI': "Major Risk", 'oCC_EX': 6.0, 'mCC_HisDep': 1.0}, "NA"),
+    ({'oPBRC_UI': "Considerable Risk", 'oCC_EX': 6.0, 'mCC_HisDep': 1.0}, "NA"),
+    ({'oCC_EX': 5.0, 'mCC_HisDep': 3.0}, "Easiest - Low-Hanging Fruit"),
+    ({'oPBRC_UI': "Minor Risk", 'oCC_EX': 6.0, 'mCC_HisDep': 2.0, 'oCC_HPE': 6.0, 'iPC_VLowLU': 80.0,
+      'iPC_HighLU': 5.0}, "Easiest - Low-Hanging Fruit"),
+    ({'mCC_HisDep': 2.0, 'oCC_HPE': 5.0, 'iPC_VLowLU': 76.0, 'iPC_HighLU': 9.0}, "Straight Forward - Quick Return"),
+    ({'oCC_EX': 1.0, 'mCC_HisDep': 2.0, 'oCC_HPE': 5.0, 'iPC_VLowLU': 76.0, 'iPC_HighLU': 9.0},
+     "Strategic - Long-Term Investment"),
+    ({'mCC_HisDep': 4.0, 'oCC_HPE': 5.0, 'iPC_VLowLU': 76.0, 'iPC_HighLU': 9.0}, "Strategic - Long-Term Investment"),
+    ({'oCC_EX': 0.0, 'oCC_HPE': 5.0, 'iPC_VLowLU': 76.0, 'iPC_HighLU': 9.0}, "NA"),
+    ({'mCC_HisDep': 4.0, 'oCC_HPE': 5.0, 'iPC_VLowLU': 75.0, 'iPC_HighLU': 9.0}, "NA"),
+    ({}, "NA")]
+
+STRATEGY_BASE = {'ObsDam': "No", 'ConsArea': "No", 'ConsEase': "No", 'oCC_EX': 0.0, 'iPC_LU': 0.0,
+                 'oPC_Dist': 1000.0, 'VegDep': 0.0}
+STRATEGY_CASES = [
+    ({}, "Other"),
+    ({'oCC_EX': 0.5, 'iPC_LU': 0.9}, "Other"),
+    ({'oCC_EX': 5.0}, "3. High restoration potential"),
+    ({'oCC_EX': 6.0, 'VegDep': 4.0}, "3a. Vegetation restoration first-priority"),
+    ({'oCC_EX': 20.0, 'ConsArea': "Yes", 'VegDep': 5.0}, "2. Highest restoration potential - translocation"),
+    ({'oCC_EX': 25.0, 'ConsEase': "Yes"}, "2. Highest restoration potential - translocation"),
+    ({'oCC_EX': 1.0}, "4. Medium-low restoration potential"),
+    ({'oCC_EX': 3.0, 'VegDep': 4.0}, "4a. Vegetation restoration first-priority"),
+    ({'oCC_EX': 3.0, 'oPC_Dist': 30.0, 'VegDep': 5.0}, "5. Restoration with infrastructure modification"),
+    ({'oCC_EX': 25.0, 'ConsArea': "Yes", 'oPC_Dist': 20.0}, "5. Restoration with infrastructure modification"),
+    ({'oCC_EX': 6.0, 'iPC_LU': 0.7}, "6. Restoration with urban or agricultural modification"),
+    ({'oCC_EX': 3.0, 'iPC_LU': 0.5, 'oPC_Dist': 20.0}, "6. Restoration with urban or agricultural modification"),
+    ({'oCC_EX': 25.0, 'iPC_LU': 0.5, 'ConsArea': "Yes"}, "6. Restoration with urban or agricultural modification"),
+    ({'ObsDam': "Yes", 'iPC_LU': 0.5, 'oCC_EX': 3.0}, "6. Restoration with urban or agricultural modification"),
+    ({'ObsDam': "Yes", 'iPC_LU': 0.33, 'oCC_EX': 3.0, 'oPC_Dist': 20.0}, "1. Beaver conservation"),
+    ({'ObsDam': "Yes", 'oCC_EX': 25.0, 'ConsEase': "Yes"}, "1. Beaver conservation"),
+    ({'ObsDam': "Yes"}, "1. Beaver conservation"),
+    ({'ObsDam': "Yes", 'iPC_LU': 0.7}, "Other")]
+
+
+def old_strategy(obs_dam, cons_area, cons_ease, curr_dams, landuse, infrastructure_dist, hist_veg_departure):
+    """
+    The original DamStrat chain, where each later if overwrote the category of the ones before it
+    """
+    urban = landuse > 0.66
+    ag = 0.33 < landuse <= 0.66
+    strategy = 'Other'
+    if curr_dams >= 5 and not urban:
+        if hist_veg_departure >= 4:
+            strategy = "3a. Vegetation restoration first-priority"
+        else:
+            strategy = "3. High restoration potential"
+    if curr_dams >= 20 and (cons_area == 'Yes' or cons_ease == 'Yes'):
+        strategy = "2. Highest restoration potential - translocation"
+    if 1 <= curr_dams < 5 and not urban:
+        if hist_veg_departure >= 4:
+            strategy = "4a. Vegetation restoration first-priority"
+        else:
+            strategy = "4. Medium-low restoration potential"
+    if curr_dams >= 1 and infrastructure_dist <= 30:
+        strategy = "5. Restoration with infrastructure modification"
+    if curr_dams >= 1 and (urban or ag):
+        strategy = "6. Restoration with urban or agricultural modification"
+    if obs_dam == 'Yes' and not urban and not ag:
+        strategy = "1. Beaver conservation"
+    return strategy
+
+
+class TestConservationRules(unittest.TestCase):
+
+    def assert_classified(self, out_field, base, cases):
+        columns, expected = make_columns(base, cases)
+        categories = Conservation_Rules.classify(columns, Conservation_Rules.RULE_TABLES[out_field])
+        for i, (values, category) in enumerate(cases):
+            self.assertEqual(categories[i], category, values)
+
+    def test_risk(self):
+        self.assert_classified("oPBRC_UI", RISK_BASE, RISK_CASES)
+
+    def test_unsuitable(self):
+        self.assert_classified("oPBRC_UD", UNSUITABLE_BASE, UNSUITABLE_CASES)
+
+    def test_opportunity(self):
+        self.assert_classified("oPBRC_CR", OPPORTUNITY_BASE, OPPORTUNITY_CASES)
+
+    def test_strategy(self):
+        self.assert_classified("DamStrat", STRATEGY_BASE, STRATEGY_CASES)
+
+    def test_strategy_matches_last_write_wins(self):
+        # every combination of values on and either side of the thresholds
+        random_state = np.random.RandomState(0)
+        num_reaches = 5000
+        columns = {'ObsDam': random_state.choice(["Yes", "No"], num_reaches),
+                   'ConsArea': random_state.choice(["Yes", "No"], num_reaches),
+                   'ConsEase': random_state.choice(["Yes", "No"], num_reaches),
+                   'oCC_EX': random_state.choice([0.0, 0.5, 1.0, 3.0, 5.0, 10.0, 20.0, 30.0], num_reaches),
+                   'iPC_LU': random_state.choice([0.0, 0.33, 0.5, 0.66, 0.9], num_reaches),
+                   'oPC_Dist': random_state.choice([10.0, 30.0, 31.0, 500.0], num_reaches),
+                   'VegDep': random_state.choice([0.0, 3.9, 4.0, 10.0], num_reaches)}
+        categories = Conservation_Rules.classify(columns, Conservation_Rules.RULE_TABLES["DamStrat"])
+        for i in range(num_reaches):
+            expected = old_strategy(columns['ObsDam'][i], columns['ConsArea'][i], columns['ConsEase'][i],
+                                    columns['oCC_EX'][i], columns['iPC_LU'][i], columns['oPC_Dist'][i],
+                                    columns['VegDep'][i])
+            self.assertEqual(categories[i], expected)
+
+    def test_unknown_field(self):
+        with self.assertRaises(Exception):
+            Conservation_Rules.classify({'oCC_EX': np.zeros(2)},
+                                        {"default": "Other", "rules": [["Low", [["iPC_LU", "<", 1]]]]})
+
+
+if __name__ == '__main__':
+    unittest.main()
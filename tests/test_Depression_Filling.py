@@ -0,0 +1,195 @@
+# -------------------------------------------------------------------------------
+# Name:        Depression Filling Tests
+# Purpose:     Checks the priority-flood depression filling on small hand-built DEMs, filled whole and in bands
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Depression_Filling
+
+
+NAN = np.nan
+
+
+class ArrayDEM:
+    """
+    A DEM held in an array, read like a RasterSampler
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, np.float64)
+        self.num_rows, self.num_cols = self.values.shape
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        return self.values[row_start:row_start + num_rows, col_start:col_start + num_cols].copy()
+
+
+def fill_in_bands(values, block_rows, epsilon=0.0):
+    """
+    Fills a DEM a band of rows at a time, and reads it back whole
+    """
+    dem = ArrayDEM(values)
+    filled = Depression_Filling.BandedFill(dem, epsilon, block_rows)
+    return filled.read_window(0, 0, dem.num_rows, dem.num_cols)
+
+
+def drains_off(filled):
+    """
+    Checks that every cell with data has a path to the DEM's edge or NoData that never goes uphill, by searching
+    uphill from the cells next to them
+    """
+    num_rows, num_cols = filled.shape
+    padded = np.full((num_rows + 2, num_cols + 2), NAN)
+    padded[1:-1, 1:-1] = filled
+    reached = np.isnan(padded)
+    queue = list(zip(*np.nonzero(reached)))
+    while len(queue) > 0:
+        row, col = queue.pop()
+        for other_row in range(max(row - 1, 1), min(row + 2, num_rows + 1)):
+            for other_col in range(max(col - 1, 1), min(col + 2, num_cols + 1)):
+                if reached[other_row, other_col]:
+                    continue
+                if np.isnan(padded[row, col]) or padded[other_row, other_col] >= padded[row, col]:
+                    reached[other_row, other_col] = True
+                    queue.append((other_row, other_col))
+    return bool(reached.all())
+
+
+class TestFillDepressions(unittest.TestCase):
+
+    def assert_filled(self, values, expected, epsilon=0.0):
+        expected = np.asarray(expected, np.float64)
+        np.testing.assert_array_equal(Depression_Filling.fill_depressions(np.asarray(values, np.float64), epsilon),
+                                      expected)
+        for block_rows in range(1, len(expected) + 1):
+            np.testing.assert_array_equal(fill_in_bands(values, block_rows, epsilon), expected)
+
+    def test_pit(self):
+        values = [[9, 9, 9, 9, 9],
+                  [9, 5, 5, 5, 9],
+                  [9, 5, 1, 5, 9],
+                  [9, 5, 5, 5, 6],
+                  [9, 9, 9, 9, 9]]
+        expected = [[9, 9, 9, 9, 9],
+                    [9, 6, 6, 6, 9],
+                    [9, 6, 6, 6, 9],
+                    [9, 6, 6, 6, 6],
+                    [9, 9, 9, 9, 9]]
+        self.assert_filled(values, expected)
+
+    def test_nested_pits(self):
+        # a deep pit inside a wider depression, which spills over the 4 on the right edge
+        values = [[8, 8, 8, 8, 8, 8, 8],
+                  [8, 3, 3, 3, 3, 3, 8],
+                  [8, 3, 7, 7, 7, 3, 8],
+                  [8, 3, 7, 0, 7, 3, 4],
+                  [8, 3, 7, 7, 7, 3, 8],
+                  [8, 3, 3, 3, 3, 3, 8],
+                  [8, 8, 8, 8, 8, 8, 8]]
+        expected = [[8, 8, 8, 8, 8, 8, 8],
+                    [8, 4, 4, 4, 4, 4, 8],
+                    [8, 4, 7, 7, 7, 4, 8],
+                    [8, 4, 7, 7, 7, 4, 4],
+                    [8, 4, 7, 7, 7, 4, 8],
+                    [8, 4, 4, 4, 4, 4, 8],
+                    [8, 8, 8, 8, 8, 8, 8]]
+        self.assert_filled(values, expected)
+
+    def test_no_data_hole_drains(self):
+        # the pit is next to a hole in the DEM, so it drains into it and isn't filled
+        values = [[9, 9, 9, 9, 9],
+                  [9, 2, 5, 5, 9],
+                  [9, 5, NAN, 5, 9],
+                  [9, 5, 5, 1, 9],
+                  [9, 9, 9, 9, 9]]
+        self.assert_filled(values, values)
+
+    def test_no_data_stays_no_data(self):
+        values = [[NAN, NAN, 9, 9],
+                  [NAN, 9, 1, 9],
+                  [9, 9, 9, 9]]
+        filled = Depression_Filling.fill_depressions(np.array(values, np.float64))
+        self.assertTrue(np.array_equal(np.isnan(filled), np.isnan(values)))
+        # the pit touches the NoData corner diagonally, so it drains there
+        self.assertEqual(filled[1, 2], 1)
+
+    def test_flat_with_epsilon(self):
+        values = [[9, 9, 9, 9, 9, 9],
+                  [9, 1, 1, 1, 1, 9],
+                  [9, 1, 1, 1, 1, 9],
+                  [9, 9, 9, 9, 9, 5]]
+        epsilon = 0.001
+        filled = Depression_Filling.fill_depressions(np.array(values, np.float64), epsilon)
+
+        # every filled cell is raised above the spill level, by a step for each cell it is from the outlet
+        inner = filled[1:3, 1:5]
+        self.assertTrue(np.all(inner > 5))
+        self.assertTrue(np.all(inner <= 5 + 4 * epsilon + 1e-9))
+        self.assertEqual(len(np.unique(np.round(inner / epsilon))), 4)
+
+        # and every one of them has a lower neighbour, so flow leaves the flat without crossing an equal cell
+        for row in range(1, 3):
+            for col in range(1, 5):
+                neighbours = filled[row - 1:row + 2, col - 1:col + 2]
+                self.assertTrue(np.any(neighbours < filled[row, col]))
+
+    def test_epsilon_only_used_in_one_band(self):
+        values = np.array([[9, 9, 9, 9],
+                           [9, 1, 1, 9],
+                           [9, 1, 1, 9],
+                           [9, 9, 9, 9]], np.float64)
+        self.assertTrue(Depression_Filling.BandedFill.uses_epsilon(4, 4))
+        self.assertFalse(Depression_Filling.BandedFill.uses_epsilon(4, 2))
+        np.testing.assert_array_equal(fill_in_bands(values, 2, 0.001), np.full((4, 4), 9.0))
+
+    def test_spill_in_another_band(self):
+        # the depression at the top only spills out through the gap at the bottom, several bands below
+        values = [[9, 9, 9, 9, 9],
+                  [9, 2, 2, 2, 9],
+                  [9, 9, 9, 3, 9],
+                  [9, 8, 8, 3, 9],
+                  [9, 8, 8, 3, 9],
+                  [9, 9, 9, 6, 9]]
+        expected = [[9, 9, 9, 9, 9],
+                    [9, 6, 6, 6, 9],
+                    [9, 9, 9, 6, 9],
+                    [9, 8, 8, 6, 9],
+                    [9, 8, 8, 6, 9],
+                    [9, 9, 9, 6, 9]]
+        self.assert_filled(values, expected)
+
+    def test_spill_across_band_diagonal(self):
+        # the two halves of the depression only touch diagonally, across the boundary between the first two bands,
+        # and the lower half spills over the 7 beside it
+        values = [[9, 9, 9, 9, 9],
+                  [9, 1, 9, 9, 9],
+                  [9, 9, 2, 7, 9],
+                  [9, 9, 9, 9, 7]]
+        expected = [[9, 9, 9, 9, 9],
+                    [9, 7, 9, 9, 9],
+                    [9, 9, 7, 7, 9],
+                    [9, 9, 9, 9, 7]]
+        self.assert_filled(values, expected)
+
+    def test_random_dems_in_bands(self):
+        random_state = np.random.RandomState(0)
+        for trial in range(20):
+            values = np.round(random_state.uniform(0, 10, (9, 7)), 1)
+            values[random_state.rand(9, 7) < 0.1] = NAN
+            whole = Depression_Filling.fill_depressions(values)
+            self.assertTrue(drains_off(whole))
+            self.assertTrue(np.all(np.isnan(values) | (whole >= values)))
+            for block_rows in [1, 2, 3, 4]:
+                np.testing.assert_array_equal(fill_in_bands(values, block_rows), whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
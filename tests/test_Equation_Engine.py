@@ -0,0 +1,133 @@
+# -------------------------------------------------------------------------------
+# Name:        Equation Engine Tests
+# Purpose:     Checks that the equation engine rejects anything but arithmetic on the allowed variables, and that it
+#              gives the results eval gave on the regional curve equations
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import ast
+import os
+import sys
+import unittest
+import numpy as np
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+import Equation_Engine
+import Regional_Curves
+
+BATCH_FOLDER = os.path.join(REPO_FOLDER, "SupportingTools", "BatchScripts", "02_BatchBRATTools")
+
+
+def load_equations(script, name):
+    """
+    Reads a dictionary of regional curve equations from a batch iHyd script. The scripts import arcpy, so the
+    dictionary is read from the script's syntax tree rather than by importing it
+    :param script: The name of the script in the batch iHyd folder
+    :param name: The name the dictionary is assigned to
+    :return: A dictionary of region code to (Qlow equation, Q2 equation)
+    """
+    with open(os.path.join(BATCH_FOLDER, script)) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == name for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(name + " is not in " + script)
+
+
+def make_variables(num_reaches, seed=0):
+    """
+    Makes values for every allowed variable, in the ranges the regional curves are used over
+    :param num_reaches: The number of reaches
+    :param seed: Seed for the random number generator
+    :return: A dictionary of variable name to array
+    """
+    random_state = np.random.RandomState(seed)
+    forest = random_state.uniform(0, 100, num_reaches)
+    return {'DAsqm': np.exp(random_state.normal(2, 1.5, num_reaches)),
+            'ELEV_FT': random_state.uniform(3500, 10000, num_reaches),
+            'MIN_ELEV': random_state.uniform(3000, 8000, num_reaches),
+            'RELIEF': random_state.uniform(100, 5000, num_reaches),
+            'PRECIP': random_state.uniform(5, 60, num_reaches),
+            'PRECIP_IN': random_state.uniform(5, 60, num_reaches),
+            'JAN_PRECIP': random_state.uniform(0.5, 6, num_reaches),
+            'LATITUDE': random_state.uniform(41, 49, num_reaches),
+            'LONGITUDE': random_state.uniform(104, 117, num_reaches),
+            'FOREST': forest,
+            'FOREST_PLUS_ONE': forest + 1,
+            'BASIN_SLOPE': random_state.uniform(0.01, 0.6, num_reaches),
+            'SLOPE_THIRTY': random_state.uniform(1, 50, num_reaches),
+            'SLOPE_FIFTY': random_state.uniform(1, 50, num_reaches)}
+
+
+class EquationEngineTest(unittest.TestCase):
+
+    def assert_rejected(self, text):
+        self.assertRaises(Equation_Engine.EquationError, Equation_Engine.CompiledEquation, text)
+
+    def test_rejects_imports_and_attributes(self):
+        self.assert_rejected("__import__('os').system('echo')")
+        self.assert_rejected("DAsqm.__class__")
+        self.assert_rejected("DAsqm.real")
+        self.assert_rejected("np.linalg.norm(DAsqm)")
+        self.assert_rejected("os.system('echo')")
+        self.assert_rejected("().__class__.__bases__[0].__subclasses__()")
+        self.assert_rejected("open('equations.txt')")
+
+    def test_rejects_unknown_names(self):
+        self.assert_rejected("DAsqm * x")
+        self.assert_rejected("arcpy")
+        self.assert_rejected("np")
+        self.assert_rejected("eval('DAsqm')")
+        self.assert_rejected("unknown(DAsqm)")
+
+    def test_rejects_other_syntax(self):
+        self.assert_rejected("DAsqm if DAsqm > 1 else 1")
+        self.assert_rejected("DAsqm > 1")
+        self.assert_rejected("lambda: DAsqm")
+        self.assert_rejected("[DAsqm]")
+        self.assert_rejected("DAsqm // 2")
+        self.assert_rejected("DAsqm % 2")
+        self.assert_rejected("'DAsqm'")
+        self.assert_rejected("True * DAsqm")
+        self.assert_rejected("log(DAsqm, 10)")
+        self.assert_rejected("DAsqm *")
+
+    def test_missing_variable(self):
+        equation = Equation_Engine.CompiledEquation("14.7 * (DAsqm ** 0.815) * PRECIP")
+        self.assertRaises(Equation_Engine.EquationError, equation.evaluate, {'DAsqm': np.ones(3)})
+
+    def test_matches_eval(self):
+        variables = make_variables(5000)
+        equation_sets = [Regional_Curves.REGIONAL_EQUATIONS, {0: Regional_Curves.DEFAULT_EQUATIONS},
+                         load_equations("iHyd_GYE.py", "GYE_EQUATIONS"),
+                         load_equations("iHyd_Idaho.py", "IDAHO_EQUATIONS")]
+        for equations in equation_sets:
+            for region in sorted(equations):
+                for text in equations[region]:
+                    with np.errstate(all='ignore'):
+                        expected = eval(text, {'__builtins__': {}}, dict(variables))
+                    # a small block size, so equations are evaluated over many blocks
+                    result = Equation_Engine.evaluate_equation(text, variables, block_size=777)
+                    self.assertTrue(np.isfinite(result).all(), text)
+                    np.testing.assert_allclose(result, expected, rtol=1e-12, err_msg=text)
+
+    def test_single_values(self):
+        variables = {'DAsqm': np.array([1.0, 10.0, 100.0]), 'LATITUDE': 44.5}
+        text = "22.2*(DAsqm**0.608) * ((LATITUDE-40)**-1.24)"
+        np.testing.assert_allclose(Equation_Engine.evaluate_equation(text, variables),
+                                   22.2 * (variables['DAsqm'] ** 0.608) * ((44.5 - 40) ** -1.24), rtol=1e-12)
+        self.assertAlmostEqual(Equation_Engine.evaluate_equation("14.5 * DAsqm ** 0.328", {'DAsqm': 8.0}),
+                               14.5 * 8.0 ** 0.328)
+
+    def test_functions(self):
+        variables = make_variables(100)
+        np.testing.assert_allclose(Equation_Engine.evaluate_equation("np.log10(DAsqm) + sqrt(-(-DAsqm))", variables),
+                                   np.log10(variables['DAsqm']) + np.sqrt(variables['DAsqm']), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Engine Tests
+# Purpose:     Checks the results of the vectorized FIS engine
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import FIS_Engine
+
+try:
+    import skfuzzy
+except ImportError:
+    skfuzzy = None
+
+
+def veg_inputs(num_reaches, seed=0):
+    """
+    Makes vegetation FIS inputs, with a share of reaches entirely in one suitability class like real networks
+    """
+    random_state = np.random.RandomState(seed)
+    inputs = []
+    for i in range(2):
+        veg = np.round(random_state.uniform(0, 4, num_reaches), 2)
+        whole_class = random_state.rand(num_reaches) < 0.2
+        veg[whole_class] = random_state.randint(0, 5, whole_class.sum())
+        inputs.append(veg)
+    return inputs
+
+
+def comb_inputs(num_reaches, seed=0):
+    """
+    Makes combined FIS inputs spread over every term of each input
+    """
+    random_state = np.random.RandomState(seed)
+    ovc = random_state.uniform(0, 45, num_reaches)
+    ovc[random_state.rand(num_reaches) < 0.2] = 0
+    sp2 = np.clip(np.exp(random_state.normal(np.log(1000), 1.0, num_reaches)), 0, 10000)
+    splow = np.clip(np.exp(random_state.normal(np.log(150), 0.5, num_reaches)), 0, 10000)
+    slope = np.clip(np.exp(random_state.normal(np.log(0.02), 1.5, num_reaches)), 0, 1)
+    return [ovc, sp2, splow, slope]
+
+
+def grid_centroid(fis, strengths, num_points=200001):
+    """
+    Finds the centroid of the clipped and aggregated output terms on a fine grid over the output universe
+    """
+    name, universe_range, terms = fis['output']
+    universe = FIS_Engine.make_universe(universe_range)
+    x = np.linspace(universe[0], universe[-1], num_points)
+    y = np.zeros(len(x))
+    for strength, (term, mf_type, params) in zip(strengths, terms):
+        y = np.fmax(y, np.fmin(FIS_Engine.membership(x, mf_type, params), strength))
+    # trapezoid rule, written out since np.trapz isn't in every numpy version
+    widths = np.diff(x)
+    area = ((y[1:] + y[:-1]) * widths).sum() / 2.0
+    moment = ((x[1:] * y[1:] + x[:-1] * y[:-1]) * widths).sum() / 2.0
+    return moment / area
+
+
+class TestFISEngine(unittest.TestCase):
+
+    @unittest.skipIf(skfuzzy is None, "skfuzzy is not installed")
+    def test_comb_fis_matches_skfuzzy(self):
+        inputs = comb_inputs(60)
+        difference = np.abs(FIS_Engine.evaluate(FIS_Engine.COMB_FIS, inputs) -
+                            FIS_Engine.evaluate_skfuzzy(FIS_Engine.COMB_FIS, inputs))
+        self.assertLessEqual(difference.max(), FIS_Engine.SKFUZZY_TOLERANCE)
+
+    @unittest.skipIf(skfuzzy is None, "skfuzzy is not installed")
+    def test_veg_fis_matches_skfuzzy(self):
+        inputs = veg_inputs(200)
+        difference = np.abs(FIS_Engine.evaluate(FIS_Engine.VEG_FIS, inputs) -
+                            FIS_Engine.evaluate_skfuzzy(FIS_Engine.VEG_FIS, inputs))
+        self.assertLessEqual(difference.max(), FIS_Engine.SKFUZZY_TOLERANCE)
+
+    def test_evaluate_unique(self):
+        # 10 distinct tuples, each shared by 30 reaches in a shuffled order
+        distinct = veg_inputs(10, seed=3)
+        index = np.random.RandomState(3).permutation(np.repeat(np.arange(10), 30))
+        inputs = [values[index] for values in distinct]
+
+        out, hit_rate = FIS_Engine.evaluate_unique(FIS_Engine.VEG_FIS, inputs)
+        np.testing.assert_allclose(out, FIS_Engine.evaluate(FIS_Engine.VEG_FIS, inputs), rtol=0, atol=1e-9)
+        self.assertAlmostEqual(hit_rate, 1.0 - 10.0 / 300)
+
+    def test_defuzzify_matches_grid_centroid(self):
+        random_state = np.random.RandomState(1)
+        num_terms = len(FIS_Engine.COMB_FIS['output'][2])
+        strengths = random_state.rand(40, num_terms)
+        # some reaches with only one term firing, or with terms not firing at all
+        strengths[random_state.rand(40, num_terms) < 0.3] = 0.0
+        strengths[0] = [0, 0, 1, 0, 0]
+        out = FIS_Engine.defuzzify(FIS_Engine.COMB_FIS, strengths)
+        for i in range(len(strengths)):
+            if strengths[i].max() > 0:
+                self.assertAlmostEqual(out[i], grid_centroid(FIS_Engine.COMB_FIS, strengths[i]), places=5)
+            else:
+                self.assertEqual(out[i], 0.0)
+
+    def test_chunking_is_bit_identical(self):
+        inputs = comb_inputs(1000, seed=2)
+        whole = FIS_Engine.evaluate(FIS_Engine.COMB_FIS, inputs, chunk_size=len(inputs[0]))
+        for chunk_size, processes in [(1, 1), (7, 1), (333, 1), (100, 2), (250, None)]:
+            chunked = FIS_Engine.evaluate(FIS_Engine.COMB_FIS, inputs, chunk_size=chunk_size, processes=processes)
+            self.assertTrue(np.array_equal(chunked, whole), (chunk_size, processes))
+
+    def test_evaluate_incremental(self):
+        folder = tempfile.mkdtemp()
+        try:
+            sidecar_file = os.path.join(folder, "veg_fis.npz")
+            reach_ids = np.arange(1, 101)
+            inputs = veg_inputs(100, seed=4)
+            expected = FIS_Engine.evaluate(FIS_Engine.VEG_FIS, inputs)
+
+            out, num_evaluated, hit_rate = FIS_Engine.evaluate_incremental(FIS_Engine.VEG_FIS, reach_ids, inputs,
+                                                                           sidecar_file)
+            self.assertTrue(os.path.exists(sidecar_file))
+            self.assertEqual(num_evaluated, 100)
+            self.assertTrue(np.array_equal(out, expected))
+
+            # nothing changed, so the previous outputs are all reused
+            out, num_evaluated, hit_rate = FIS_Engine.evaluate_incremental(FIS_Engine.VEG_FIS, reach_ids, inputs,
+                                                                           sidecar_file)
+            self.assertEqual(num_evaluated, 0)
+            self.assertTrue(np.array_equal(out, expected))
+
+            # only the changed reaches, and a new one, are evaluated
+            inputs = [values.copy() for values in inputs]
+            inputs[0][[3, 50, 99]] = [0.5, 1.5, 3.5]
+            reach_ids = reach_ids.copy()
+            reach_ids[10] = 1000
+            out, num_evaluated, hit_rate = FIS_Engine.evaluate_incremental(FIS_Engine.VEG_FIS, reach_ids, inputs,
+                                                                           sidecar_file)
+            self.assertEqual(num_evaluated, 4)
+            self.assertTrue(np.array_equal(out, FIS_Engine.evaluate(FIS_Engine.VEG_FIS, inputs)))
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -------------------------------------------------------------------------------
+# Name:        Flow Routing Tests
+# Purpose:     Checks the D8 flow directions and flow accumulation on small hand-built DEMs, routed whole and in bands
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Depression_Filling
+import Flow_Routing
+
+
+NAN = np.nan
+
+
+class ArrayDEM:
+    """
+    A DEM held in an array, read like a RasterSampler
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, np.float64)
+        self.num_rows, self.num_cols = self.values.shape
+
+    def read_window(self, row_start, col_start, num_rows, num_cols):
+        return self.values[row_start:row_start + num_rows, col_start:col_start + num_cols].copy()
+
+
+def follow(directions, row, col):
+    """
+    Follows the flow directions from a cell until they leave the DEM or reach NoData
+    :return: The list of cells passed through, not counting the first
+    """
+    num_rows, num_cols = directions.shape
+    path = []
+    while True:
+        direction = directions[row, col]
+        row += Flow_Routing.ROW_OFFSET[direction]
+        col += Flow_Routing.COL_OFFSET[direction]
+        if not (0 <= row < num_rows and 0 <= col < num_cols) or directions[row, col] < 0:
+            return path
+        path.append((row, col))
+        if len(path) > directions.size:
+            raise AssertionError("The flow directions loop")
+
+
+class TestFlowRouting(unittest.TestCase):
+
+    def test_tilted_plane(self):
+        # falls to the east, so every cell flows east and the last column, which flows off the DEM, gathers each row
+        values = np.tile(np.arange(5, 0, -1, dtype=np.float64), (3, 1))
+        directions = Flow_Routing.flow_directions(values, 1.0, 1.0)
+        np.testing.assert_array_equal(Flow_Routing.direction_codes(directions, 'ESRI')[:, :4], np.full((3, 4), 1.0))
+        np.testing.assert_array_equal(Flow_Routing.direction_codes(directions, 'TAUDEM')[:, :4], np.full((3, 4), 1.0))
+        np.testing.assert_array_equal(Flow_Routing.accumulate_flow(directions), np.tile(np.arange(5.0), (3, 1)))
+
+    def test_flat_with_one_outlet(self):
+        # a flat walled in on every side but the gap on the right, which everything drains out of
+        values = [[9, 9, 9, 9, 9, 9],
+                  [9, 5, 5, 5, 5, 9],
+                  [9, 5, 5, 5, 5, 4],
+                  [9, 5, 5, 5, 5, 9],
+                  [9, 9, 9, 9, 9, 9]]
+        values = np.array(values, np.float64)
+        directions = Flow_Routing.flow_directions(values, 1.0, 1.0)
+        self.assertFalse(np.any(directions == Flow_Routing.NO_DIRECTION))
+        for row in range(5):
+            for col in range(6):
+                if (row, col) != (2, 5):
+                    self.assertEqual(follow(directions, row, col)[-1], (2, 5))
+        self.assertEqual(Flow_Routing.accumulate_flow(directions)[2, 5], values.size - 1)
+
+    def test_no_data(self):
+        values = [[3, 2, 1],
+                  [3, NAN, 1],
+                  [3, 2, 1]]
+        directions = Flow_Routing.flow_directions(np.array(values, np.float64), 1.0, 1.0)
+        self.assertEqual(directions[1, 1], -1)
+        accumulation = Flow_Routing.accumulate_flow(directions)
+        self.assertTrue(np.isnan(accumulation[1, 1]))
+        self.assertTrue(np.isnan(Flow_Routing.direction_codes(directions)[1, 1]))
+
+    def test_bands_match_whole(self):
+        random_state = np.random.RandomState(0)
+        for trial in range(30):
+            values = random_state.randint(0, 4, (11, 8)).astype(np.float64)
+            values[random_state.rand(11, 8) < 0.1] = NAN
+            filled = Depression_Filling.fill_depressions(values)
+            whole = Flow_Routing.flow_directions(filled, 2.0, 3.0)
+            accumulation = Flow_Routing.accumulate_flow(whole)
+            for block_rows in [1, 2, 3, 5, 11]:
+                banded = Flow_Routing.flow_directions_in_bands(
+                    Depression_Filling.BandedFill(ArrayDEM(values), 0.0, block_rows), 2.0, 3.0, block_rows)
+                np.testing.assert_array_equal(banded, whole)
+                np.testing.assert_array_equal(Flow_Routing.accumulate_flow(banded, block_rows=block_rows),
+                                              accumulation)
+
+    def test_accumulation_adds_up_every_cell(self):
+        # each cell's flow is added to every cell downstream of it, and to nothing else
+        random_state = np.random.RandomState(1)
+        for trial in range(30):
+            values = random_state.randint(0, 5, (9, 7)).astype(np.float64)
+            values[random_state.rand(9, 7) < 0.1] = NAN
+            filled = Depression_Filling.fill_depressions(values)
+            directions = Flow_Routing.flow_directions(filled, 1.0, 1.0)
+            weights = random_state.uniform(1, 2, filled.shape)
+
+            expected = np.where(np.isnan(filled), NAN, 0.0)
+            for row, col in zip(*np.nonzero(directions >= 0)):
+                for downstream in follow(directions, row, col):
+                    expected[downstream] += weights[row, col]
+            np.testing.assert_allclose(Flow_Routing.accumulate_flow(directions, weights), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -------------------------------------------------------------------------------
+# Name:        Spatial Index Tests
+# Purpose:     Checks the grid index over stream network segments against measuring every segment
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SpatialIndex
+
+
+def make_polylines(num_lines, vertices_per_line, seed=0):
+    """
+    Makes random walk polylines scattered over a 10 km square, like the reaches of a stream network
+    :param num_lines: The number of polylines
+    :param vertices_per_line: The number of vertices in each polyline
+    :param seed: Seed for the random number generator
+    :return: Arrays of the polyline each vertex belongs to, and the x and y coordinates of each vertex
+    """
+    random_state = np.random.RandomState(seed)
+    owners = np.repeat(np.arange(num_lines), vertices_per_line)
+    steps_x = random_state.normal(0, 30, (num_lines, vertices_per_line))
+    steps_y = random_state.normal(0, 30, (num_lines, vertices_per_line))
+    steps_x[:, 0] = random_state.uniform(0, 10000, num_lines)
+    steps_y[:, 0] = random_state.uniform(0, 10000, num_lines)
+    return owners, np.cumsum(steps_x, axis=1).ravel(), np.cumsum(steps_y, axis=1).ravel()
+
+
+def brute_force_nearest(index, x, y, max_distance):
+    """
+    Finds the nearest polyline to each point by measuring the distance to every segment
+    :return: Arrays of the nearest distance to each point (inf if none are within max_distance) and the set of
+        polylines at that distance
+    """
+    nearest_distance = np.full(len(x), np.inf)
+    nearest_owners = []
+    for i in range(len(x)):
+        distances = SpatialIndex.point_segment_distance(x[i], y[i], index.x0, index.y0, index.x1, index.y1)
+        closest = distances.min()
+        if closest <= max_distance:
+            nearest_distance[i] = closest
+            nearest_owners.append(set(index.owners[distances == closest]))
+        else:
+            nearest_owners.append(set([-1]))
+    return nearest_distance, nearest_owners
+
+
+def brute_force_owners_in_box(index, x_min, y_min, x_max, y_max):
+    """
+    Finds the polylines with a segment whose bounding box overlaps a box by checking every segment
+    :return: Array of the indices of the polylines, without repeats
+    """
+    overlaps = ((np.fmin(index.x0, index.x1) <= x_max) & (np.fmax(index.x0, index.x1) >= x_min) &
+                (np.fmin(index.y0, index.y1) <= y_max) & (np.fmax(index.y0, index.y1) >= y_min))
+    return np.unique(index.owners[overlaps])
+
+
+class SegmentIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.owners, self.x, self.y = make_polylines(400, 6)
+        self.index = SpatialIndex.SegmentIndex.from_polylines(self.owners, self.x, self.y)
+
+    def test_nearest_matches_brute_force(self):
+        random_state = np.random.RandomState(1)
+        x = random_state.uniform(-500, 10500, 5000)
+        y = random_state.uniform(-500, 10500, 5000)
+        for max_distance in [25.0, 300.0]:
+            owners, distances = self.index.nearest(x, y, max_distance)
+            expected_distances, expected_owners = brute_force_nearest(self.index, x, y, max_distance)
+            np.testing.assert_array_equal(distances, expected_distances)
+            for i in range(len(x)):
+                self.assertIn(owners[i], expected_owners[i])
+            self.assertTrue((owners >= 0).any() and (owners == -1).any())
+
+    def test_owners_in_box_matches_brute_force(self):
+        random_state = np.random.RandomState(2)
+        for trial in range(300):
+            x_min, x_max = np.sort(random_state.uniform(-1000, 11000, 2))
+            y_min, y_max = np.sort(random_state.uniform(-1000, 11000, 2))
+            # every fifth box is small, so it is looked up cell by cell rather than by filtering every segment
+            if trial % 5 == 0:
+                x_max = x_min + 50
+                y_max = y_min + 50
+            np.testing.assert_array_equal(self.index.owners_in_box(x_min, y_min, x_max, y_max),
+                                          brute_force_owners_in_box(self.index, x_min, y_min, x_max, y_max))
+
+    def test_extent_clipping(self):
+        # boxes far larger than the network are clipped to its extent rather than looked up over billions of cells
+        np.testing.assert_array_equal(self.index.owners_in_box(-1e15, -1e15, 1e15, 1e15), np.arange(400))
+        np.testing.assert_array_equal(self.index.owners_in_box(-1e12, -1e12, 5000, 1e12),
+                                      brute_force_owners_in_box(self.index, -1e12, -1e12, 5000, 1e12))
+        # boxes outside the network, or inside out, find nothing
+        self.assertEqual(self.index.owners_in_box(1e6, 1e6, 2e6, 2e6).size, 0)
+        self.assertEqual(self.index.owners_in_box(-2e6, -2e6, -1e6, -1e6).size, 0)
+        self.assertEqual(self.index.owners_in_box(6000, 6000, 5000, 5000).size, 0)
+
+    def test_multipart_polylines(self):
+        # two polylines of two parts each. The gap between the parts of polyline 0 crosses the middle of the square
+        owners = np.array([0, 0, 0, 0, 1, 1, 1, 1])
+        parts = np.array([0, 0, 1, 1, 0, 0, 1, 1])
+        x = np.array([0.0, 10.0, 90.0, 100.0, 0.0, 0.0, 100.0, 100.0])
+        y = np.array([0.0, 0.0, 0.0, 0.0, 100.0, 90.0, 90.0, 100.0])
+        index = SpatialIndex.SegmentIndex.from_polylines(owners, x, y, vertex_parts=parts)
+        self.assertEqual(len(index.x0), 4)
+        nearest_owners, distances = index.nearest(np.array([50.0, 50.0]), np.array([1.0, 89.0]), 30.0)
+        # without parts, polyline 0 would have a segment from (10, 0) to (90, 0), one unit from the first point
+        self.assertEqual(nearest_owners[0], -1)
+        self.assertEqual(distances[0], np.inf)
+        self.assertEqual(nearest_owners[1], -1)
+        np.testing.assert_array_equal(index.owners_in_box(40, -5, 60, 95), [])
+        np.testing.assert_array_equal(index.owners_in_box(95, -5, 105, 95), [0, 1])
+
+        joined = SpatialIndex.SegmentIndex.from_polylines(owners, x, y)
+        self.assertEqual(len(joined.x0), 6)
+        nearest_owners, distances = joined.nearest(np.array([50.0, 50.0]), np.array([1.0, 89.0]), 30.0)
+        np.testing.assert_array_equal(nearest_owners, [0, 1])
+        np.testing.assert_allclose(distances, [1.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+# -------------------------------------------------------------------------------
+# Name:        Zone Cells Tests
+# Purpose:     Checks the rasterization of buffer polygons, and the zonal statistics and histograms over their cells,
+#              against testing and summarizing every cell on its own
+#
+# Author:      BRAT Development Team
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Zone_Cells
+
+
+class Point:
+    """
+    A polygon vertex, with the coordinate names of an arcpy Point
+    """
+
+    def __init__(self, x, y):
+        self.X = x
+        self.Y = y
+
+
+class Extent:
+    """
+    A polygon's bounding box, with the names of an arcpy Extent
+    """
+
+    def __init__(self, x, y):
+        self.XMin = min(x)
+        self.YMin = min(y)
+        self.XMax = max(x)
+        self.YMax = max(y)
+
+
+class Polygon:
+    """
+    A single part polygon laid out like an arcpy Polygon: the exterior ring, then each interior ring after a None
+    """
+
+    def __init__(self, rings):
+        """
+        :param rings: A list of rings, the exterior first, each a list of (x, y)
+        """
+        self.part = []
+        for ring in rings:
+            if len(self.part) > 0:
+                self.part.append(None)
+            self.part.extend(Point(x, y) for x, y in ring)
+        self.extent = Extent([x for x, y in rings[0]], [y for x, y in rings[0]])
+        self.labelPoint = Point(np.mean([x for x, y in rings[0]]), np.mean([y for x, y in rings[0]]))
+
+    def __iter__(self):
+        return iter([self.part])
+
+
+class Grid:
+    """
+    A raster grid with the attributes and find_cells of a RasterSampler
+    """
+
+    def __init__(self, x_min, y_max, cell_size, num_rows, num_cols):
+        self.x_min = x_min
+        self.y_max = y_max
+        self.cell_width = cell_size
+        self.cell_height = cell_size
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+
+    def find_cells(self, x, y):
+        rows = np.floor((self.y_max - y) / self.cell_height).astype(np.int64)
+        cols = np.floor((x - self.x_min) / self.cell_width).astype(np.int64)
+        return rows, cols, (rows >= 0) & (rows < self.num_rows) & (cols >= 0) & (cols < self.num_cols)
+
+    def centers(self):
+        """
+        :return: 2D arrays of the x and y of each cell center
+        """
+        rows, cols = np.mgrid[0:self.num_rows, 0:self.num_cols]
+        return self.x_min + (cols + 0.5) * self.cell_width, self.y_max - (rows + 0.5) * self.cell_height
+
+
+def even_odd_inside(rings, x, y):
+    """
+    Tests whether each point is inside a polygon one point at a time, by counting the edges a ray to its right crosses
+    :param rings: A list of rings, each a list of (x, y)
+    :param x: 2D array of the x of each point
+    :param y: 2D array of the y of each point
+    :return: 2D boolean array of whether each point is inside
+    """
+    inside = np.zeros(x.shape, dtype=bool)
+    for index in np.ndindex(x.shape):
+        crossings = 0
+        for ring in rings:
+            for i in range(len(ring)):
+                (ax, ay), (bx, by) = ring[i], ring[(i + 1) % len(ring)]
+                if (ay > y[index]) != (by > y[index]):
+                    if ax + (y[index] - ay) * (bx - ax) / (by - ay) > x[index]:
+                        crossings += 1
+        inside[index] = crossings % 2 == 1
+    return inside
+
+
+def circle(center_x, center_y, radius, num_points=48):
+    """
+    :return: A ring approximating a circle, as a list of (x, y)
+    """
+    angles = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    return list(zip(center_x + radius * np.cos(angles), center_y + radius * np.sin(angles)))
+
+
+def zone_cells_of(polygons, grid, weighted=False):
+    """
+    Finds the ZoneCells of a list of polygons, one zone each, the way Zonal_Statistics.find_zone_cells does
+    :return: The ZoneCells
+    """
+    zones, rows, cols, weights = [], [], [], []
+    for i, polygon in enumerate(polygons):
+        polygon_rows, polygon_cols, polygon_weights = Zone_Cells.polygon_cells(polygon, grid, weighted)
+        zones.append(np.full(len(polygon_rows), i, dtype=np.int64))
+        rows.append(polygon_rows)
+        cols.append(polygon_cols)
+        weights.append(polygon_weights)
+    return Zone_Cells.ZoneCells(np.arange(len(polygons)), np.concatenate(zones), np.concatenate(rows),
+                                np.concatenate(cols), np.concatenate(weights))
+
+
+class ScanlineFillTest(unittest.TestCase):
+
+    def fill(self, rings, grid):
+        edges = Zone_Cells.polygon_edges(Polygon(rings))
+        return Zone_Cells.scanline_fill(edges[0], edges[1], edges[2], edges[3], grid.y_max, grid.x_min,
+                                        grid.cell_height, grid.cell_width, grid.num_rows, grid.num_cols)
+
+    def test_square(self):
+        grid = Grid(0.0, 5.0, 1.0, 5, 5)
+        expected = np.zeros((5, 5), dtype=bool)
+        expected[1:4, 1:4] = True
+        np.testing.assert_array_equal(self.fill([[(1, 1), (4, 1), (4, 4), (1, 4)]], grid), expected)
+
+    def test_hole(self):
+        grid = Grid(0.0, 6.0, 1.0, 6, 6)
+        rings = [[(0, 0), (6, 0), (6, 6), (0, 6)], [(2, 2), (2, 4), (4, 4), (4, 2)]]
+        expected = np.ones((6, 6), dtype=bool)
+        expected[2:4, 2:4] = False
+        np.testing.assert_array_equal(self.fill(rings, grid), expected)
+
+    def test_matches_point_in_polygon(self):
+        grid = Grid(-3.0, 47.0, 2.5, 40, 44)
+        x, y = grid.centers()
+        random_state = np.random.RandomState(0)
+        angles = np.sort(random_state.uniform(0, 2 * np.pi, 30))
+        radii = random_state.uniform(10, 45, 30)
+        star = list(zip(50 + radii * np.cos(angles), 0 + radii * np.sin(angles)))
+        for rings in [[circle(40, 20, 25)], [circle(40, 20, 25), circle(45, 25, 8)], [star]]:
+            np.testing.assert_array_equal(self.fill(rings, grid), even_odd_inside(rings, x, y))
+
+
+class PolygonCellsTest(unittest.TestCase):
+
+    def test_centers_inside(self):
+        grid = Grid(0.0, 100.0, 10.0, 10, 10)
+        x, y = grid.centers()
+        rings = [circle(52, 47, 31)]
+        rows, cols, weights = Zone_Cells.polygon_cells(Polygon(rings), grid)
+        inside = np.zeros((10, 10), dtype=bool)
+        inside[rows, cols] = True
+        np.testing.assert_array_equal(inside, even_odd_inside(rings, x, y))
+        np.testing.assert_array_equal(weights, 1)
+
+    def test_weighted_coverage(self):
+        # a square over the middle of a 3 by 3 block of cells covers half of the edge cells and a quarter of the corners
+        grid = Grid(0.0, 3.0, 1.0, 3, 3)
+        polygon = Polygon([[(0.5, 0.5), (2.5, 0.5), (2.5, 2.5), (0.5, 2.5)]])
+        rows, cols, weights = Zone_Cells.polygon_cells(polygon, grid, weighted=True)
+        coverage = np.zeros((3, 3))
+        coverage[rows, cols] = weights
+        np.testing.assert_array_equal(coverage, [[0.25, 0.5, 0.25], [0.5, 1, 0.5], [0.25, 0.5, 0.25]])
+
+        # the weights of a circle's cells add up to about its area, in cells
+        grid = Grid(0.0, 100.0, 5.0, 20, 20)
+        rows, cols, weights = Zone_Cells.polygon_cells(Polygon([circle(50, 50, 30, 96)]), grid, weighted=True)
+        self.assertAlmostEqual(weights.sum(), np.pi * 30 ** 2 / 25.0, delta=5)
+        self.assertTrue(((weights > 0) & (weights <= 1)).all())
+
+    def test_weighted_hole(self):
+        grid = Grid(0.0, 6.0, 1.0, 6, 6)
+        polygon = Polygon([[(0, 0), (6, 0), (6, 6), (0, 6)], [(1.5, 1.5), (1.5, 4.5), (4.5, 4.5), (4.5, 1.5)]])
+        rows, cols, weights = Zone_Cells.polygon_cells(polygon, grid, weighted=True)
+        coverage = np.zeros((6, 6))
+        coverage[rows, cols] = weights
+        self.assertAlmostEqual(coverage.sum(), 36 - 9)
+        self.assertEqual(coverage[3, 3], 0)
+        self.assertEqual(coverage[1, 1], 0.75)
+        self.assertEqual(coverage[1, 2], 0.5)
+
+    def test_small_polygon_gets_label_point_cell(self):
+        grid = Grid(0.0, 100.0, 10.0, 10, 10)
+        polygon = Polygon([[(41, 41), (43, 41), (43, 43), (41, 43)]])
+        rows, cols, weights = Zone_Cells.polygon_cells(polygon, grid)
+        np.testing.assert_array_equal(rows, [5])
+        np.testing.assert_array_equal(cols, [4])
+        np.testing.assert_array_equal(weights, [1])
+
+    def test_off_raster(self):
+        grid = Grid(0.0, 100.0, 10.0, 10, 10)
+        rows, cols, weights = Zone_Cells.polygon_cells(Polygon([circle(500, 500, 30)]), grid)
+        self.assertEqual(len(rows), 0)
+
+
+class ZoneCellsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = Grid(0.0, 200.0, 5.0, 40, 40)
+        self.x, self.y = self.grid.centers()
+        random_state = np.random.RandomState(1)
+        self.values = np.round(random_state.uniform(0, 10, (40, 40)), 1)
+        self.values[random_state.rand(40, 40) < 0.1] = np.nan
+        # the first two buffers overlap, like the buffers of neighbouring reaches, and the third has a hole
+        self.rings = [[circle(80, 100, 40)], [circle(120, 100, 40)],
+                      [circle(100, 100, 60), circle(100, 100, 30)]]
+        self.zone_cells = zone_cells_of([Polygon(rings) for rings in self.rings], self.grid)
+
+    def test_overlapping_zones_each_get_their_cells(self):
+        for zone, rings in enumerate(self.rings):
+            inside = even_odd_inside(rings, self.x, self.y)
+            self.assertEqual((self.zone_cells.zones == zone).sum(), inside.sum())
+        shared = even_odd_inside(self.rings[0], self.x, self.y) & even_odd_inside(self.rings[1], self.x, self.y)
+        self.assertGreater(shared.sum(), 0)
+
+    def test_summarize(self):
+        values = self.values[self.zone_cells.rows, self.zone_cells.cols]
+        for stat_type, function in [('MEAN', np.mean), ('MINIMUM', np.min), ('MAXIMUM', np.max)]:
+            expected = []
+            for rings in self.rings:
+                zone_values = self.values[even_odd_inside(rings, self.x, self.y)]
+                expected.append(function(zone_values[~np.isnan(zone_values)]))
+            np.testing.assert_allclose(self.zone_cells.summarize(values, stat_type), expected, rtol=1e-12)
+
+    def test_no_data(self):
+        # a zone whose cells are all NoData is NaN, and NoData is left out of the others
+        values = self.values[self.zone_cells.rows, self.zone_cells.cols].copy()
+        values[self.zone_cells.zones == 1] = np.nan
+        for stat_type in ['MEAN', 'MINIMUM', 'MAXIMUM']:
+            result = self.zone_cells.summarize(values, stat_type)
+            self.assertTrue(np.isnan(result[1]))
+            self.assertFalse(np.isnan(result[[0, 2]]).any())
+        self.assertTrue(np.isnan(self.zone_cells.summarize(np.full(len(values), np.nan), 'MINIMUM')).all())
+
+        raster_values, counts = self.zone_cells.histogram(values)
+        np.testing.assert_array_equal(counts[1], 0)
+        totals = self.zone_cells.totals()
+        self.assertEqual(totals[1], (self.zone_cells.zones == 1).sum())
+        self.assertTrue((counts.sum(axis=1) <= totals).all())
+
+    def test_weighted_mean(self):
+        zone_cells = zone_cells_of([Polygon([[(2.5, 192.5), (12.5, 192.5), (12.5, 200), (2.5, 200)]])], self.grid,
+                                   weighted=True)
+        values = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+        grid_values = np.full((40, 40), np.nan)
+        grid_values[:2, :3] = values
+        coverage = np.array([[0.5, 1, 0.5], [0.25, 0.5, 0.25]])
+        expected = (values * coverage).sum() / coverage.sum()
+        result = zone_cells.summarize(grid_values[zone_cells.rows, zone_cells.cols], 'MEAN')
+        np.testing.assert_allclose(result, [expected], rtol=1e-12)
+
+    def test_histogram(self):
+        classes = np.floor(self.values / 2.5)
+        raster_values, counts = self.zone_cells.histogram(classes[self.zone_cells.rows, self.zone_cells.cols])
+        np.testing.assert_array_equal(raster_values, [0, 1, 2, 3, 4])
+        for zone, rings in enumerate(self.rings):
+            zone_classes = classes[even_odd_inside(rings, self.x, self.y)]
+            np.testing.assert_array_equal(counts[zone], [(zone_classes == value).sum() for value in raster_values])
+
+        weighted = zone_cells_of([Polygon(rings) for rings in self.rings], self.grid, weighted=True)
+        raster_values, counts = weighted.histogram(classes[weighted.rows, weighted.cols])
+        for zone in range(len(self.rings)):
+            has_data = ~np.isnan(classes[weighted.rows, weighted.cols]) & (weighted.zones == zone)
+            self.assertAlmostEqual(counts[zone].sum(), weighted.weights[has_data].sum())
+        np.testing.assert_allclose(weighted.totals(), np.bincount(weighted.zones, weighted.weights))
+
+
+if __name__ == '__main__':
+    unittest.main()